@@ -0,0 +1,380 @@
+import functools
+import os
+import random
+import statistics
+
+from biometrics import get_backend
+import keystroke_scorer
+from card_secret import CARDS, encode_card_secret, stored_card_secret, verify_sequence
+from db_pool import DB
+from instrumentation import count, span
+from lockout import get_lockouts
+from login_session import LoginSession
+from passkey_registry import PasskeyExhausted, get_registry
+from password_hashing import get_hasher
+from typing_profile import get_profile_store
+from typing_store import encode_intervals
+
+# ----------------------
+# Headless authentication engine
+# ----------------------
+# One AuthFlow per login walks the steps in order:
+#   password (+ typing profile) -> code word -> card sequence + passkey -> biometric
+# Every step returns a StepResult; front-ends (GUI, terminal, server, tests)
+# only decide how to show it. Nothing here prints or opens dialogs.
+
+STEP_PASSWORD = "password"
+STEP_CODE_WORD = "code_word"
+STEP_CARDS = "cards"
+STEP_BIOMETRIC = "biometric"
+STEP_DONE = "done"
+STEP_FAILED = "failed"
+
+# StepResult.status values
+OK = "ok"               # step passed, flow moved on
+RETRY = "retry"         # wrong answer, same step may be tried again
+DENIED = "denied"       # flow is over (failed)
+LOCKED = "locked"       # temporarily locked / rate limited, see retry_after
+BANNED = "banned"       # 24-hour lock after too many card failures
+
+TYPING_TOLERANCE_WPM = 25
+BOT_STDDEV_MS = 8
+# "auto": keystroke-dynamics scorer when NumPy is installed, else the WPM check;
+# "keystroke" requires NumPy; "wpm" always uses the old +-25 wpm rule
+TYPING_CHECK = os.environ.get("TRISECURE_TYPING_CHECK", "auto")
+MAX_CODE_WORD_ATTEMPTS = 3
+MAX_BIOMETRIC_ATTEMPTS = 3
+
+
+class AuthStateError(Exception):
+    """A step was called out of order."""
+    pass
+
+
+class StepResult:
+    def __init__(self, status, message="", **data):
+        self.status = status
+        self.message = message
+        self.data = data
+
+    @property
+    def ok(self):
+        return self.status == OK
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["data"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __repr__(self):
+        return f"StepResult({self.status!r}, {self.message!r}, {self.data!r})"
+
+
+def compute_wpm(total_chars, duration_seconds):
+    if duration_seconds <= 0 or total_chars == 0:
+        return 0
+    words = total_chars / 5.0
+    minutes = duration_seconds / 60.0
+    wpm = words / minutes
+    return int(round(wpm))
+
+
+def generate_passkey_from_selection(selection, card_values, claim, db=DB):
+    """
+    selection: list of 7 card names in order; card_values: dict mapping the 9 cards to digits.
+    Each card digit x becomes (3x + 1) mod 10, then one random digit is inserted so the
+    8-digit passkey is unused; claim(passkey) stores it and raises sqlite3.IntegrityError
+    if the UNIQUE index refuses it (raises PasskeyExhausted if no variant is free).
+    """
+    with span("passkey.generate"):
+        passkey7 = "".join(str((3 * card_values[c] + 1) % 10) for c in selection)[:7]
+        return get_registry(db).reserve_unique(passkey7, claim)
+
+
+def passkey_abbrev(selection):
+    return "".join(c[0:2].lower() if c.lower().startswith("j") else c[0].lower() for c in selection)
+
+
+def _step(name):
+    """Times an AuthFlow step as span "auth.<name>" and counts its result status."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(self, *args, **kwargs):
+            with span("auth." + name) as sp:
+                result = fn(self, *args, **kwargs)
+                sp.set(status=result.status)
+            count("auth.results", step=name, status=result.status)
+            return result
+        return inner
+    return wrap
+
+
+class AuthFlow:
+    """State machine for one login attempt. Create with AuthEngine.start()."""
+    def __init__(self, engine, source=None):
+        self.engine = engine
+        self.source = source or engine.source
+        self.state = STEP_PASSWORD
+        self.user = None
+        self.code_word_attempts = 0
+        self.biometric_attempts = 0
+        self.card_values = None
+        self._typing_sample = None      # (intervals, wpm, profile), folded into the profile on success
+
+    def _expect(self, state):
+        if self.state != state:
+            raise AuthStateError(f"expected step {state!r}, flow is at {self.state!r}")
+
+    def _fail(self, message, status=DENIED, **data):
+        self.state = STEP_FAILED
+        self.finish()
+        return StepResult(status, message, **data)
+
+    @property
+    def username(self):
+        return self.user["username"] if self.user else None
+
+    @property
+    def done(self):
+        return self.state in (STEP_DONE, STEP_FAILED)
+
+    # --- step 0: password + typing profile ---
+    @_step(STEP_PASSWORD)
+    def submit_password(self, username, password, intervals=(), total_chars=None, duration=0.0):
+        self._expect(STEP_PASSWORD)
+        engine = self.engine
+        allowed, retry_after, reason = engine.lockouts.check(username, source=self.source)
+        if not allowed:
+            if reason == "banned":
+                return StepResult(BANNED, "You have reached the trying limit. Log in after 24 hours.",
+                                  retry_after=retry_after)
+            return StepResult(LOCKED, f"Too many attempts. Try again in {retry_after} seconds.",
+                              retry_after=retry_after)
+
+        user = LoginSession.authenticate(username, password, engine.db, engine.hasher)
+        if not user:
+            engine.lockouts.record_failure(username, source=self.source, lockable=False)
+            return StepResult(RETRY, "Invalid username or password.")
+
+        intervals = list(intervals)
+        if total_chars is None:
+            total_chars = len(username) + len(password)
+        wpm = compute_wpm(total_chars, duration)
+
+        stored_wpm = user["typing_wpm"]
+        if not stored_wpm:
+            # first login: record the typing profile (written when the flow ends)
+            user.stage(typing_wpm=wpm, typing_intervals=encode_intervals(intervals))
+            self._typing_sample = (intervals, wpm, None)
+            self.user = user
+            self.state = STEP_CODE_WORD
+            return StepResult(OK, f"Typing profile recorded ({wpm} wpm).", wpm=wpm, profile_recorded=True)
+
+        # rolling profile if there is one, else the first-login snapshot in the users row
+        profile = engine.profiles.load(username) if engine.update_profile else None
+        template = None
+        if engine.use_keystroke_scorer and len(intervals) >= 3:
+            if profile is not None and profile.length >= 3:
+                template = profile.template()
+            else:
+                template = keystroke_scorer.KeystrokeTemplate.from_stored(user["typing_intervals"])
+        if template is not None and len(template) >= 3:
+            rejected = self._check_rhythm(template, intervals, wpm)
+        else:
+            if profile is not None and profile.wpm:
+                stored_wpm = round(profile.wpm)
+            rejected = self._check_wpm(stored_wpm, intervals, wpm)
+        if rejected is not None:
+            return rejected
+
+        self._typing_sample = (intervals, wpm, profile)
+        self.user = user
+        self.state = STEP_CODE_WORD
+        return StepResult(OK, "Typing profile matched.", wpm=wpm, profile_recorded=False)
+
+    def _check_rhythm(self, template, intervals, wpm):
+        accepted, value, reason = keystroke_scorer.verdict(template, intervals, self.engine.keystroke_threshold)
+        if reason == "bot":
+            return StepResult(DENIED, "Keystroke timing looks artificial (bot-like).", wpm=wpm)
+        if not accepted:
+            return StepResult(DENIED, f"Typing rhythm does not match your profile (score {value:.2f}).",
+                              wpm=wpm, typing_score=value)
+        return None
+
+    def _check_wpm(self, stored_wpm, intervals, wpm):
+        try:
+            stored_wpm_val = int(stored_wpm)
+        except (TypeError, ValueError):
+            stored_wpm_val = 0
+        tol = self.engine.typing_tolerance
+        if not (stored_wpm_val - tol <= wpm <= stored_wpm_val + tol):
+            return StepResult(DENIED, f"Typing speed mismatch. Recorded: {stored_wpm_val} wpm, Now: {wpm} wpm.",
+                              wpm=wpm, stored_wpm=stored_wpm_val)
+        # bot detection: human keystroke intervals vary, scripted ones do not
+        if len(intervals) >= 3 and statistics.pstdev(intervals) < BOT_STDDEV_MS:
+            return StepResult(DENIED, "Keystroke timing looks artificial (bot-like).", wpm=wpm)
+        return None
+
+    # --- step 1: code word ---
+    @_step(STEP_CODE_WORD)
+    def submit_code_word(self, answer):
+        self._expect(STEP_CODE_WORD)
+        # checked against the row loaded at login; the KDF runs on the shared pool
+        hasher = self.engine.hasher
+        matches, rehash = hasher.verify_code_word(answer, self.user["code_word"])
+        if matches:
+            if rehash:
+                # legacy plaintext (or weaker hash): upgrade it with the rest of the flow's updates
+                self.user.stage(code_word=hasher.hash_code_word(answer))
+            self.state = STEP_CARDS
+            return StepResult(OK, "Security question passed.")
+        self.code_word_attempts += 1
+        left = self.engine.max_code_word_attempts - self.code_word_attempts
+        if left > 0:
+            return StepResult(RETRY, f"Wrong code word. Attempts left: {left}", attempts_left=left)
+        return self._fail("Wrong code word.")
+
+    # --- step 2: poker cards + passkey ---
+    @property
+    def needs_card_setup(self):
+        return not self.user.get("passkey")
+
+    def new_card_values(self):
+        """Random digit for each of the 9 cards, used by setup_cards()."""
+        self.card_values = dict(zip(CARDS, random.sample(range(10), 9)))
+        return self.card_values
+
+    @_step("card_setup")
+    def setup_cards(self, selection):
+        """First-time setup: returns OK with passkey/abbrev, or RETRY if the selection can't be used."""
+        self._expect(STEP_CARDS)
+        if not self.needs_card_setup:
+            raise AuthStateError("user already has a passkey")
+        if len(selection) != 7 or len(set(selection)) != 7 or any(c not in CARDS for c in selection):
+            return StepResult(RETRY, "Please select exactly 7 distinct cards in sequence.")
+        card_values = self.card_values or self.new_card_values()
+        card_secret = encode_card_secret(selection, card_values)
+
+        def claim(passkey):
+            # saved immediately: the user is about to see the passkey
+            self.user.save(passkey=passkey, card_secret=card_secret)
+
+        try:
+            passkey = generate_passkey_from_selection(selection, card_values, claim, self.engine.db)
+        except PasskeyExhausted:
+            return StepResult(RETRY, "This card sequence cannot produce a unique passkey. Please pick a different sequence.")
+        self.state = STEP_BIOMETRIC
+        return StepResult(OK, "Passkey created.", passkey=passkey, abbrev=passkey_abbrev(selection),
+                          shown=f"{passkey}({passkey_abbrev(selection)})")
+
+    def lock_remaining(self):
+        return self.engine.lockouts.remaining(self.username)
+
+    @_step(STEP_CARDS)
+    def submit_cards(self, selection, passkey):
+        self._expect(STEP_CARDS)
+        lockouts = self.engine.lockouts
+        remaining = lockouts.remaining(self.username)
+        if remaining > 0:
+            return StepResult(LOCKED, f"Locked. Try again in {remaining} seconds.", retry_after=remaining)
+        secret = stored_card_secret(self.user)
+        stored_passkey = self.user.get("passkey") or ""
+        if verify_sequence(secret, selection) and (passkey or "").strip() == stored_passkey:
+            lockouts.record_success(self.username)
+            self.state = STEP_BIOMETRIC
+            return StepResult(OK, "Step 1 passed successfully!")
+        result = lockouts.record_failure(self.username, source=self.source)
+        if result["banned"]:
+            return self._fail("You have reached the trying limit. Log in after 24 hours.", BANNED)
+        if result["locked_for"]:
+            return StepResult(LOCKED, f"Locked for {result['locked_for']} seconds.",
+                              retry_after=result["locked_for"])
+        return StepResult(RETRY, "Incorrect sequence or passkey.")
+
+    # --- step 3: biometric ---
+    @property
+    def biometric_setup(self):
+        return not self.user["fingerprint_enabled"]
+
+    def check_biometric(self):
+        """Blocking backend call; safe to run on a worker thread, pass the result to submit_biometric()."""
+        return self.engine.biometric().verify(self.username)
+
+    def cancel_biometric(self):
+        """Abort a check_biometric() running on another thread; it returns False, which callers drop."""
+        self.engine.biometric().cancel()
+
+    @_step(STEP_BIOMETRIC)
+    def submit_biometric(self, verified=None):
+        self._expect(STEP_BIOMETRIC)
+        if verified is None:
+            verified = self.check_biometric()
+        self.biometric_attempts += 1
+        setup = self.biometric_setup
+        if verified:
+            if setup:
+                self.user.stage(fingerprint_enabled=1)
+            self.state = STEP_DONE
+            self.finish()
+            return StepResult(OK, "Touch ID activated successfully!" if setup else "Fingerprint verified.",
+                              activated=setup)
+        left = self.engine.max_biometric_attempts - self.biometric_attempts
+        if left > 0:
+            msg = "Touch ID failed." if setup else "Fingerprint mismatch."
+            return StepResult(RETRY, f"{msg} Attempts left: {left}", attempts_left=left)
+        if setup:
+            return self._fail("Touch ID failed. You can retry on your next login.")
+        return self._fail("Fingerprint mismatch. Maximum attempts reached. Access denied.")
+
+    def finish(self):
+        """
+        End of flow (passed, failed or abandoned): write everything staged in one UPDATE.
+        Only a fully passed login updates the rolling typing profile.
+        """
+        if self.user is not None:
+            self.user.flush()
+            if self.state == STEP_DONE and self._typing_sample is not None and self.engine.update_profile:
+                intervals, wpm, profile = self._typing_sample
+                self.engine.profiles.record(self.username, intervals, wpm, profile)
+        self._typing_sample = None
+
+
+class AuthEngine:
+    def __init__(self, db=DB, source="engine", lockouts=None, biometric_backend=None,
+                 typing_tolerance=TYPING_TOLERANCE_WPM, max_code_word_attempts=MAX_CODE_WORD_ATTEMPTS,
+                 max_biometric_attempts=MAX_BIOMETRIC_ATTEMPTS, typing_check=TYPING_CHECK,
+                 keystroke_threshold=keystroke_scorer.THRESHOLD, update_profile=True, hasher=None):
+        self.db = db
+        self.source = source
+        self.lockouts = lockouts or get_lockouts(db)
+        self._biometric_backend = biometric_backend
+        self.typing_tolerance = typing_tolerance
+        self.max_code_word_attempts = max_code_word_attempts
+        self.max_biometric_attempts = max_biometric_attempts
+        if typing_check == "keystroke" and not keystroke_scorer.HAVE_NUMPY:
+            raise RuntimeError("typing_check='keystroke' needs NumPy (pip install numpy)")
+        self.use_keystroke_scorer = typing_check != "wpm" and keystroke_scorer.HAVE_NUMPY
+        self.keystroke_threshold = keystroke_threshold
+        self.update_profile = update_profile
+        self.profiles = get_profile_store(db)
+        self.hasher = hasher or get_hasher()
+
+    def biometric(self):
+        return self._biometric_backend or get_backend()
+
+    def start(self, source=None):
+        """New flow; `source` overrides the rate-limit bucket (e.g. one per client address)."""
+        return AuthFlow(self, source)
+
+
+_engines = {}
+
+
+def get_engine(db=DB, source="engine"):
+    """Shared engine per (db, source); flows are cheap, create one per login with start()."""
+    key = (db, source)
+    engine = _engines.get(key)
+    if engine is None:
+        engine = _engines.setdefault(key, AuthEngine(db, source))
+    return engine
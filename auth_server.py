@@ -0,0 +1,354 @@
+"""
+HTTP/JSON server for the three-step login (python auth_server.py --port 8765).
+
+Every request and response body is JSON. After /login, send the session token
+back as "Authorization: Bearer <token>" (or a "token" field in the body).
+
+  POST /login       {"username", "password", "intervals": [ms, ...], "duration": s, "total_chars"?}
+  POST /code-word   {"answer"}
+  GET  /cards       -> card names and mode ("setup" or "verify")
+  POST /cards       {"selection": [7 card names], "passkey"}  (passkey only when verifying)
+  POST /biometric   {}  runs the configured biometric backend
+  GET  /session     -> current step / username
+  POST /logout
+  GET  /health
+
+Step replies carry "status" (ok/retry/denied/locked/banned), "message" and "step"
+(the step to call next). The HTTP code follows the status: 200, 401, 403, 429 (with
+Retry-After), or 403 for banned. When the worker queues are full the reply is
+503 with Retry-After: 1.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import secrets
+import sys
+import time
+
+from auth_engine import AuthEngine, AuthStateError, STEP_DONE, STEP_FAILED
+from card_secret import CARDS
+from db_pool import DB, AsyncDatabase
+from executors import DB_QUEUE, KDF, KDF_WORKERS, Overloaded, all_stats, configure
+from migrations import run_migrations
+
+log = logging.getLogger("trisecure.server")
+
+# ----------------------
+# Server settings
+# ----------------------
+HOST = os.environ.get("TRISECURE_SERVER_HOST", "127.0.0.1")
+PORT = int(os.environ.get("TRISECURE_SERVER_PORT", "8765"))
+WORKERS = int(os.environ.get("TRISECURE_SERVER_WORKERS", "8"))
+SESSION_TTL = int(os.environ.get("TRISECURE_SESSION_TTL", "600"))     # idle seconds
+MAX_BODY = 64 * 1024
+READ_TIMEOUT = 30
+
+HTTP_STATUS = {"ok": 200, "retry": 401, "denied": 403, "locked": 429, "banned": 403}
+REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found",
+           405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large",
+           429: "Too Many Requests", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class HttpError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+# ----------------------
+# Sessions: token -> AuthFlow
+# ----------------------
+class Session:
+    def __init__(self, flow, ttl):
+        self.flow = flow
+        self.ttl = ttl
+        self.lock = asyncio.Lock()      # one request at a time per flow
+        self.touch()
+
+    def touch(self):
+        self.expires_at = time.monotonic() + self.ttl
+
+
+class SessionStore:
+    def __init__(self, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self._sessions = {}
+
+    def create(self, flow):
+        token = secrets.token_urlsafe(32)
+        self._sessions[token] = Session(flow, self.ttl)
+        return token
+
+    def get(self, token):
+        session = self._sessions.get(token) if token else None
+        if session is None or session.expires_at <= time.monotonic():
+            self.drop(token)
+            raise HttpError(401, "Unknown or expired session token.")
+        session.touch()
+        return session
+
+    def drop(self, token):
+        return self._sessions.pop(token, None)
+
+    def purge(self):
+        """Remove idle sessions; returns their flows so the caller can finish() them."""
+        now = time.monotonic()
+        expired = [t for t, s in self._sessions.items() if s.expires_at <= now]
+        return [self._sessions.pop(token).flow for token in expired]
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+# ----------------------
+# Request handling
+# ----------------------
+class AuthServer:
+    def __init__(self, db=DB, workers=WORKERS, session_ttl=SESSION_TTL, engine=None, queue=DB_QUEUE):
+        self.db = AsyncDatabase(db, workers, queue)
+        self.engine = engine or AuthEngine(db, source="server")
+        self.sessions = SessionStore(session_ttl)
+        self.routes = {
+            ("POST", "/login"): self.login,
+            ("POST", "/code-word"): self.code_word,
+            ("GET", "/cards"): self.cards_info,
+            ("POST", "/cards"): self.cards,
+            ("POST", "/biometric"): self.biometric,
+            ("GET", "/session"): self.session_info,
+            ("POST", "/logout"): self.logout,
+            ("GET", "/health"): self.health,
+        }
+
+    # --- endpoints: each returns (http code, json dict) ---
+    def _step_reply(self, result, flow, token=None):
+        body = {"status": result.status, "message": result.message, "step": flow.state}
+        body.update(result.data)
+        if token:
+            body["token"] = token
+        return HTTP_STATUS.get(result.status, 200), body
+
+    async def login(self, request):
+        body = request["json"]
+        username, password = body.get("username"), body.get("password")
+        if not isinstance(username, str) or not isinstance(password, str):
+            raise HttpError(400, "username and password are required.")
+        try:
+            intervals = [int(i) for i in body.get("intervals") or []]
+            duration = float(body.get("duration") or 0.0)
+            total_chars = int(body["total_chars"]) if body.get("total_chars") is not None else None
+        except (TypeError, ValueError):
+            raise HttpError(400, "intervals, duration and total_chars must be numbers.")
+        flow = self.engine.start(source=f"server:{request['peer']}")
+        result = await self.db.run(flow.submit_password, username.strip(), password.strip(),
+                                   intervals=intervals, total_chars=total_chars, duration=duration)
+        token = self.sessions.create(flow) if result.ok else None
+        return self._step_reply(result, flow, token)
+
+    async def _with_flow(self, request, fn, *args):
+        token = request["token"]
+        session = self.sessions.get(token)
+        async with session.lock:
+            flow = session.flow
+            try:
+                result = await self.db.run(fn, flow, *args)
+            except AuthStateError as e:
+                raise HttpError(409, str(e))
+            if flow.state == STEP_FAILED:
+                self.sessions.drop(token)
+            return self._step_reply(result, flow)
+
+    async def code_word(self, request):
+        answer = request["json"].get("answer")
+        if not isinstance(answer, str):
+            raise HttpError(400, "answer is required.")
+        return await self._with_flow(request, lambda flow: flow.submit_code_word(answer))
+
+    async def cards_info(self, request):
+        flow = self.sessions.get(request["token"]).flow
+        if flow.user is None:
+            raise HttpError(409, "log in first")
+        return 200, {"cards": list(CARDS), "mode": "setup" if flow.needs_card_setup else "verify",
+                     "retry_after": await self.db.run(flow.lock_remaining), "step": flow.state}
+
+    async def cards(self, request):
+        body = request["json"]
+        selection = body.get("selection")
+        if not isinstance(selection, list) or not all(isinstance(c, str) for c in selection):
+            raise HttpError(400, "selection must be a list of card names.")
+        passkey = str(body.get("passkey") or "")
+
+        def submit(flow):
+            if flow.needs_card_setup:
+                flow.new_card_values()
+                return flow.setup_cards(selection)
+            return flow.submit_cards(selection, passkey)
+        return await self._with_flow(request, submit)
+
+    async def biometric(self, request):
+        # backend calls block (helper process / simulator latency), so they run off the loop too
+        return await self._with_flow(request, lambda flow: flow.submit_biometric())
+
+    async def session_info(self, request):
+        flow = self.sessions.get(request["token"]).flow
+        return 200, {"step": flow.state, "username": flow.username, "authenticated": flow.state == STEP_DONE}
+
+    async def logout(self, request):
+        session = self.sessions.drop(request["token"])
+        if session is not None:
+            await self._finish(session.flow)
+        return 200, {"status": "ok", "message": "Logged out."}
+
+    async def health(self, request):
+        return 200, {"status": "ok", "sessions": len(self.sessions), "workers": self.db.workers,
+                     "pool": self.db.pool.stats(), "executors": dict(all_stats(), db=self.db.executor.stats())}
+
+    # --- HTTP/1.1 plumbing (keep-alive, Content-Length bodies only) ---
+    async def _read_request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "Malformed request line.")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = headers.get("content-length") or "0"
+        if not (length.isascii() and length.isdigit()):
+            # also rejects "-1" and "+5"; the connection is closed since the body cannot be skipped
+            raise HttpError(400, "Invalid Content-Length.")
+        length = int(length)
+        if length > MAX_BODY:
+            raise HttpError(413, "Request body too large.")
+        raw = await reader.readexactly(length) if length else b""
+        try:
+            body = json.loads(raw) if raw else {}
+        except ValueError:
+            raise HttpError(400, "Body must be JSON.")
+        if not isinstance(body, dict):
+            raise HttpError(400, "Body must be a JSON object.")
+        token = body.get("token")
+        auth = headers.get("authorization", "")
+        if auth.lower().startswith("bearer "):
+            token = auth[7:].strip()
+        return {"method": method.upper(), "path": target.split("?", 1)[0], "headers": headers,
+                "json": body, "token": token}
+
+    async def _dispatch(self, request):
+        handler = self.routes.get((request["method"], request["path"]))
+        if handler is None:
+            if any(path == request["path"] for _, path in self.routes):
+                raise HttpError(405, "Method not allowed.")
+            raise HttpError(404, "Not found.")
+        return await handler(request)
+
+    def _write(self, writer, code, body, keep_alive):
+        payload = json.dumps(body).encode()
+        head = [f"HTTP/1.1 {code} {REASONS.get(code, 'OK')}",
+                "Content-Type: application/json",
+                f"Content-Length: {len(payload)}",
+                "Connection: " + ("keep-alive" if keep_alive else "close")]
+        if code == 429 and body.get("retry_after"):
+            head.append(f"Retry-After: {body['retry_after']}")
+        elif code == 503:
+            head.append("Retry-After: 1")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + payload)
+
+    async def handle_client(self, reader, writer):
+        peer = (writer.get_extra_info("peername") or ("?",))[0]
+        try:
+            while True:
+                keep_alive = False
+                request = None
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), READ_TIMEOUT)
+                    if request is None:
+                        break
+                    request["peer"] = peer
+                    keep_alive = request["headers"].get("connection", "").lower() != "close"
+                    code, body = await self._dispatch(request)
+                except HttpError as e:
+                    code, body = e.code, {"status": "error", "message": e.message}
+                except Overloaded:
+                    code, body = 503, {"status": "busy", "message": "Server busy, retry shortly."}
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except Exception:
+                    # details go to the log only, never to the client
+                    where = f"{request['method']} {request['path']}" if request else "request"
+                    log.exception("unhandled error in %s from %s", where, peer)
+                    code, body = 500, {"status": "error", "message": "Internal error."}
+                self._write(writer, code, body, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _purge_loop(self):
+        while True:
+            await asyncio.sleep(min(60, self.sessions.ttl))
+            for flow in self.sessions.purge():
+                await self._finish(flow)
+
+    async def _finish(self, flow):
+        # a dropped session must still be written back, so wait out a full queue
+        while True:
+            try:
+                return await self.db.run(flow.finish)
+            except Overloaded:
+                await asyncio.sleep(0.05)
+
+    async def serve(self, host=HOST, port=PORT, ready=None):
+        server = await asyncio.start_server(self.handle_client, host, port)
+        purger = asyncio.create_task(self._purge_loop())
+        if ready is not None:
+            ready(server)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            purger.cancel()
+            self.db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the TriSecure login flow as an HTTP/JSON service.")
+    parser.add_argument("--db", default=DB, help="SQLite database file (default: users.db)")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="threads running DB/biometric work")
+    parser.add_argument("--queue", type=int, default=DB_QUEUE, help="requests waiting for a DB thread before 503")
+    parser.add_argument("--kdf-workers", type=int, default=KDF_WORKERS, help="processes for password hashing")
+    parser.add_argument("--session-ttl", type=int, default=SESSION_TTL, help="idle seconds before a token expires")
+    args = parser.parse_args(argv)
+
+    run_migrations(args.db)
+    configure(KDF, workers=args.kdf_workers)
+    server = AuthServer(args.db, workers=args.workers, session_ttl=args.session_ttl, queue=args.queue)
+    server.engine.hasher.warm_up()    # calibrate the password hash cost before accepting logins
+
+    def ready(srv):
+        for sock in srv.sockets:
+            print(f"TriSecure auth server listening on {sock.getsockname()}", flush=True)
+    try:
+        asyncio.run(server.serve(args.host, args.port, ready))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
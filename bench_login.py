@@ -0,0 +1,277 @@
+"""
+Login throughput benchmark.
+
+Seeds a database with N synthetic users through the bulk registration path
+(bulk_import.import_users), then drives the full login flow headlessly with
+AuthEngine. The flow covers password + typing profile, code word, card
+sequence + passkey, and a simulated biometric. It reports p50/p95/p99 per step
+and logins/sec for every processes x threads combination.
+
+  python bench_login.py --users 10000 --logins 5000 --threads 1,4,8 --processes 1,2 --output bench.json
+
+Seeding is skipped for users that already exist, so re-runs against the same
+--db only pay for the logins.
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from auth_engine import AuthEngine
+from biometrics import LatencyBackend, SimulatedBackend
+from bulk_import import import_users
+from card_secret import CARDS, encode_card_secret
+from db_pool import get_pool
+from executors import all_stats
+from instrumentation import histogram
+from password_hashing import ALGORITHM, MIN_COST, Hasher
+from typing_profile import seed_typing_profiles
+from typing_store import encode_intervals
+
+BENCH_DB = "bench_users.db"
+STEPS = ("password", "code_word", "cards", "biometric", "total")
+TYPING_WPM = 40
+UPDATE_BATCH = 50_000
+# seeded hashes use the cheapest cost so 1M users seed in minutes; --kdf-cost 0 uses the calibrated one
+KDF_COST = MIN_COST[ALGORITHM]
+
+
+# ----------------------
+# Synthetic users (everything derived from the index, so workers need no shared state)
+# ----------------------
+def synthetic_user(i):
+    rng = random.Random(i)
+    selection = rng.sample(CARDS, 7)
+    card_values = dict(zip(CARDS, rng.sample(range(10), 9)))
+    return {
+        "first_name": "Bench",
+        "last_name": f"User{i}",
+        "dob": f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(1950, 2005)}",
+        "phone": f"01{rng.choice('3456789')}{i % 10**8:08d}",
+        "code_word": f"word{i}",
+        "username": f"bench{i:07d}",
+        "password": f"pw-{i}-{rng.getrandbits(32):08x}",
+        "selection": selection,
+        "card_values": card_values,
+        # unique by construction (the card math is covered by the setup path, not benchmarked)
+        "passkey": f"{i % 10**8:08d}",
+    }
+
+
+def typing_sample(user, rng):
+    """Intervals (ms) and duration that match the seeded TYPING_WPM profile, with human-like jitter."""
+    chars = len(user["username"]) + len(user["password"])
+    duration = chars / 5.0 / TYPING_WPM * 60.0
+    mean_ms = duration * 1000 / max(1, chars - 2)
+    intervals = [int(rng.gauss(mean_ms, mean_ms * 0.15)) for _ in range(chars - 2)]
+    return intervals, chars, duration
+
+
+def seed_users(db, count, hasher=None):
+    """Register users 0..count-1 (skipping existing ones) and give them a complete profile."""
+    # leased for seeding only, so the main thread does not keep a slot the login threads need
+    with get_pool(db).leased() as conn:
+        return _seed(conn, db, count, hasher)
+
+
+def _seed(conn, db, count, hasher):
+    try:
+        existing = conn.execute("SELECT COUNT(*) FROM users WHERE username LIKE 'bench%'").fetchone()[0]
+    except Exception:
+        existing = 0
+    report = {"requested": count, "existing": existing, "registered": 0, "seconds": 0.0}
+    if existing >= count:
+        return report
+    started = time.perf_counter()
+    users = (synthetic_user(i) for i in range(existing, count))
+    fields = ("first_name", "last_name", "dob", "phone", "code_word", "username", "password")
+    imported = import_users(({f: u[f] for f in fields} for u in users), db=db, hasher=hasher)
+    report["registered"] = imported["inserted"]
+
+    # the state a user has after their first full login (typing profile, cards, Touch ID)
+    rng = random.Random(0)
+    batch = []
+    sql = """UPDATE users SET typing_wpm=?, typing_intervals=?, passkey=?, card_secret=?, fingerprint_enabled=1
+             WHERE username=?"""
+    for i in range(existing, count):
+        user = synthetic_user(i)
+        intervals, _, _ = typing_sample(user, rng)
+        batch.append((TYPING_WPM, encode_intervals(intervals), user["passkey"],
+                      encode_card_secret(user["selection"], user["card_values"]), user["username"]))
+        if len(batch) >= UPDATE_BATCH:
+            with conn:
+                conn.executemany(sql, batch)
+            batch.clear()
+    if batch:
+        with conn:
+            conn.executemany(sql, batch)
+    with conn:
+        seed_typing_profiles(conn)
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+# ----------------------
+# Login driver
+# ----------------------
+def login_once(engine, user, rng):
+    """One complete login; returns {step: seconds} or raises if any step fails."""
+    timings = {}
+    flow = engine.start()
+    intervals, chars, duration = typing_sample(user, rng)
+    steps = (
+        ("password", lambda: flow.submit_password(user["username"], user["password"], intervals, chars, duration)),
+        ("code_word", lambda: flow.submit_code_word(user["code_word"])),
+        ("cards", lambda: flow.submit_cards(user["selection"], user["passkey"])),
+        ("biometric", lambda: flow.submit_biometric()),
+    )
+    begin = time.perf_counter()
+    for name, step in steps:
+        started = time.perf_counter()
+        result = step()
+        timings[name] = time.perf_counter() - started
+        if not result.ok:
+            flow.finish()
+            raise RuntimeError(f"{user['username']} failed at {name}: {result.message}")
+    timings["total"] = time.perf_counter() - begin
+    return timings
+
+
+def run_worker(db, indices, threads, biometric_latency_ms, pool_size, kdf_cost=KDF_COST):
+    """Runs in each benchmark process: logs in every index using `threads` threads."""
+    get_pool(db, size=pool_size)
+    backend = SimulatedBackend(results=["SUCCESS"], deny=[])
+    if biometric_latency_ms:
+        backend = LatencyBackend(backend, biometric_latency_ms)
+    # same cost as the seeded hashes, otherwise every first login would rehash
+    hasher = Hasher(cost=kdf_cost or None)
+    engine = AuthEngine(db, source=f"bench-{os.getpid()}", biometric_backend=backend, hasher=hasher)
+    samples = {step: [] for step in STEPS}
+    errors = []
+
+    def work(chunk, seed):
+        rng = random.Random(seed)
+        out = []
+        for i in chunk:
+            try:
+                out.append(login_once(engine, synthetic_user(i), rng))
+            except Exception as e:
+                errors.append(str(e))
+        return out
+
+    chunks = [indices[t::threads] for t in range(threads)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for timings_list in pool.map(work, chunks, range(threads)):
+            for timings in timings_list:
+                for step, seconds in timings.items():
+                    samples[step].append(seconds)
+    return samples, errors[:20], len(errors), time.perf_counter() - started
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    # nearest-rank
+    k = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(k, len(sorted_values)) - 1]
+
+
+def summarize(values):
+    values = sorted(values)
+    ms = lambda s: round(s * 1000, 3)
+    return {"count": len(values),
+            "mean_ms": ms(sum(values) / len(values)) if values else 0.0,
+            "p50_ms": ms(percentile(values, 50)),
+            "p95_ms": ms(percentile(values, 95)),
+            "p99_ms": ms(percentile(values, 99)),
+            "max_ms": ms(values[-1]) if values else 0.0}
+
+
+def run_benchmark(db, users, logins, processes, threads, biometric_latency_ms=None, seed=1, kdf_cost=KDF_COST):
+    rng = random.Random(seed)
+    indices = [rng.randrange(users) for _ in range(logins)]
+    pool_size = threads + 1     # every login thread plus this one
+    started = time.perf_counter()
+    if processes == 1:
+        results = [run_worker(db, indices, threads, biometric_latency_ms, pool_size, kdf_cost)]
+    else:
+        # spawn: children open their own SQLite connections instead of inheriting ours
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=processes, mp_context=ctx) as pool:
+            futures = [pool.submit(run_worker, db, indices[p::processes], threads, biometric_latency_ms, pool_size,
+                                   kdf_cost)
+                       for p in range(processes)]
+            results = [f.result() for f in futures]
+    wall = time.perf_counter() - started
+    # throughput over the slowest worker's login loop (process start-up excluded)
+    elapsed = max(r[3] for r in results)
+
+    samples = {step: [] for step in STEPS}
+    errors, error_count = [], 0
+    for worker_samples, worker_errors, worker_error_count, _ in results:
+        for step in STEPS:
+            samples[step].extend(worker_samples[step])
+        errors.extend(worker_errors)
+        error_count += worker_error_count
+    completed = len(samples["total"])
+    return {"processes": processes, "threads": threads, "logins": logins, "completed": completed,
+            "failed": error_count, "errors": errors[:5], "seconds": round(elapsed, 3), "wall_seconds": round(wall, 3),
+            "logins_per_sec": round(completed / elapsed, 1) if elapsed else 0.0,
+            "steps": {step: summarize(samples[step]) for step in STEPS}}
+
+
+def _int_list(text):
+    return [int(x) for x in str(text).split(",") if x.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the login flow against synthetic users.")
+    parser.add_argument("--db", default=BENCH_DB, help=f"SQLite database file (default: {BENCH_DB})")
+    parser.add_argument("--users", type=int, default=10_000, help="synthetic users to seed (e.g. 10000, 100000, 1000000)")
+    parser.add_argument("--logins", type=int, default=2_000, help="logins per run")
+    parser.add_argument("--threads", type=_int_list, default=[1, 4], help="comma-separated thread counts")
+    parser.add_argument("--processes", type=_int_list, default=[1], help="comma-separated process counts")
+    parser.add_argument("--biometric-latency-ms", help='simulated Touch ID delay, e.g. "50" or "20-80"')
+    parser.add_argument("--kdf-cost", type=int, default=KDF_COST,
+                        help=f"password hash cost for seeding and logins (default: {KDF_COST}; 0 = calibrated)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    report = {"db": args.db, "users": args.users, "python": sys.version.split()[0],
+              "started_at": int(time.time()), "runs": []}
+    get_pool(args.db, size=max(args.threads) + 1)
+    seed_hasher = Hasher(cost=args.kdf_cost or None)
+    report["seed"] = seed_users(args.db, args.users, seed_hasher)
+    report["kdf"] = {"algorithm": seed_hasher.algorithm, "cost": seed_hasher.cost}
+    for processes in args.processes:
+        for threads in args.threads:
+            run = run_benchmark(args.db, args.users, args.logins, processes, threads,
+                                args.biometric_latency_ms, args.seed, args.kdf_cost)
+            report["runs"].append(run)
+            print(f"processes={processes} threads={threads}: {run['logins_per_sec']} logins/s, "
+                  f"total p50={run['steps']['total']['p50_ms']}ms p99={run['steps']['total']['p99_ms']}ms",
+                  file=sys.stderr)
+
+    # with TRISECURE_TRACE=histogram the inner spans (DB, lockouts, biometric...) are included
+    # (single-process runs only: other processes keep their own histograms)
+    if histogram() is not None:
+        report["trace"] = histogram().snapshot()
+    # queue wait / run time per pool, for this process (seeding and single-process runs)
+    report["executors"] = all_stats()
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+    return 0 if all(run["failed"] == 0 for run in report["runs"]) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+import importlib
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from instrumentation import span
+
+# ----------------------
+# Pluggable biometric backends for step 3
+# ----------------------
+# Select with TRISECURE_BIOMETRIC_BACKEND (default "touchid"). Backends are
+# named "module:Class" and only imported when first used, so the macOS helper
+# code never loads on machines that run the simulator.
+BACKEND = os.environ.get("TRISECURE_BIOMETRIC_BACKEND", "touchid")
+BACKENDS = {
+    "touchid": "biometrics:TouchIDBackend",
+    "simulated": "biometrics:SimulatedBackend",
+    "latency": "biometrics:LatencyBackend",
+}
+LATENCY_SAMPLES = 1000
+
+
+class BiometricBackend:
+    """
+    Base class. Subclasses implement authenticate(username, reason) -> bool;
+    callers use verify(), which also records how long each check took.
+    cancel() (from another thread) makes a running check return False early,
+    where the backend can interrupt it.
+    """
+    name = "base"
+
+    def __init__(self):
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def authenticate(self, username, reason):
+        raise NotImplementedError
+
+    def verify(self, username, reason="Authenticate with Touch ID"):
+        started = time.perf_counter()
+        try:
+            with span("biometric.verify", backend=self.name):
+                return bool(self.authenticate(username, reason))
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+    def cancel(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class TouchIDBackend(BiometricBackend):
+    """macOS Touch ID through the long-lived helper process (touchid_helper.py)."""
+    name = "touchid"
+
+    def __init__(self, helper=None):
+        super().__init__()
+        if helper is None:
+            from touchid_helper import get_helper
+            helper = get_helper()
+        self.helper = helper
+
+    def authenticate(self, username, reason):
+        return self.helper.authenticate(reason) == "SUCCESS"
+
+    def cancel(self):
+        self.helper.cancel()
+
+    def close(self):
+        self.helper.close()
+
+
+class SimulatedBackend(BiometricBackend):
+    """
+    Deterministic stand-in: replies cycle through `results` (default all
+    success). Users listed in `deny` always fail.
+    Env: TRISECURE_BIOMETRIC_RESULTS="SUCCESS,FAILED", TRISECURE_BIOMETRIC_DENY="alice,bob".
+    """
+    name = "simulated"
+
+    def __init__(self, results=None, deny=None):
+        super().__init__()
+        if results is None:
+            results = os.environ.get("TRISECURE_BIOMETRIC_RESULTS", "SUCCESS").split(",")
+        if deny is None:
+            deny = os.environ.get("TRISECURE_BIOMETRIC_DENY", "").split(",")
+        self.results = [str(r).strip().upper() == "SUCCESS" for r in results if str(r).strip()] or [True]
+        self.deny = {d.strip() for d in deny if d.strip()}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def authenticate(self, username, reason):
+        if username in self.deny:
+            return False
+        with self._lock:
+            ok = self.results[self._count % len(self.results)]
+            self._count += 1
+        return ok
+
+
+class LatencyBackend(BiometricBackend):
+    """
+    Wraps another backend (default: simulated) and adds a delay before each
+    check, for load-testing step 3. Delay in ms, fixed ("50") or a uniform
+    range ("20-80"), seeded so runs are repeatable.
+    Env: TRISECURE_BIOMETRIC_LATENCY_MS, TRISECURE_BIOMETRIC_INNER.
+    """
+    name = "latency"
+
+    def __init__(self, inner=None, latency_ms=None, seed=0):
+        super().__init__()
+        if inner is None:
+            inner = load_backend(os.environ.get("TRISECURE_BIOMETRIC_INNER", "simulated"))
+        if latency_ms is None:
+            latency_ms = os.environ.get("TRISECURE_BIOMETRIC_LATENCY_MS", "50")
+        low, _, high = str(latency_ms).partition("-")
+        self.low_ms = float(low)
+        self.high_ms = float(high) if high else self.low_ms
+        self.inner = inner
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def authenticate(self, username, reason):
+        with self._lock:
+            delay = self._rng.uniform(self.low_ms, self.high_ms) / 1000.0
+        time.sleep(delay)
+        return self.inner.authenticate(username, reason)
+
+    def cancel(self):
+        self.inner.cancel()
+
+    def close(self):
+        self.inner.close()
+
+
+def load_backend(name, **options):
+    """Instantiate a backend by short name or "module:Class" path."""
+    target = BACKENDS.get(name, name)
+    module_name, _, class_name = target.partition(":")
+    if not class_name:
+        raise ValueError(f"unknown biometric backend: {name}")
+    cls = getattr(importlib.import_module(module_name), class_name)
+    return cls(**options)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """The configured backend, created on first use."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = load_backend(BACKEND)
+    return _backend
+
+
+def set_backend(backend):
+    """Swap the active backend (e.g. a simulator in tests or benchmarks)."""
+    global _backend
+    with _backend_lock:
+        old, _backend = _backend, backend
+    if old is not None and old is not backend:
+        old.close()
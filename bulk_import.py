@@ -0,0 +1,184 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+from db_pool import DB, get_pool
+from migrations import run_migrations
+from password_hashing import get_hasher, normalize_code_word
+from user_ids import get_id_generator
+from validators import validate_dob_str, validate_phone_str
+
+FIELDS = ("first_name", "last_name", "dob", "phone", "code_word", "username", "password")
+CODE_WORD_COLUMN = 5    # positions in an INSERT_SQL row
+USERNAME_COLUMN = 6
+PASSWORD_COLUMN = 7
+BATCH_SIZE = 50_000
+MAX_REPORTED_ERRORS = 100
+LOOKUP_CHUNK = 900      # usernames per "IN (...)" query, under SQLite's bound-parameter limit
+
+INSERT_SQL = """
+    INSERT OR IGNORE INTO users (
+        id, first_name, last_name, dob, phone, code_word, username, password, created_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+# ----------------------
+# Input readers (one dict per user)
+# ----------------------
+def read_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        for record in csv.DictReader(f):
+            yield record
+
+
+def read_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def read_records(path, fmt=None):
+    fmt = fmt or ("jsonl" if path.lower().endswith((".jsonl", ".ndjson")) else "csv")
+    if fmt == "jsonl":
+        return read_jsonl(path)
+    if fmt == "csv":
+        return read_csv(path)
+    raise ValueError(f"unsupported format: {fmt}")
+
+
+def clean_record(record):
+    """Strip fields and apply the registration rules. Returns (values_tuple, error)."""
+    values = [str(record.get(f) or "").strip() for f in FIELDS]
+    first_name, last_name, dob, phone, code_word, username, password = values
+    if not username or not password:
+        return None, "Username and password cannot be empty."
+    if not first_name or not last_name:
+        return None, "First and last name are required."
+    ok, msg = validate_dob_str(dob)
+    if not ok:
+        return None, msg
+    ok, msg = validate_phone_str(phone)
+    if not ok:
+        return None, msg
+    return tuple(values), None
+
+
+# ----------------------
+# In-memory ID allocation
+# ----------------------
+class IdAllocator:
+    """
+    Takes IDs from the shared generator, skipping any that clash with IDs
+    already in the DB (old random IDs), checked in memory.
+    """
+    def __init__(self, existing_ids, generator):
+        self.taken = set(existing_ids)
+        self.generator = generator
+
+    def next_id(self):
+        while True:
+            user_id = self.generator.next_id()
+            if user_id not in self.taken:
+                return user_id
+
+
+def existing_usernames(conn, usernames):
+    """The subset of `usernames` already in the users table."""
+    usernames = list(usernames)
+    found = set()
+    for i in range(0, len(usernames), LOOKUP_CHUNK):
+        chunk = usernames[i:i + LOOKUP_CHUNK]
+        marks = ",".join("?" * len(chunk))
+        found.update(row[0] for row in conn.execute(f"SELECT username FROM users WHERE username IN ({marks})", chunk))
+    return found
+
+
+def import_users(records, db=DB, batch_size=BATCH_SIZE, dry_run=False, hasher=None):
+    """
+    Validate and insert users in large executemany() transactions.
+    Usernames already in the DB (or repeated in the input) are skipped.
+    Passwords and (normalized) code words are hashed a batch at a time across
+    the hasher's worker processes.
+    Returns a report dict with counts and the first few validation errors.
+    """
+    run_migrations(db)
+    hasher = hasher or get_hasher()
+    conn = get_pool(db).acquire()
+    allocator = IdAllocator((row[0] for row in conn.execute("SELECT id FROM users")), get_id_generator(db))
+    seen_usernames = set()
+    report = {"read": 0, "inserted": 0, "invalid": 0, "duplicates": 0, "errors": [], "seconds": 0.0}
+    started = time.perf_counter()
+    now = int(time.time())
+    batch = []
+
+    def flush():
+        if not batch:
+            return
+        if not dry_run:
+            secrets = []
+            for row in batch:
+                secrets += (normalize_code_word(row[CODE_WORD_COLUMN]), row[PASSWORD_COLUMN])
+            hashes = hasher.hash_many(secrets)
+            for i, row in enumerate(batch):
+                row = list(row)
+                row[CODE_WORD_COLUMN], row[PASSWORD_COLUMN] = hashes[2 * i], hashes[2 * i + 1]
+                batch[i] = tuple(row)
+            before = conn.total_changes
+            with conn:
+                conn.executemany(INSERT_SQL, batch)
+            inserted = conn.total_changes - before
+        else:
+            # nothing is written, so ask the DB which usernames INSERT OR IGNORE would skip
+            inserted = len(batch) - len(existing_usernames(conn, (row[USERNAME_COLUMN] for row in batch)))
+        report["inserted"] += inserted
+        report["duplicates"] += len(batch) - inserted
+        batch.clear()
+
+    for line_no, record in enumerate(records, start=1):
+        report["read"] += 1
+        values, error = clean_record(record)
+        if error:
+            report["invalid"] += 1
+            if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                report["errors"].append({"record": line_no, "error": error})
+            continue
+        username = values[5]
+        if username in seen_usernames:
+            report["duplicates"] += 1
+            continue
+        seen_usernames.add(username)
+        batch.append((allocator.next_id(),) + values + (now,))
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import users from CSV or JSONL.")
+    parser.add_argument("path", help="CSV (with header) or JSONL file of users")
+    parser.add_argument("--db", default=DB, help="SQLite database file (default: users.db)")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="input format (default: from extension)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="validate only, do not insert")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.path):
+        print(f"File not found: {args.path}")
+        return 1
+    report = import_users(read_records(args.path, args.format), db=args.db,
+                          batch_size=args.batch_size, dry_run=args.dry_run)
+    print(json.dumps(report, indent=2))
+    return 0 if report["invalid"] == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
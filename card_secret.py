@@ -0,0 +1,75 @@
+import hmac
+
+# ----------------------
+# Poker-card secret stored as a fixed-width blob (users.card_secret)
+# ----------------------
+#   byte 0      format (1)
+#   bytes 1-7   the 7 selected cards, as indices into CARDS, in order
+#   bytes 8-16  the digit assigned to each of the 9 CARDS at setup (0xFF = unknown)
+CARDS = ["Spade", "Heart", "Diamond", "Club", "Ace", "King", "Queen", "Jack", "Joker"]
+CARD_INDEX = {name.lower(): i for i, name in enumerate(CARDS)}
+FORMAT_V1 = 1
+SEQUENCE_LEN = 7
+UNKNOWN = 0xFF
+BLOB_LEN = 1 + SEQUENCE_LEN + len(CARDS)
+
+
+def sequence_key(selection):
+    """7 card names -> the 7 index bytes stored in the blob (unknown names never match)."""
+    return bytes(CARD_INDEX.get(str(name).strip().lower(), UNKNOWN) for name in selection)
+
+
+def encode_card_secret(selection, card_values):
+    if len(selection) != SEQUENCE_LEN:
+        raise ValueError(f"expected {SEQUENCE_LEN} cards, got {len(selection)}")
+    values = bytes(card_values.get(name, UNKNOWN) for name in CARDS)
+    return bytes([FORMAT_V1]) + sequence_key(selection) + values
+
+
+def verify_sequence(blob, selection):
+    """Compare an attempted selection against the stored blob (constant time, no parsing)."""
+    if not blob or len(blob) != BLOB_LEN or len(selection) != SEQUENCE_LEN:
+        return False
+    return hmac.compare_digest(bytes(blob[1:1 + SEQUENCE_LEN]), sequence_key(selection))
+
+
+def decode_card_secret(blob):
+    """Return (sequence_names, card_values_dict) for display or export."""
+    if not blob:
+        return [], {}
+    blob = bytes(blob)
+    if blob[0] != FORMAT_V1 or len(blob) != BLOB_LEN:
+        raise ValueError("unknown card_secret format")
+    sequence = [CARDS[i] for i in blob[1:1 + SEQUENCE_LEN] if i < len(CARDS)]
+    values = {name: v for name, v in zip(CARDS, blob[1 + SEQUENCE_LEN:]) if v != UNKNOWN}
+    return sequence, values
+
+
+def card_secret_from_text(field_text):
+    """Convert the old "CardA,CardB,... | CardX:val, ..." card_sequence text, or None if unusable."""
+    if not field_text:
+        return None
+    if " | " in field_text:
+        seq_part, value_part = field_text.split(" | ", 1)
+    else:
+        seq_part, value_part = field_text, ""
+    selection = [s.strip() for s in seq_part.split(",") if s.strip()][:SEQUENCE_LEN]
+    if len(selection) != SEQUENCE_LEN:
+        return None
+    values = {}
+    for item in value_part.split(","):
+        if ":" in item:
+            k, v = item.split(":", 1)
+            try:
+                values[k.strip()] = int(v.strip())
+            except ValueError:
+                pass
+    return encode_card_secret(selection, values)
+
+
+def stored_card_secret(user):
+    """The user's card_secret blob, falling back to the old text column for unmigrated rows."""
+    blob = user.get("card_secret") if hasattr(user, "get") else user["card_secret"]
+    if blob:
+        return blob
+    return card_secret_from_text(user["card_sequence"])
@@ -0,0 +1,267 @@
+import contextlib
+import os
+import queue
+import sqlite3
+import threading
+
+from executors import DB_IO, DB_QUEUE, DB_WORKERS, THREAD, BoundedExecutor
+
+DB = "users.db"
+
+# ----------------------
+# Pool settings (can be overridden from the environment)
+# ----------------------
+# every thread keeps its connection until it releases it: one per DB worker plus the main/UI thread
+POOL_SIZE = int(os.environ.get("TRISECURE_DB_POOL_SIZE", str(DB_WORKERS + 1)))
+STATEMENT_CACHE_SIZE = int(os.environ.get("TRISECURE_DB_STATEMENT_CACHE", "256"))
+USE_WAL = os.environ.get("TRISECURE_DB_WAL", "1") != "0"
+BUSY_TIMEOUT = 30
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class _Lease:
+    """
+    Holds the connection a thread is currently using.
+    Stored in threading.local, so when the thread ends the lease is
+    dropped and the connection goes back to the pool.
+    """
+    def __init__(self, pool, conn):
+        self.pool = pool
+        self.conn = conn
+
+    def give_back(self):
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            self.pool._put_back(conn)
+
+    def __del__(self):
+        try:
+            self.give_back()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """
+    Long-lived sqlite3 connections shared between threads.
+    Each thread keeps the same connection until it calls release() (or exits),
+    so repeated connect_db() calls inside one flow reuse one connection and
+    its prepared-statement cache. Short units of work use leased() instead.
+    """
+    def __init__(self, path=DB, size=POOL_SIZE, cached_statements=STATEMENT_CACHE_SIZE,
+                 wal=USE_WAL, timeout=BUSY_TIMEOUT):
+        if size < 1:
+            raise ValueError("pool size must be at least 1")
+        self.path = path
+        self.size = size
+        self.cached_statements = cached_statements
+        self.wal = wal
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._created = 0
+        self._closed = False
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        conn.row_factory = sqlite3.Row
+        if self.wal:
+            conn.execute("PRAGMA journal_mode=WAL")
+            # WAL + NORMAL is durable across app crashes and avoids an fsync per commit
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def acquire(self, timeout=None):
+        """Return this thread's connection, leasing one from the pool if needed."""
+        if self._closed:
+            raise PoolExhausted("pool is closed")
+        lease = getattr(self._local, "lease", None)
+        if lease is not None and lease.conn is not None:
+            return lease.conn
+
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    conn = self._open()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                try:
+                    conn = self._idle.get(timeout=timeout if timeout is not None else self.timeout)
+                except queue.Empty:
+                    raise PoolExhausted(f"no free connection in pool of {self.size}")
+
+        self._local.lease = _Lease(self, conn)
+        return conn
+
+    def holds(self):
+        """True if this thread currently has a connection leased."""
+        lease = getattr(self._local, "lease", None)
+        return lease is not None and lease.conn is not None
+
+    def release(self):
+        """Give this thread's connection back to the pool (no-op if it holds none)."""
+        lease = self._local.__dict__.pop("lease", None)
+        if lease is not None:
+            lease.give_back()
+
+    @contextlib.contextmanager
+    def leased(self, timeout=None):
+        """
+        This thread's connection for one unit of work. A lease taken here is given
+        back on exit; a connection the thread already held stays with it.
+        """
+        held = self.holds()
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            if not held:
+                self.release()
+
+    def grow(self, size):
+        """Allow up to `size` connections (never shrinks)."""
+        with self._lock:
+            self.size = max(self.size, size)
+
+    def _put_back(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    def close_all(self):
+        self._closed = True
+        self.release()
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self):
+        return {"size": self.size, "created": self._created, "idle": self._idle.qsize()}
+
+
+# ----------------------
+# Module-level registry: one pool per database file
+# ----------------------
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path=DB, **options):
+    """
+    Return the shared pool for `path`, creating it on first use.
+    Options (size, cached_statements, wal, timeout) apply on creation; after
+    that a larger `size` grows the existing pool and the rest are ignored.
+    """
+    key = os.path.abspath(path) if path != ":memory:" else path
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = ConnectionPool(path, **options)
+    if "size" in options:
+        pool.grow(options["size"])
+    return pool
+
+
+@contextlib.contextmanager
+def write_transaction(conn, savepoint="nested_write"):
+    """
+    A write transaction that never commits work the caller left open on conn:
+    BEGIN IMMEDIATE ... COMMIT when conn is idle, otherwise a SAVEPOINT that
+    becomes part of the caller's transaction (and commits or rolls back with it).
+    """
+    nested = conn.in_transaction
+    conn.execute(f"SAVEPOINT {savepoint}" if nested else "BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        if nested:
+            conn.execute(f"ROLLBACK TO {savepoint}")
+            conn.execute(f"RELEASE {savepoint}")
+        else:
+            conn.rollback()
+        raise
+    if nested:
+        conn.execute(f"RELEASE {savepoint}")
+    else:
+        conn.commit()
+
+
+def connect_db(path=DB):
+    return get_pool(path).acquire()
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close_all()
+
+
+# ----------------------
+# asyncio access (server mode)
+# ----------------------
+class AsyncDatabase:
+    """
+    Runs blocking SQLite work on a fixed set of worker threads so an event loop
+    never waits on the database. Each call leases a pooled connection for its
+    worker and gives it back when done, and the pool is grown to fit all workers
+    plus one for the thread that built this.
+    At most workers + queue calls are admitted; run() raises executors.Overloaded
+    beyond that instead of queueing without limit.
+    """
+    def __init__(self, path=DB, workers=POOL_SIZE, queue=DB_QUEUE):
+        self.path = path
+        self.workers = workers
+        self.pool = get_pool(path, size=workers + 1)
+        self.executor = BoundedExecutor(DB_IO, THREAD, workers, queue)
+
+    def _leased_call(self, fn, args, kwargs):
+        with self.pool.leased():
+            return fn(*args, **kwargs)
+
+    async def run(self, fn, *args, **kwargs):
+        """Call fn(*args, **kwargs) on a DB worker thread and await the result."""
+        return await self.executor.arun(self._leased_call, fn, args, kwargs)
+
+    def _execute(self, sql, params):
+        conn = self.pool.acquire()
+        with conn:
+            return conn.execute(sql, params).rowcount
+
+    async def execute(self, sql, params=()):
+        """Run one write statement in its own transaction; returns the row count."""
+        return await self.run(self._execute, sql, params)
+
+    async def fetchone(self, sql, params=()):
+        return await self.run(lambda: self.pool.acquire().execute(sql, params).fetchone())
+
+    async def fetchall(self, sql, params=()):
+        return await self.run(lambda: self.pool.acquire().execute(sql, params).fetchall())
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,244 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import util
+
+from instrumentation import observe
+
+# ----------------------
+# Bounded executors for blocking login work
+# ----------------------
+# Two shared pools:
+#   "kdf"  processes, CPU-heavy hashing (passwords, code words)
+#   "db"   threads, SQLite and whole engine steps that must not block a UI/event loop
+# A pool admits at most workers + queue tasks. Past that, submit() waits up to
+# SUBMIT_TIMEOUT seconds for a slot and try_submit()/arun() refuse at once; both
+# raise Overloaded, so a login peak turns into fast "busy" replies instead of an
+# unbounded backlog. Each task's queue wait and run time are recorded as spans
+# "<pool>.wait" / "<pool>.run" (see instrumentation.py) and summed in stats().
+#
+# Settings (read once at import):
+#   TRISECURE_KDF_WORKERS  processes for hashing (default: all cores; 0 = run inline)
+#   TRISECURE_KDF_QUEUE    waiting hashing tasks (default: 4 per worker)
+#   TRISECURE_DB_WORKERS   DB threads (default 8)
+#   TRISECURE_DB_QUEUE     waiting DB tasks (default 64)
+#   TRISECURE_SUBMIT_TIMEOUT  seconds submit() waits for a slot (default 5)
+
+KDF = "kdf"
+DB_IO = "db"
+THREAD = "thread"
+PROCESS = "process"
+
+KDF_WORKERS = int(os.environ.get("TRISECURE_KDF_WORKERS", str(os.cpu_count() or 1)))
+KDF_QUEUE = int(os.environ.get("TRISECURE_KDF_QUEUE", str(4 * max(KDF_WORKERS, 1))))
+DB_WORKERS = int(os.environ.get("TRISECURE_DB_WORKERS", "8"))
+DB_QUEUE = int(os.environ.get("TRISECURE_DB_QUEUE", "64"))
+SUBMIT_TIMEOUT = float(os.environ.get("TRISECURE_SUBMIT_TIMEOUT", "5"))
+
+
+class Overloaded(Exception):
+    """No slot free in a bounded executor; the caller should report "busy, retry"."""
+    def __init__(self, name):
+        super().__init__(f"{name} executor is at capacity")
+        self.name = name
+
+
+def _timed_call(fn, args, kwargs):
+    # runs in the worker (thread or process): returns the result and its own run time
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+class BoundedExecutor:
+    def __init__(self, name, kind=THREAD, workers=DB_WORKERS, queue=DB_QUEUE, submit_timeout=SUBMIT_TIMEOUT):
+        if kind not in (THREAD, PROCESS):
+            raise ValueError(f"unknown executor kind: {kind}")
+        self.name = name
+        self.kind = kind
+        self.workers = workers
+        self.queue = queue
+        self.submit_timeout = submit_timeout
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + max(queue, 0))
+        self._pool = None
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "in_flight": 0,
+                       "wait_seconds": 0.0, "run_seconds": 0.0}
+
+    def _executor(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    if self.kind == PROCESS:
+                        # spawn: workers do not inherit the parent's threads, SQLite connections or Tk state
+                        self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                         mp_context=multiprocessing.get_context("spawn"))
+                    else:
+                        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        return self._pool
+
+    def _count(self, **deltas):
+        with self._lock:
+            for key, value in deltas.items():
+                self._stats[key] += value
+
+    def _reject(self):
+        self._count(rejected=1)
+        raise Overloaded(self.name)
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs); waits up to submit_timeout for a slot. Returns a Future."""
+        if not self._slots.acquire(timeout=self.submit_timeout):
+            self._reject()
+        return self._start(fn, args, kwargs)
+
+    def try_submit(self, fn, *args, **kwargs):
+        """Like submit() but never waits (for event loops)."""
+        if not self._slots.acquire(blocking=False):
+            self._reject()
+        return self._start(fn, args, kwargs)
+
+    def _start(self, fn, args, kwargs):
+        self._count(submitted=1, in_flight=1)
+        queued = time.perf_counter()
+        outer = Future()
+        if self.workers <= 0:
+            # inline mode: run in the caller, same accounting
+            inner = Future()
+            try:
+                inner.set_result(_timed_call(fn, args, kwargs))
+            except Exception as e:
+                inner.set_exception(e)
+            except BaseException:
+                self._slots.release()
+                self._count(in_flight=-1)
+                raise
+            self._finish(inner, outer, queued)
+            return outer
+        try:
+            inner = self._executor().submit(_timed_call, fn, args, kwargs)
+        except BaseException:
+            self._slots.release()
+            self._count(in_flight=-1)
+            raise
+        inner.add_done_callback(lambda done: self._finish(done, outer, queued))
+        return outer
+
+    def _finish(self, inner, outer, queued):
+        self._slots.release()
+        total = time.perf_counter() - queued
+        error = inner.exception()
+        if error is not None:
+            self._count(in_flight=-1, failed=1)
+            outer.set_exception(error)
+            return
+        result, run = inner.result()
+        wait = max(total - run, 0.0)
+        self._count(in_flight=-1, completed=1, wait_seconds=wait, run_seconds=run)
+        observe(f"{self.name}.wait", wait)
+        observe(f"{self.name}.run", run)
+        outer.set_result(result)
+
+    def run(self, fn, *args, **kwargs):
+        """submit() and wait for the result."""
+        return self.submit(fn, *args, **kwargs).result()
+
+    async def arun(self, fn, *args, **kwargs):
+        """Await fn on the pool from an event loop; raises Overloaded at once when full."""
+        return await asyncio.wrap_future(self.try_submit(fn, *args, **kwargs))
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+        done = s["completed"] or 1
+        s.update(name=self.name, kind=self.kind, workers=self.workers, queue=self.queue,
+                 mean_wait_ms=round(s.pop("wait_seconds") / done * 1000, 3),
+                 mean_run_ms=round(s.pop("run_seconds") / done * 1000, 3))
+        return s
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+
+# ----------------------
+# Shared executors
+# ----------------------
+DEFAULTS = {
+    KDF: {"kind": PROCESS, "workers": KDF_WORKERS, "queue": KDF_QUEUE},
+    DB_IO: {"kind": THREAD, "workers": DB_WORKERS, "queue": DB_QUEUE},
+}
+
+_executors = {}
+_registry_lock = threading.Lock()
+
+
+def configure(name, **settings):
+    """Replace a shared executor's settings (kind/workers/queue/submit_timeout), e.g. from a CLI flag."""
+    with _registry_lock:
+        old = _executors.pop(name, None)
+        DEFAULTS[name] = dict(DEFAULTS.get(name, {}), **settings)
+    if old is not None:
+        old.shutdown(wait=False)
+
+
+def get_executor(name):
+    executor = _executors.get(name)
+    if executor is None:
+        with _registry_lock:
+            executor = _executors.get(name)
+            if executor is None:
+                executor = _executors[name] = BoundedExecutor(name, **DEFAULTS.get(name, {}))
+    return executor
+
+
+# ----------------------
+# Running slow steps off a Tk thread
+# ----------------------
+POLL_MS = 50
+
+
+def run_off_tk(widget, fn, on_done, *args, **kwargs):
+    """
+    Runs fn(*args, **kwargs) on the shared "db" pool and calls on_done(result, error)
+    on the Tk thread (via widget.after) when it finishes.
+    Returns False at once, without running fn, if the pool is full: the Tk loop
+    never waits for a slot.
+    """
+    try:
+        future = get_executor(DB_IO).try_submit(fn, *args, **kwargs)
+    except Overloaded:
+        return False
+
+    def poll():
+        if not future.done():
+            widget.after(POLL_MS, poll)
+            return
+        error = future.exception()
+        on_done(None if error else future.result(), error)
+    widget.after(POLL_MS, poll)
+    return True
+
+
+def all_stats():
+    return {name: executor.stats() for name, executor in list(_executors.items())}
+
+
+def shutdown_all(wait=True):
+    with _registry_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait)
+
+
+# A pool worker process exits through multiprocessing's handler, which joins child
+# processes before atexit hooks run. Shut our pools down first (priority above the
+# queue finalizers, which would otherwise stop the feeder before the shutdown
+# sentinels are sent), so nested workers exit too, e.g. in bench_login processes.
+util.Finalize(None, shutdown_all, exitpriority=100)
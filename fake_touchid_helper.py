@@ -0,0 +1,35 @@
+"""
+Stand-in for the Swift Touch ID helper, speaking the same line protocol
+(see touchid_helper.py). Lets the fingerprint step run on Linux and in tests.
+
+Environment:
+  FAKE_TOUCHID_RESULTS  comma-separated replies to AUTH, cycled (default "SUCCESS")
+  FAKE_TOUCHID_DELAY    seconds to wait before each AUTH reply (default 0)
+"""
+import os
+import sys
+import time
+
+
+def main():
+    results = [r.strip() for r in os.environ.get("FAKE_TOUCHID_RESULTS", "SUCCESS").split(",") if r.strip()]
+    delay = float(os.environ.get("FAKE_TOUCHID_DELAY", "0"))
+    count = 0
+    print("READY", flush=True)
+    for line in sys.stdin:
+        cmd = line.strip().split(" ", 1)[0]
+        if cmd == "QUIT":
+            break
+        if cmd == "PING":
+            print("PONG", flush=True)
+        elif cmd == "AUTH":
+            if delay:
+                time.sleep(delay)
+            print(results[count % len(results)], flush=True)
+            count += 1
+        else:
+            print("ERROR unknown command", flush=True)
+
+
+if __name__ == "__main__":
+    main()
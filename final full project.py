@@ -11,6 +11,17 @@ import math
 import os
 import subprocess
 import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+from auth_engine import BANNED, LOCKED, RETRY, AuthEngine
+from card_secret import CARDS
+from db_pool import get_pool
+from executors import run_off_tk
+from keystroke_capture import KeystrokeRecorder
+from migrations import run_migrations
+from otp_service import OTP_MAX_ATTEMPTS, StubSink, get_otp_service
+from password_hashing import get_hasher
+from user_ids import next_user_id
 
 
 # GUI imports
@@ -19,253 +30,105 @@ from tkcalendar import Calendar
 from tkinter import messagebox, simpledialog
 
 DB = "users.db"
-
-# ----------------------
-# Touch ID Swift script creation (macOS)
-# ----------------------
-TOUCH_ID_SCRIPT = "touchid.swift"
-TOUCH_ID_SWIFT_CONTENT = """
-import LocalAuthentication
-import Foundation
-
-let context = LAContext()
-var error: NSError?
-
-if context.canEvaluatePolicy(.deviceOwnerAuthenticationWithBiometrics, error: &error) {
-    context.evaluatePolicy(.deviceOwnerAuthenticationWithBiometrics, localizedReason: "Authenticate with Touch ID") { success, authenticationError in
-        if success {
-            print("SUCCESS")
-        } else {
-            print("FAILED")
-        }
-        exit(0)
-    }
-} else {
-    print("UNAVAILABLE")
-    exit(0)
-}
-
-RunLoop.main.run()
-"""
-
-def ensure_swift_file():
-    try:
-        if not os.path.exists(TOUCH_ID_SCRIPT):
-            with open(TOUCH_ID_SCRIPT, "w") as f:
-                f.write(TOUCH_ID_SWIFT_CONTENT)
-    except Exception:
-        # If any file writing errors occur, ignore here; Touch ID will fail gracefully later
-        pass
-
-def touch_id_auth():
-    """
-    Attempts to run the Swift script to trigger Touch ID.
-    Returns True on success, False otherwise.
-    """
-    ensure_swift_file()
-    swift_path = "/usr/bin/swift"
-    if not os.path.exists(swift_path):
-        # swift not available
-        return False
-    try:
-        result = subprocess.run([swift_path, TOUCH_ID_SCRIPT], capture_output=True, text=True, timeout=20)
-        output = result.stdout.strip() + result.stderr.strip()
-        if "SUCCESS" in output:
-            return True
-        return False
-    except Exception:
-        return False
+LOGIN_SOURCE = "gui"   # rate-limit bucket for attempts made from this app
+ENGINE = AuthEngine(DB, source=LOGIN_SOURCE)
 
 # ----------------------
 # Backend DB & Helpers
 # ----------------------
 def connect_db():
-    conn = sqlite3.connect(DB, timeout=30)
-    conn.row_factory = sqlite3.Row
-    return conn
+    # Reuses this thread's long-lived connection from the shared pool (WAL, statement cache)
+    return get_pool(DB).acquire()
 
 def init_db():
-    with connect_db() as conn:
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id TEXT PRIMARY KEY,
-            first_name TEXT,
-            last_name TEXT,
-            dob TEXT,
-            phone TEXT,
-            code_word TEXT,
-            username TEXT UNIQUE,
-            password TEXT,
-            passkey TEXT,
-            card_sequence TEXT,
-            card_values TEXT,
-            typing_wpm INTEGER,
-            typing_intervals TEXT,
-            created_at INTEGER,
-            fingerprint_enabled INTEGER
-        )
-        """)
-        conn.commit()
-
-def add_missing_columns():
-    with connect_db() as conn:
-        cur = conn.cursor()
-        cur.execute("PRAGMA table_info(users)")
-        existing_cols = [row["name"] for row in cur.fetchall()]
-        required_cols = {
-            "first_name": "TEXT",
-            "last_name": "TEXT",
-            "passkey": "TEXT",
-            "card_sequence": "TEXT",
-            "card_values": "TEXT",
-            "typing_wpm": "INTEGER",
-            "typing_intervals": "TEXT",
-            "fingerprint_enabled": "INTEGER"
-        }
-        for col, col_type in required_cols.items():
-            if col not in existing_cols:
-                try:
-                    cur.execute(f"ALTER TABLE users ADD COLUMN {col} {col_type}")
-                    conn.commit()
-                except Exception:
-                    pass
-
-def compute_wpm(total_chars, duration_seconds):
-    if duration_seconds <= 0 or total_chars == 0:
-        return 0
-    words = total_chars / 5.0
-    minutes = duration_seconds / 60.0
-    wpm = words / minutes
-    return int(round(wpm))
+    # Runs pending migrations once; a current schema costs a single PRAGMA read
+    run_migrations(DB)
 
 # ----------------------
 # Core logic functions (kept as original as possible)
 # ----------------------
 def otp_verification(phone=None):
-    otp = random.randint(1000, 9999)
-    if phone:
-        print(f"\n Sending OTP to {phone}...")
-    time.sleep(1)
-    print(f"Your OTP is: {otp}")
-    attempts = 0
-    while attempts < 3:
+    service = get_otp_service()
+    # issuing is non-blocking; only wait here until the code has been shown
+    ticket = service.issue(phone or "console")
+    ticket.delivery.result(timeout=10)
+    while True:
         entered = input("Enter OTP: ").strip()
-        if entered == str(otp):
+        status, left = service.verify(ticket.key, entered)
+        if status == "ok":
             print("✅ OTP verified.")
             return True
+        if status == "wrong":
+            print(f"❌ Incorrect OTP. Attempts left: {left}")
+        elif status == "expired":
+            print("❌ OTP expired. Please try again.")
+            return False
         else:
-            attempts += 1
-            if attempts < 3:
-                print(f"❌ Incorrect OTP. Attempts left: {3 - attempts}")
-            else:
-                print("❌ Incorrect OTP. Maximum attempts reached.")
-                return False
-    return False
+            print("❌ Incorrect OTP. Maximum attempts reached.")
+            return False
 
 def otp_simulate_and_verify(phone, parent):
-    otp = random.randint(1000, 9999)
-    # show popup with OTP for demo
-    messagebox.showinfo("OTP Sent", f"📱 Sending OTP to {phone}...\n\n(For demo) OTP: {otp}", parent=parent)
-    attempts = 0
-    while attempts < 3:
-        entered = simpledialog.askstring("Enter OTP", f"Enter OTP sent to {phone} (attempt {attempts+1}/3):", parent=parent)
+    # demo transport: the "sent" message is kept in memory and shown in a popup
+    service = get_otp_service("gui", transport=StubSink())
+    ticket = service.issue(phone)
+    ticket.delivery.result(timeout=10)
+    messagebox.showinfo("OTP Sent", f"📱 Sending OTP to {phone}...\n\n(For demo) {service.transport.last(phone)}", parent=parent)
+    attempt = 1
+    while True:
+        entered = simpledialog.askstring("Enter OTP", f"Enter OTP sent to {phone} (attempt {attempt}/{OTP_MAX_ATTEMPTS}):", parent=parent)
         if entered is None:
             return False
-        if entered.strip() == str(otp):
+        status, left = service.verify(ticket.key, entered)
+        if status == "ok":
             messagebox.showinfo("OTP", "✅ OTP verified.", parent=parent)
             return True
-        attempts += 1
-        if attempts < 3:
-            messagebox.showwarning("OTP", f"Incorrect OTP. Attempts left: {3 - attempts}", parent=parent)
+        if status == "wrong":
+            messagebox.showwarning("OTP", f"Incorrect OTP. Attempts left: {left}", parent=parent)
+            attempt += 1
+        elif status == "expired":
+            messagebox.showerror("OTP", "OTP expired. Please register again.", parent=parent)
+            return False
         else:
             messagebox.showerror("OTP", "Incorrect OTP. Maximum attempts reached.", parent=parent)
             return False
-    return False
 
 def register_user_console_flow(first_name, last_name, dob, phone, code_word, username, password):
     # This keeps original DB insertion behavior but is called by GUI with validated fields.
     if not username or not password:
         return False, "Username and password cannot be empty."
 
-    with connect_db() as conn:
-        cur = conn.cursor()
-        while True:
-            user_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=7))
-            cur.execute("SELECT 1 FROM users WHERE id=?", (user_id,))
-            if not cur.fetchone():
-                break
-
     try:
+        # salted hashes, computed before the connection is used (the KDF is deliberately slow);
+        # the code word is normalized (strip + lower) once here, answers get the same treatment
+        hasher = get_hasher()
+        password_hash = hasher.hash(password)
+        code_word_hash = hasher.hash_code_word(code_word)
         with connect_db() as conn:
             cur = conn.cursor()
             cur.execute("SELECT 1 FROM users WHERE username=?", (username,))
             if cur.fetchone():
                 return False, "Username already exists."
-            cur.execute("""
-                INSERT INTO users (
-                    id, first_name, last_name, dob, phone, code_word, username, password, created_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (user_id, first_name, last_name, dob, phone, code_word, username, password, int(time.time())))
+            while True:
+                # IDs come from the permuted sequence, no DB lookup needed
+                user_id = next_user_id(DB)
+                try:
+                    cur.execute("""
+                        INSERT INTO users (
+                            id, first_name, last_name, dob, phone, code_word, username, password, created_at
+                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """, (user_id, first_name, last_name, dob, phone, code_word_hash, username, password_hash,
+                          int(time.time())))
+                except sqlite3.IntegrityError as e:
+                    # only possible against an old random ID; take the next one
+                    if "users.id" in str(e):
+                        continue
+                    raise
+                break
             conn.commit()
             return True, f"Registration successful! Your User ID: {user_id}"
     except Exception as e:
         return False, f"Error: {e}"
 
-# Step1 helper: generate passkey from card selection
-def generate_passkey_from_selection(selection, card_values):
-    # selection: list of 7 card names in order
-    # card_values: dict mapping 9 cards to digits 0-9
-    numbers = [card_values[c] for c in selection]
-    results = []
-    for x in numbers:
-        val = 3 * x + 1
-        # if two-digit result, take last digit
-        if val >= 10:
-            val = int(str(val)[-1])
-        results.append(val)
-    joined = "".join(str(r) for r in results)
-    passkey7 = joined[:7]
-    # insert random digit anywhere to make 8 digits
-    random_digit = str(random.randint(0, 9))
-    pos = random.randint(0, len(passkey7))
-    passkey8 = passkey7[:pos] + random_digit + passkey7[pos:]
-    # ensure uniqueness in DB (simple tweak)
-    with connect_db() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT 1 FROM users WHERE passkey=?", (passkey8,))
-        if cur.fetchone():
-            # replace the inserted digit with (digit+1)%10
-            new_digit = str((int(random_digit) + 1) % 10)
-            passkey8 = passkey7[:pos] + new_digit + passkey7[pos:]
-    return passkey8
-
-# Step1 verification helper: parse stored card_sequence and card_values, return cleaned sequence
-def parse_card_sequence_field(field_text):
-    """
-    field_text expected as: "CardA,CardB,CardC,... | CardX:val, CardY:val, ..."
-    Return (sequence_list, card_value_pairs_dict_or_empty)
-    """
-    if not field_text:
-        return [], {}
-    if " | " in field_text:
-        seq_part, value_part = field_text.split(" | ", 1)
-        seq_list = [s.strip() for s in seq_part.split(",") if s.strip()]
-        value_pairs = {}
-        try:
-            for item in value_part.split(","):
-                item = item.strip()
-                if not item:
-                    continue
-                if ":" in item:
-                    k, v = item.split(":", 1)
-                    value_pairs[k.strip()] = int(v.strip())
-        except Exception:
-            value_pairs = {}
-        return seq_list, value_pairs
-    else:
-        seq_list = [s.strip() for s in field_text.split(",") if s.strip()]
-        return seq_list, {}
-
 # ----------------------
 # GUI: CustomTkinter wrappers
 # ----------------------
@@ -290,6 +153,8 @@ class TriSecureApp(ctk.CTk):
             page = F(parent=self.container, controller=self)
             self.frames[F.__name__] = page
             page.grid(row=0, column=0, sticky="nsew")
+        self.flow = None    # login attempt in progress (AuthFlow)
+        self.protocol("WM_DELETE_WINDOW", self.close)
         self.show_frame("HomePage")
 
     def show_frame(self, name, **kwargs):
@@ -298,6 +163,22 @@ class TriSecureApp(ctk.CTk):
             frame.on_show(**kwargs)
         frame.tkraise()
 
+    def begin_flow(self, flow):
+        self.end_flow()
+        self.flow = flow
+
+    def end_flow(self):
+        # every way out of a login (passed, failed, Back buttons, closing the window)
+        # ends here, so whatever the flow staged is written by flow.finish()
+        flow, self.flow = self.flow, None
+        if flow is not None:
+            flow.finish()
+
+    def close(self):
+        self.frames["FingerprintPage"].cancel_touch()
+        self.end_flow()
+        self.destroy()
+
 # ---------- Home ----------
 class HomePage(ctk.CTkFrame):
     def __init__(self, parent, controller):
@@ -309,7 +190,7 @@ class HomePage(ctk.CTkFrame):
         ctk.CTkButton(self, text="Exit", width=200, fg_color="red", command=self.quit_app).pack(pady=10)
 
     def quit_app(self):
-        self.controller.destroy()
+        self.controller.close()
 
 # ---------- Register ----------
 class RegisterPage(ctk.CTkFrame):
@@ -343,7 +224,9 @@ class RegisterPage(ctk.CTkFrame):
 
         btn_frame = ctk.CTkFrame(self)
         btn_frame.pack(pady=12)
-        ctk.CTkButton(btn_frame, text="Submit Registration", command=self.submit).grid(row=0, column=0, padx=8)
+        self._busy = False      # registration (password/code word hashing) running off the Tk thread
+        self.submit_btn = ctk.CTkButton(btn_frame, text="Submit Registration", command=self.submit)
+        self.submit_btn.grid(row=0, column=0, padx=8)
         ctk.CTkButton(btn_frame, text="Back", command=lambda: controller.show_frame("HomePage")).grid(row=0, column=1, padx=8)
 
     def open_calendar(self, event=None):
@@ -362,6 +245,8 @@ class RegisterPage(ctk.CTkFrame):
         ctk.CTkButton(top, text="Select", command=pick).pack(pady=8)
 
     def submit(self):
+        if self._busy:
+            return
         fn = self.first_name.get().strip()
         ln = self.last_name.get().strip()
         dob = self.dob_entry.get().strip()
@@ -397,7 +282,18 @@ class RegisterPage(ctk.CTkFrame):
             messagebox.showerror("OTP", "Registration cancelled due to failed OTP verification.")
             return
 
-        ok, msg = register_user_console_flow(fn, ln, dob, phone, code_word, username, password)
+        # hashing the password and code word is deliberately slow, so it runs off the Tk thread
+        if not run_off_tk(self, register_user_console_flow, self._on_register_result,
+                          fn, ln, dob, phone, code_word, username, password):
+            messagebox.showerror("Registration Error", "The system is busy. Please try again.")
+            return
+        self._busy = True
+        self.submit_btn.configure(state="disabled")
+
+    def _on_register_result(self, result, error):
+        self._busy = False
+        self.submit_btn.configure(state="normal")
+        ok, msg = result if error is None else (False, f"Error: {error}")
         if not ok:
             messagebox.showerror("Registration Error", msg)
             return
@@ -417,6 +313,7 @@ class LoginPage(ctk.CTkFrame):
     def __init__(self, parent, controller):
         super().__init__(parent)
         self.controller = controller
+        self._busy = False      # password check running off the Tk thread
 
         header = ctk.CTkLabel(self, text="Login", font=ctk.CTkFont(size=20, weight="bold"))
         header.pack(pady=18)
@@ -434,54 +331,48 @@ class LoginPage(ctk.CTkFrame):
         self.password_entry.grid(row=2, column=1, padx=8, pady=8, sticky="ew")
         form.grid_columnconfigure(1, weight=1)
 
-        # storage for key timestamps
-        self.u_timestamps = []
-        self.p_timestamps = []
+        # key-down times per field (preallocated; reused across attempts)
+        self.u_keys = KeystrokeRecorder()
+        self.p_keys = KeystrokeRecorder()
 
-        # bind key events to capture per-key timestamps
-        self.username_entry.bind("<KeyPress>", self._on_username_key)
-        self.password_entry.bind("<KeyPress>", self._on_password_key)
+        # presses are timed; a release is when the entry's text can be checked against them
+        for entry, keys in ((self.username_entry, self.u_keys), (self.password_entry, self.p_keys)):
+            entry.bind("<KeyPress>", lambda event, k=keys: self._on_key_press(event, k))
+            entry.bind("<KeyRelease>", lambda event, e=entry, k=keys: self._on_key_release(e, k))
 
         btn_frame = ctk.CTkFrame(self)
         btn_frame.pack(pady=12)
-        ctk.CTkButton(btn_frame, text="Login", command=self.attempt_login).grid(row=0, column=0, padx=8)
+        self.login_btn = ctk.CTkButton(btn_frame, text="Login", command=self.attempt_login)
+        self.login_btn.grid(row=0, column=0, padx=8)
         ctk.CTkButton(btn_frame, text="Back", command=lambda: controller.show_frame("HomePage")).grid(row=0, column=1, padx=8)
 
     def on_show(self, **kwargs):
-        # reset timestamps and fields each time shown
-        self.u_timestamps = []
-        self.p_timestamps = []
+        # reset recorded keys and fields each time shown
+        self.u_keys.clear()
+        self.p_keys.clear()
         self.username_entry.delete(0, "end")
         self.password_entry.delete(0, "end")
 
-    def _now_ms(self):
-        return int(time.time() * 1000)
-
-    def _on_username_key(self, event):
-        # record timestamp in ms for each key press (excluding modifier-only keys)
-        if len(event.keysym) == 1 or event.keysym in ("BackSpace", "Return"):
-            self.u_timestamps.append(time.time())
+    def _on_key_press(self, event, keys):
+        # runs before the entry inserts the character; modifier/navigation keys are not recorded
+        if event.keysym == "BackSpace":
+            keys.backspace()
+        elif len(event.char) == 1 and event.char.isprintable():
+            keys.press(time.monotonic_ns())
 
-    def _on_password_key(self, event):
-        if len(event.keysym) == 1 or event.keysym in ("BackSpace", "Return"):
-            self.p_timestamps.append(time.time())
+    def _on_key_release(self, entry, keys):
+        # the entry has been edited by now: paste, cut or a mid-text delete restarts the recording
+        keys.sync(len(entry.get()))
 
     def attempt_login(self):
+        if self._busy:
+            return
         typed_username = self.username_entry.get().strip()
         typed_password = self.password_entry.get().strip()
 
-        # compute intervals lists and durations from timestamps
-        def compute_intervals_and_duration(ts_list):
-            if len(ts_list) < 2:
-                return [], 0.0
-            intervals = []
-            for i in range(1, len(ts_list)):
-                intervals.append(int((ts_list[i] - ts_list[i-1]) * 1000))  # ms
-            total_dur = ts_list[-1] - ts_list[0]
-            return intervals, total_dur
-
-        u_intervals, u_duration = compute_intervals_and_duration(self.u_timestamps)
-        p_intervals, p_duration = compute_intervals_and_duration(self.p_timestamps)
+        # press-to-press intervals feed the typing profile
+        u_intervals, u_duration = self.u_keys.intervals_ms(), self.u_keys.duration()
+        p_intervals, p_duration = self.p_keys.intervals_ms(), self.p_keys.duration()
 
         total_chars = len(typed_username) + len(typed_password)
         total_duration = (u_duration or 0.0) + (p_duration or 0.0)
@@ -489,66 +380,47 @@ class LoginPage(ctk.CTkFrame):
             # fallback: small epsilon to avoid division by zero
             total_duration = 0.001
 
-        combined_intervals = u_intervals + p_intervals
-        wpm = compute_wpm(total_chars, total_duration)
-
-        # Query DB for credentials
-        with connect_db() as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT * FROM users WHERE username=? AND password=?", (typed_username, typed_password))
-            user = cur.fetchone()
-
-        if not user:
-            messagebox.showerror("Login Failed", "Invalid username or password.")
+        # the engine checks lockouts, credentials (slow KDF) and the typing profile on a
+        # worker thread; the Tk loop keeps running and polls for the result
+        flow = ENGINE.start()
+        on_done = lambda result, error: self._on_login_result(flow, result, error)
+        started = run_off_tk(self, flow.submit_password, on_done, typed_username, typed_password,
+                             intervals=u_intervals + p_intervals, total_chars=total_chars, duration=total_duration)
+        if not started:
+            messagebox.showerror("Login", "The system is busy. Please try again.")
             return
-
-        # If first-time typing profile not set, save it
-        stored_wpm = user["typing_wpm"]
-        stored_intervals_field = user["typing_intervals"]
-        if not stored_wpm:
-            intervals_str = ",".join(str(i) for i in combined_intervals)
-            with connect_db() as conn:
-                conn.execute("UPDATE users SET typing_wpm=?, typing_intervals=? WHERE username=?",
-                             (wpm, intervals_str, typed_username))
-                conn.commit()
-            messagebox.showinfo("Login Successful", f"Login successful. Typing profile recorded ({wpm} wpm).")
-            # forward to security step1
-            self.controller.show_frame("SecurityPage", user_row=user)
+        self._busy = True
+        self.login_btn.configure(state="disabled")
+
+    def _on_login_result(self, flow, result, error):
+        self._busy = False
+        self.login_btn.configure(state="normal")
+        if error is not None:
+            messagebox.showerror("Login", f"Error: {error}")
             return
-
-        # Else compare wpm tolerance and check keystroke uniformity
-        try:
-            stored_wpm_val = int(stored_wpm)
-        except Exception:
-            stored_wpm_val = int(stored_wpm) if stored_wpm else 0
-        tol = 25 
-        if not (stored_wpm_val - tol <= wpm <= stored_wpm_val + tol):
-            messagebox.showerror("Access Denied", f"Typing speed mismatch. Recorded: {stored_wpm_val} wpm, Now: {wpm} wpm.")
+        if result.status == RETRY:
+            messagebox.showerror("Login Failed", result.message)
             return
-
-        # bot detection via stddev of intervals (human intervals vary)
-        import statistics
-        stddev = None
-        if len(combined_intervals) >= 3:
-            try:
-                stddev = statistics.pstdev(combined_intervals)
-            except Exception:
-                stddev = None
-        if stddev is not None and stddev < 8:
-            messagebox.showerror("Access Denied", "looks artificial (bot-like).")
+        if not result.ok:
+            messagebox.showerror("Access Denied", result.message)
             return
 
-        messagebox.showinfo("Login Successful", "Welcome user.")
+        if result.profile_recorded:
+            messagebox.showinfo("Login Successful", f"Login successful. {result.message}")
+        else:
+            messagebox.showinfo("Login Successful", "Welcome user.")
         # go to SecurityPage
-        self.controller.show_frame("SecurityPage", user_row=user)
-        self.controller.frames["SecurityPage"].set_user(user)
+        self.controller.begin_flow(flow)
+        self.controller.frames["SecurityPage"].set_flow(flow)
+        self.controller.show_frame("SecurityPage")
 
 # ---------- Security Page (new, separated) ----------
 class SecurityPage(ctk.CTkFrame):
     def __init__(self, parent, controller):
         super().__init__(parent)
         self.controller = controller
-        self.user_row = None
+        self.flow = None
+        self._busy = False      # code word check running off the Tk thread
         ctk.CTkLabel(self, text="🔐 Security Question", font=ctk.CTkFont(size=20, weight="bold")).pack(pady=20)
         ctk.CTkLabel(self, text="Enter your code word to continue").pack(pady=6)
         self.code_entry = ctk.CTkEntry(self, placeholder_text="Your Code Word", show="*")
@@ -557,40 +429,59 @@ class SecurityPage(ctk.CTkFrame):
         self.msg.pack(pady=6)
         btn_frame = ctk.CTkFrame(self)
         btn_frame.pack(pady=12)
-        ctk.CTkButton(btn_frame, text="Verify", command=self.verify_codeword).grid(row=0, column=0, padx=8)
-        ctk.CTkButton(btn_frame, text="Back to Login", command=lambda: controller.show_frame("LoginPage")).grid(row=0, column=1, padx=8)
-
-    def set_user(self, user_row):
-        # user_row may be sqlite Row object; convert to dict minimally for safety
-        self.user_row = user_row
+        self.verify_btn = ctk.CTkButton(btn_frame, text="Verify", command=self.verify_codeword)
+        self.verify_btn.grid(row=0, column=0, padx=8)
+        self.back_btn = ctk.CTkButton(btn_frame, text="Back to Login", command=self.back_to_login)
+        self.back_btn.grid(row=0, column=1, padx=8)
+
+    def set_flow(self, flow):
+        # flow is the AuthFlow started at login (holds the user's LoginSession)
+        self.flow = flow
         self.code_entry.delete(0, "end")
         self.msg.configure(text="")
 
     def verify_codeword(self):
-        if not self.user_row:
+        if not self.flow:
             messagebox.showerror("Error", "No user loaded.")
             self.controller.show_frame("LoginPage")
             return
-        stored = (self.user_row["code_word"] or "").strip().lower()
-        answer = self.code_entry.get().strip().lower()
-        if answer == stored:
-            messagebox.showinfo("Success", "✅ Security question passed.")
-            # fetch fresh row from DB and forward to Step1
-            with connect_db() as conn:
-                cur = conn.cursor()
-                cur.execute("SELECT * FROM users WHERE username=?", (self.user_row["username"],))
-                updated = cur.fetchone()
-            self.controller.show_frame("Step1Page", user_row=updated)
-                   
+        if self._busy:
+            return
+        # the code word is a salted hash now, so the check runs off the Tk thread like the password
+        if not run_off_tk(self, self.flow.submit_code_word, self._on_codeword_result, self.code_entry.get()):
+            messagebox.showerror("Security", "The system is busy. Please try again.")
+            return
+        self._busy = True
+        self.verify_btn.configure(state="disabled")
+        self.back_btn.configure(state="disabled")
+
+    def back_to_login(self):
+        self.controller.end_flow()
+        self.controller.show_frame("LoginPage")
+
+    def _on_codeword_result(self, result, error):
+        self._busy = False
+        self.verify_btn.configure(state="normal")
+        self.back_btn.configure(state="normal")
+        if error is not None:
+            messagebox.showerror("Security", f"Error: {error}")
+            return
+        if result.ok:
+            messagebox.showinfo("Success", f"✅ {result.message}")
+            # forward the same flow to Step1 (no need to re-read the row)
+            self.controller.show_frame("Step1Page", flow=self.flow)
+        elif result.status == RETRY:
+            self.msg.configure(text=f"❌ Incorrect code word. Attempts left: {result.attempts_left}")
         else:
-            self.msg.configure(text="❌ Incorrect code word.")        
+            messagebox.showerror("Access Denied", f"❌ {result.message}")
+            self.back_to_login()
 
 # ---------- Step1 Page (Poker card) ----------
 class Step1Page(ctk.CTkFrame):
     def __init__(self, parent, controller):
         super().__init__(parent)
         self.controller = controller
-        self.user_row = None
+        self.flow = None
 
         header = ctk.CTkLabel(self, text="--- Poker Card Security ---", font=ctk.CTkFont(size=20, weight="bold"))
         header.pack(pady=12)
@@ -610,49 +501,71 @@ class Step1Page(ctk.CTkFrame):
         btn_frame = ctk.CTkFrame(self)
         btn_frame.pack(pady=10)
         self.submit_btn = ctk.CTkButton(btn_frame, text="Submit Selection", command=self.submit_selection)
-        self.reset_btn =  ctk.CTkButton(btn_frame, text="Reset Selection",  command=lambda: self.on_show(self.user_row))
-        self.back_btn = ctk.CTkButton(btn_frame, text="Back to Home", command=lambda: controller.show_frame("HomePage"))
+        self.reset_btn =  ctk.CTkButton(btn_frame, text="Reset Selection",  command=lambda: self.on_show(self.flow))
+        self.back_btn = ctk.CTkButton(btn_frame, text="Back to Home", command=self.back_to_home)
         self.submit_btn.grid(row=0, column=0, padx=10)
         self.reset_btn.grid(row=0, column=1, padx=10)
         self.back_btn.grid(row=0, column=2, padx=10)
 
         # variables
-        self.cards = ["Spade", "Heart", "Diamond", "Club", "Ace", "King", "Queen", "Jack", "Joker"]
+        self.cards = list(CARDS)
         self.card_buttons = []
         self.current_selection = []
-        self.card_values_map = {}
         self.is_setup_mode = False
+        self._lock_job = None
 
-    def on_show(self, user_row=None):
+    def on_show(self, flow=None):
         # reset
-        self.user_row = user_row
+        self._cancel_lock_countdown()
+        self.flow = flow
         self.current_selection = []
-        self.card_values_map = {}
         self.passkey_label.configure(text="")
         for w in self.grid_frame.winfo_children():
             w.destroy()
         # Decide mode based on whether user has a passkey
-        if not user_row:
+        if not flow:
             messagebox.showerror("Error", "No user context provided.")
             self.controller.show_frame("HomePage")
             return
-        self.user_row = dict(user_row)
-        self.is_setup_mode = not bool(self.user_row.get("passkey"))
-        # Setup card values for first-time or verification
+        self.is_setup_mode = flow.needs_card_setup
+        # Render grid shuffled; card values stay hidden in both modes
+        self._render_grid(show_values=False)
         if self.is_setup_mode:
-            # first-time assign random values 0-9 mapped to 9 cards
-            values = random.sample(range(10), 9)
-            self.card_values_map = dict(zip(self.cards, values))
-            self._render_grid(show_values=False)  # show only names
+            # first-time: fresh random values 0-9 mapped to the 9 cards
+            flow.new_card_values()
+        else:
+            # a lock from an earlier attempt (even in another session) still applies
+            self._lock_countdown()
+
+    def back_to_home(self):
+        self._cancel_lock_countdown()
+        self.controller.end_flow()
+        self.controller.show_frame("HomePage")
+
+    # --- lockout: persisted lock-until, countdown driven by after() (never sleeps) ---
+    def _set_inputs_enabled(self, enabled):
+        state = "normal" if enabled else "disabled"
+        self.submit_btn.configure(state=state)
+        for b in self.card_buttons:
+            b.configure(state=state)
+
+    def _cancel_lock_countdown(self):
+        if self._lock_job is not None:
+            self.after_cancel(self._lock_job)
+            self._lock_job = None
+
+    def _lock_countdown(self):
+        self._lock_job = None
+        if not self.flow:
+            return
+        remaining = self.flow.lock_remaining()
+        if remaining > 0:
+            self._set_inputs_enabled(False)
+            self.passkey_label.configure(text=f"⏳ Locked. Try again in {remaining} seconds.")
+            self._lock_job = self.after(1000, self._lock_countdown)
         else:
-            # verification: show full 9 cards in shuffled grid
-            # stored sequence parse to get saved selection (but not reveal values)
-            full_seq_field = self.user_row.get("card_sequence") or ""
-            seq_list, hidden_map = parse_card_sequence_field(full_seq_field)
-            # For verification we should not show values. Use default cards ordering shuffled.
-            self.card_values_map = {}  # will be derived from passkey later (secret)
-            # Render grid shuffled
-            self._render_grid(show_values=False)
+            self._set_inputs_enabled(True)
+            self.passkey_label.configure(text="")
 
     def _render_grid(self, show_values=False):
         # create 3x3 buttons
@@ -663,7 +576,7 @@ class Step1Page(ctk.CTkFrame):
             for c in range(3):
                 idx = r * 3 + c
                 name = shuffled[idx]
-                text = name if not show_values else f"{name}\n({self.card_values_map.get(name,'?')})"
+                text = name if not show_values else f"{name}\n({(self.flow.card_values or {}).get(name,'?')})"
                 b = ctk.CTkButton(self.grid_frame, text=text, width=160, height=80,
                                   command=lambda n=name: self._on_card_click(n))
                 b.grid(row=r, column=c, padx=8, pady=8)
@@ -682,171 +595,161 @@ class Step1Page(ctk.CTkFrame):
         self.passkey_label.configure(text=f"Selected ({len(self.current_selection)}/7): " + ", ".join(self.current_selection))
 
     def submit_selection(self):
+        if self._lock_job is not None:
+            return
         if len(self.current_selection) != 7:
             messagebox.showwarning("Selection", "Please select exactly 7 distinct cards in sequence.")
             return
-        # Setup mode: generate passkey, save mapping & sequence
+        # Setup mode: generate passkey, save card secret (sequence + hidden values)
         if self.is_setup_mode:
-            # ensure card_values_map exists (it was created in on_show)
-            if not self.card_values_map:
-                values = random.sample(range(10), 9)
-                self.card_values_map = dict(zip(self.cards, values))
-            passkey = generate_passkey_from_selection(self.current_selection, self.card_values_map)
-            # create card_value_set (hidden mapping of original random assignment)
-            card_value_set = ", ".join([f"{k}:{v}" for k, v in self.card_values_map.items()])
-            shown_abbrev = "".join([c[0:2].lower() if c.lower().startswith('j') else c[0].lower() for c in self.current_selection])
-            shown = f"{passkey}({shown_abbrev})"
-            # save passkey and card_sequence in DB (card_values stored in separate column later)
-            with connect_db() as conn:
-                conn.execute("UPDATE users SET passkey=?, card_sequence=? WHERE username=?",
-                             (passkey, f"{','.join(self.current_selection)} | {card_value_set}", self.user_row["username"]))
-                conn.commit()
-            messagebox.showinfo("Passkey Created", f"Your generated passkey: {shown}\n(Please memorize it now)")
-            # after setup, mark user_row updated and continue to welcome
-            # fetch updated user row and proceed
-            with connect_db() as conn:
-                cur = conn.cursor()
-                cur.execute("SELECT * FROM users WHERE username=?", (self.user_row["username"],))
-                new_user = cur.fetchone()
-            self.controller.frames["FingerprintPage"].set_user(new_user)
+            result = self.flow.setup_cards(self.current_selection)
+            if not result.ok:
+                messagebox.showerror("Passkey", result.message)
+                self.current_selection = []
+                self.passkey_label.configure(text="")
+                return
+            messagebox.showinfo("Passkey Created", f"Your generated passkey: {result.shown}\n(Please memorize it now)")
+            # session already reflects the new passkey; continue to fingerprint
+            self.controller.frames["FingerprintPage"].set_flow(self.flow)
             self.controller.show_frame("FingerprintPage")
             return
 
-        # Verification mode:
-        # Fetch stored sequence (original) and stored passkey
-        full_seq_field = self.user_row.get("card_sequence") or ""
-        stored_passkey = (self.user_row.get("passkey") or "")
-        seq_list, hidden_map = parse_card_sequence_field(full_seq_field)
-        # Recompute mapping of first 7 digits of passkey to the seq_list
-        digits_from_passkey = [int(d) for d in stored_passkey if d.isdigit()][:7]
-        mapping_by_passkey = dict(zip(seq_list[:7], digits_from_passkey))
-        # Save mapping into DB column card_values (clean format)
-        if mapping_by_passkey:
-            updated_value_text = ", ".join([f"{k}:{v}" for k, v in mapping_by_passkey.items()])
-            with connect_db() as conn:
-                cur = conn.cursor()
-                cur.execute("UPDATE users SET card_values=? WHERE username=?", (updated_value_text, self.user_row["username"]))
-                conn.commit()
-
-        # Now verify the user's selection equals stored sequence (order) and passkey entered matches
-        # Ask user for passkey via a small prompt
+        # Verification mode: ask for the passkey, the engine compares it and the sequence
         entered_passkey = ctk.CTkInputDialog(text="Enter your 8-digit passkey", title="Passkey").get_input()
         if entered_passkey is None:
             messagebox.showinfo("Cancelled", "Passkey entry cancelled.")
             return
 
-        # Compare normalized sequences
-        attempt_norm = [s.strip().lower() for s in self.current_selection]
-        original_norm = [s.strip().lower() for s in seq_list[:7]]
-        if attempt_norm == original_norm and entered_passkey == stored_passkey:
+        result = self.flow.submit_cards(self.current_selection, entered_passkey)
+        if result.ok:
             messagebox.showinfo("✅Success","user confirmed!")
-            # fetch updated user row and proceed
-            with connect_db() as conn:
-                cur = conn.cursor()
-                cur.execute("SELECT * FROM users WHERE username=?", (self.user_row["username"],))
-                new_user = cur.fetchone()
-            self.controller.frames["FingerprintPage"].set_user(new_user)
+            self.controller.frames["FingerprintPage"].set_flow(self.flow)
             self.controller.show_frame("FingerprintPage")
             return
-        else:
-            # handle fail & lock logic (simple counting as per your original design)
-            # We'll implement local counters stored on this page object
-            if not hasattr(self, "_fail_count"):
-                self._fail_count = 0
-                self._lock_cycles = 0
-                self._lock_time = 60
-            self._fail_count += 1
-            messagebox.showerror("Failed", "Incorrect sequence or passkey.")
-            if self._fail_count % 3 == 0:
-                self._lock_cycles += 1
-                messagebox.showwarning("Locked", f"Locked for {self._lock_time} seconds.")
-                time.sleep(self._lock_time)
-                self._lock_time += 60
-            if self._lock_cycles >= 3:
-                messagebox.showerror("Kicked", "You have reached the trying limit. Log in after 24 hours.")
-                self.controller.show_frame("HomePage")
-                return
-            # reset selection for next try
-            self.current_selection = []
-            self.passkey_label.configure(text="")
+        messagebox.showerror("Failed", "Incorrect sequence or passkey.")
+        if result.status == BANNED:
+            messagebox.showerror("Kicked", result.message)
+            self.back_to_home()
+            return
+        if result.status == LOCKED:
+            messagebox.showwarning("Locked", result.message)
+        # reset selection for next try
+        self.current_selection = []
+        self.passkey_label.configure(text="")
+        if result.status == LOCKED:
+            self._lock_countdown()
 
 # ---------- Fingerprint Page ----------
 class FingerprintPage(ctk.CTkFrame):
+    POLL_MS = 100
+
     def __init__(self, parent, controller):
         super().__init__(parent)
         self.controller = controller
-        self.user_row = None
-        self.attempts = 0
-        self.max_attempts = 3
+        self.flow = None
+        # the biometric check (flow.check_biometric, backend chosen in biometrics.py)
+        # blocks for up to ~20s, so it runs on a worker thread
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="biometric")
+        self._future = None
+        self._poll_job = None
 
         ctk.CTkLabel(self, text="🔒 Fingerprint Authentication", font=ctk.CTkFont(size=20, weight="bold")).pack(pady=18)
         self.info = ctk.CTkLabel(self, text="Use Touch ID to complete login/activation.")
         self.info.pack(pady=8)
+        self.progress = ctk.CTkProgressBar(self, mode="indeterminate", width=260)
+        self.progress.pack(pady=8)
+        self.progress.pack_forget()
 
         btn_frame = ctk.CTkFrame(self)
         btn_frame.pack(pady=12)
-        ctk.CTkButton(btn_frame, text="Start Touch ID", command=self.start_touch).grid(row=0, column=0, padx=8)
-
-    def set_user(self, user_row):
-        self.user_row = user_row
-        self.attempts = 0
+        self.start_btn = ctk.CTkButton(btn_frame, text="Start Touch ID", command=self.start_touch)
+        self.cancel_btn = ctk.CTkButton(btn_frame, text="Cancel", state="disabled", command=self.cancel_touch)
+        self.start_btn.grid(row=0, column=0, padx=8)
+        self.cancel_btn.grid(row=0, column=1, padx=8)
+
+    def set_flow(self, flow):
+        self.cancel_touch()
+        self.flow = flow
         self.info.configure(text="Use Touch ID to complete login/activation.")
 
+    def _set_busy(self, busy):
+        if busy:
+            self.progress.pack(pady=8, before=self.start_btn.master)
+            self.progress.start()
+            self.start_btn.configure(state="disabled")
+            self.cancel_btn.configure(state="normal")
+        else:
+            self.progress.stop()
+            self.progress.pack_forget()
+            self.start_btn.configure(state="normal")
+            self.cancel_btn.configure(state="disabled")
+
     def start_touch(self):
-        if not self.user_row:
+        if not self.flow:
             messagebox.showerror("Error", "No user loaded.")
             return
-        # first-time activation
-        enabled = self.user_row["fingerprint_enabled"]
-        if not enabled:
-            # Try up to max_attempts
-            while self.attempts < self.max_attempts:
-                self.attempts += 1
-                ok = touch_id_auth()
-                if ok:
-                    with connect_db() as conn:
-                        conn.execute("UPDATE users SET fingerprint_enabled=1 WHERE username=?", (self.user_row["username"],))
-                        conn.commit()
-                    messagebox.showinfo("Activated", "✅ Touch ID activated successfully!")
-                    # refresh user and proceed to welcome
-                    with connect_db() as conn:
-                        cur = conn.cursor()
-                        cur.execute("SELECT * FROM users WHERE username=?", (self.user_row["username"],))
-                        new_user = cur.fetchone()
-                    self.controller.frames["WelcomePage"].on_show(user_row=new_user)
-                    self.controller.show_frame("WelcomePage")
-                    return
-                else:
-                    remaining = self.max_attempts - self.attempts
-                    if remaining > 0:
-                        messagebox.showwarning("Failed", f"Touch ID failed. Attempts left: {remaining}")
-                    else:
-                        messagebox.showerror("Failed", "Touch ID failed. You can retry on your next login.")
-                        self.controller.show_frame("HomePage")
-                        return
+        if self._future is not None or self.flow.done:
+            return
+        attempt = self.flow.biometric_attempts + 1
+        self.info.configure(text=f"Waiting for Touch ID... (attempt {attempt}/{ENGINE.max_biometric_attempts})")
+        self._set_busy(True)
+        self._future = self._executor.submit(self.flow.check_biometric)
+        self._poll_job = self.after(self.POLL_MS, self._poll_result)
+
+    def cancel_touch(self):
+        # abort the check in the backend (dismisses the Touch ID prompt); its result is
+        # ignored and not counted as an attempt
+        if self._poll_job is not None:
+            self.after_cancel(self._poll_job)
+            self._poll_job = None
+        if self._future is not None:
+            future, self._future = self._future, None
+            self.flow.cancel_biometric()
+            if not future.cancel() and not future.done():
+                # a backend that cannot be interrupted still holds the worker: use a fresh one
+                self._executor.shutdown(wait=False)
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="biometric")
+            self.info.configure(text="Cancelled. Press Start Touch ID to try again.")
+        self._set_busy(False)
+
+    def _poll_result(self):
+        self._poll_job = None
+        future = self._future
+        if future is None:
+            return
+        if not future.done():
+            self._poll_job = self.after(self.POLL_MS, self._poll_result)
+            return
+        self._future = None
+        self._set_busy(False)
+        try:
+            ok = future.result()
+        except Exception:
+            ok = False
+        self._on_result(ok)
+
+    def _on_result(self, ok):
+        # the engine counts attempts and writes the staged session when the flow ends
+        result = self.flow.submit_biometric(ok)
+        if result.ok:
+            title = "Activated" if result.activated else "Verified"
+            messagebox.showinfo(title, f"✅ {result.message}")
+            self._go_welcome()
+        elif result.status == RETRY:
+            messagebox.showwarning("Failed", result.message)
+            self.start_touch()
         else:
-            # verification flow
-            while self.attempts < self.max_attempts:
-                self.attempts += 1
-                ok = touch_id_auth()
-                if ok:
-                    messagebox.showinfo("Verified", "✅ Fingerprint verified.")
-                    # refresh and go to welcome
-                    with connect_db() as conn:
-                        cur = conn.cursor()
-                        cur.execute("SELECT * FROM users WHERE username=?", (self.user_row["username"],))
-                        new_user = cur.fetchone()
-                    self.controller.frames["WelcomePage"].on_show(user_row=new_user)
-                    self.controller.show_frame("WelcomePage")
-                    return
-                else:
-                    remaining = self.max_attempts - self.attempts
-                    if remaining > 0:
-                        messagebox.showwarning("Mismatch", f"Fingerprint mismatch. Attempts left: {remaining}")
-                    else:
-                        messagebox.showerror("Denied", "Fingerprint mismatch. Maximum attempts reached. Access denied.")
-                        self.controller.show_frame("HomePage")
-                        return            
+            messagebox.showerror("Denied", result.message)
+            self._go_home()
+
+    def _go_welcome(self):
+        self.controller.end_flow()
+        self.controller.frames["WelcomePage"].on_show(user_row=self.flow.user)
+        self.controller.show_frame("WelcomePage")
+
+    def _go_home(self):
+        self.controller.end_flow()
+        self.controller.show_frame("HomePage")
 
 # ---------- Welcome Page ----------
 class WelcomePage(ctk.CTkFrame):
@@ -874,6 +777,6 @@ class WelcomePage(ctk.CTkFrame):
 # ----------------------
 if __name__ == "__main__":
     init_db()
-    add_missing_columns()
+    get_hasher().warm_up()   # calibrate the password hash cost before the first login
     app = TriSecureApp()
     app.mainloop()
\ No newline at end of file
@@ -9,70 +9,29 @@ import sys
 import os
 import subprocess
 
+from auth_engine import BANNED, DENIED, LOCKED, RETRY, AuthEngine
+from biometrics import get_backend
+from card_secret import CARDS
+from db_pool import get_pool
+from keystroke_capture import capture_field
+from migrations import run_migrations
+from otp_service import get_otp_service
+from password_hashing import get_hasher
+from user_ids import next_user_id
+
 DB = "users.db"
+LOGIN_SOURCE = "terminal"   # rate-limit bucket for attempts made from this console
+ENGINE = AuthEngine(DB, source=LOGIN_SOURCE)
+
+# Biometric Authentication (Touch ID by default; backend chosen in biometrics.py)
 
-# Platform-specific single-character input for timing
-try:
-    import msvcrt
-    PLATFORM = "windows"
-except Exception:
-    import tty
-    import termios
-    PLATFORM = "unix"
-
-# NEW: Touch ID Swift Script Auto-Creation
-
-TOUCH_ID_SCRIPT = "touchid.swift"
-TOUCH_ID_SWIFT_CONTENT = """
-import LocalAuthentication
-
-let context = LAContext()
-var error: NSError?
-
-if context.canEvaluatePolicy(.deviceOwnerAuthenticationWithBiometrics, error: &error) {
-    context.evaluatePolicy(.deviceOwnerAuthenticationWithBiometrics, localizedReason: "Authenticate with Touch ID") { success, authenticationError in
-        if success {
-            print("SUCCESS")
-        } else {
-            print("FAILED")
-        }
-        exit(0)
-    }
-} else {
-    print("UNAVAILABLE")
-    exit(0)
-}
-
-RunLoop.main.run()
-"""
-
-def ensure_swift_file():
-    if not os.path.exists(TOUCH_ID_SCRIPT):
-        with open(TOUCH_ID_SCRIPT, "w") as f:
-            f.write(TOUCH_ID_SWIFT_CONTENT)
-
-# NEW: Touch ID Authentication Wrapper
-
-def touch_id_auth():
+def biometric_auth(username):
     """
-    Calls the Swift script to trigger Touch ID.
+    Runs one check on the configured biometric backend.
     Returns True/False depending on success.
     """
-    ensure_swift_file()
-
     try:
-        result = subprocess.run(
-            ["/usr/bin/swift", TOUCH_ID_SCRIPT],
-            capture_output=True,
-            text=True
-        )
-
-        output = result.stdout.strip()
-
-        if "SUCCESS" in output:
-            return True
-        return False
-
+        return get_backend().verify(username)
     except Exception as e:
         print("Touch ID Error:", e)
         return False
@@ -80,148 +39,43 @@ def touch_id_auth():
 
 # Database Connection ---
 def connect_db():
-    conn = sqlite3.connect(DB, timeout=30)
-    conn.row_factory = sqlite3.Row
-    return conn
+    # Reuses this thread's long-lived connection from the shared pool (WAL, statement cache)
+    return get_pool(DB).acquire()
 
-# Initialize Database ---
+# Initialize / upgrade database (versioned migrations, see migrations.py) ---
 def init_db():
-    with connect_db() as conn:
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id TEXT PRIMARY KEY,
-            first_name TEXT,
-            last_name TEXT,
-            dob TEXT,
-            phone TEXT,
-            code_word TEXT,
-            username TEXT UNIQUE,
-            password TEXT,
-            passkey TEXT,
-            card_sequence TEXT,
-            card_values TEXT,
-            typing_wpm INTEGER,
-            typing_intervals TEXT,
-            created_at INTEGER,
-            fingerprint_enabled INTEGER         
-        )
-        """)
-        conn.commit()
-
-# Add Missing Columns ---
-def add_missing_columns():
-    with connect_db() as conn:
-        cur = conn.cursor()
-        cur.execute("PRAGMA table_info(users)")
-        existing_cols = [row["name"] for row in cur.fetchall()]
-        required_cols = {
-            "first_name": "TEXT",
-            "last_name": "TEXT",
-            "passkey": "TEXT",
-            "card_sequence": "TEXT",
-            "card_values": "TEXT",
-            "typing_wpm": "INTEGER",
-            "typing_intervals": "TEXT",
-            "fingerprint_enabled": "INTEGER"
-        }
-        for col, col_type in required_cols.items():
-            if col not in existing_cols:
-                try:
-                    cur.execute(f"ALTER TABLE users ADD COLUMN {col} {col_type}")
-                    conn.commit()
-                except Exception:
-                    pass
-
-# Helper: read a single character with timestamp, cross-platform
-def _read_char_timestamp():
-    if PLATFORM == "windows":
-        ch = msvcrt.getwch()
-        return ch, time.time()
-    else:
-        fd = sys.stdin.fileno()
-        old = termios.tcgetattr(fd)
-        try:
-            tty.setraw(fd)
-            ch = sys.stdin.read(1)
-            return ch, time.time()
-        finally:
-            termios.tcsetattr(fd, termios.TCSADRAIN, old)
+    # Runs pending migrations once; a current schema costs a single PRAGMA read
+    run_migrations(DB)
 
 # Capture typed input per-character (shows prompt; optionally mask)
 def capture_typed(prompt, mask=False):
     """
     Returns: typed_string, intervals_list_ms, total_duration_seconds
-    intervals_list_ms: list of intervals between consecutive keypress timestamps in milliseconds
+    Raw mode is entered once for the whole field; keys are stamped with
+    perf_counter_ns (see keystroke_capture.py).
     """
-    print(prompt, end="", flush=True)
-    chars = []
-    timestamps = []
-
-    while True:
-        ch, ts = _read_char_timestamp()
-        # Enter/Return
-        if ch in ("\r", "\n"):
-            print("")  # newline after enter
-            break
-        # Backspace (Windows '\x08', Unix '\x7f')
-        if ch in ("\x08", "\x7f"):
-            if chars:
-                chars.pop()
-                timestamps.pop()
-                # Erase character from console display
-                sys.stdout.write("\b \b")
-                sys.stdout.flush()
-            continue
-        # Ctrl-C -> raise KeyboardInterrupt
-        if ord(ch) == 3:
-            raise KeyboardInterrupt
-        # Printable characters
-        chars.append(ch)
-        timestamps.append(ts)
-        if mask:
-            sys.stdout.write("*")
-        else:
-            sys.stdout.write(ch)
-        sys.stdout.flush()
-
-    # compute intervals between consecutive keystrokes in milliseconds
-    intervals_ms = []
-    for i in range(1, len(timestamps)):
-        intervals_ms.append(int((timestamps[i] - timestamps[i - 1]) * 1000))
-    total_duration = (timestamps[-1] - timestamps[0]) if len(timestamps) >= 2 else 0.0
-    typed = "".join(chars)
-    return typed, intervals_ms, total_duration
-
-# Compute WPM from character count and duration_seconds
-def compute_wpm(total_chars, duration_seconds):
-    if duration_seconds <= 0:
-        return 0
-    words = total_chars / 5.0
-    minutes = duration_seconds / 60.0
-    wpm = words / minutes
-    return int(round(wpm))
+    return capture_field(prompt, mask=mask)
 
 # OTP Verification ---
 def otp_verification(phone=None):
-    otp = random.randint(1000, 9999)
-    if phone:
-        print(f"\n Sending OTP to {phone}...")
-    time.sleep(1)
-    print(f"Your OTP is: {otp}")
-    attempts = 0
-    while attempts < 3:
+    service = get_otp_service()
+    # issuing is non-blocking; only wait here until the code has been shown
+    ticket = service.issue(phone or "console")
+    ticket.delivery.result(timeout=10)
+    while True:
         entered = input("Enter OTP: ").strip()
-        if entered == str(otp):
+        status, left = service.verify(ticket.key, entered)
+        if status == "ok":
             print("✅ OTP verified.")
             return True
+        if status == "wrong":
+            print(f"❌ Incorrect OTP. Attempts left: {left}")
+        elif status == "expired":
+            print("❌ OTP expired. Please try again.")
+            return False
         else:
-            attempts += 1
-            if attempts < 3:
-                print(f"❌ Incorrect OTP. Attempts left: {3 - attempts}")
-            else:
-                print("❌ Incorrect OTP. Maximum attempts reached.")
-                return False
-    return False
+            print("❌ Incorrect OTP. Maximum attempts reached.")
+            return False
 
 # Register New User ---
 def register_user():
@@ -275,40 +129,45 @@ def register_user():
         print("Username and password cannot be empty.")
         return
 
-    with connect_db() as conn:
-        cur = conn.cursor()
-        while True:
-            user_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=7))
-            cur.execute("SELECT 1 FROM users WHERE id=?", (user_id,))
-            if not cur.fetchone():
-                break
-
     try:
+        hasher = get_hasher()
+        password_hash = hasher.hash(password)
+        code_word_hash = hasher.hash_code_word(code_word)
         with connect_db() as conn:
             cur = conn.cursor()
             cur.execute("SELECT 1 FROM users WHERE username=?", (username,))
             if cur.fetchone():
                 print("Username already exists. Try another one.")
                 return
-            cur.execute("""
-                INSERT INTO users (
-                    id, first_name, last_name, dob, phone, code_word, username, password, created_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (user_id, first_name, last_name, dob, phone, code_word, username, password, int(time.time())))
+            while True:
+                # IDs come from the permuted sequence, no DB lookup needed
+                user_id = next_user_id(DB)
+                try:
+                    cur.execute("""
+                        INSERT INTO users (
+                            id, first_name, last_name, dob, phone, code_word, username, password, created_at
+                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """, (user_id, first_name, last_name, dob, phone, code_word_hash, username, password_hash,
+                          int(time.time())))
+                except sqlite3.IntegrityError as e:
+                    # only possible against an old random ID; take the next one
+                    if "users.id" in str(e):
+                        continue
+                    raise
+                break
             conn.commit()
             print(f"✅ Registration successful! Your User ID: {user_id}")
     except Exception as e:
         print("Error:", e)
 
 # ---- Poker Card Security System ----
-def step1_poker_security(user):
-    cards = ["Spade", "Heart", "Diamond", "Club", "Ace", "King", "Queen", "Jack", "Joker"]
+def step1_poker_security(flow):
+    cards = list(CARDS)
 
     # --- New User Setup ---
-    if not user["passkey"]:
+    if flow.needs_card_setup:
         print("\n--- Poker Card Security Setup ---")
-        values = random.sample(range(10), 9)
-        card_values = dict(zip(cards, values))
+        flow.new_card_values()
 
         print("\nSelect 7 cards in sequence:\n")
         for i in range(3):
@@ -323,78 +182,27 @@ def step1_poker_security(user):
             else:
                 print("Invalid or duplicate card. Try again.")
 
-        numbers = [card_values[c] for c in selection]
-        results = []
-        for x in numbers:
-            val = 3 * x + 1
-            # If result is >=10, take last digit (as requested)
-            if val >= 10:
-                val = int(str(val)[-1])
-            results.append(val)
-
-        joined = "".join(str(r) for r in results)
-        passkey = joined[:7]
-
-        # insert a random digit (0–9) into a random position to make it 8 digits
-        random_digit = str(random.randint(0, 9))
-        pos = random.randint(0, len(passkey))
-        passkey = passkey[:pos] + random_digit + passkey[pos:]
-
-        card_value_set = ", ".join([f"{k}:{v}" for k, v in card_values.items()])
-
-        with connect_db() as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT 1 FROM users WHERE passkey=?", (passkey,))
-            if cur.fetchone():
-                # ensure still 8 characters: replace inserted random digit with a different digit
-                new_digit = str((int(random_digit) + 1) % 10)
-                passkey = passkey[:pos] + new_digit + passkey[pos:]
-
-        abbrev = "".join([c[0:2].lower() if c.lower().startswith('j') else c[0].lower() for c in selection])
-        shown = f"{passkey}({abbrev})"
+        result = flow.setup_cards(selection)
+        if not result.ok:
+            print(f"❌ {result.message} Please log in again.")
+            return False
 
-        print(f"\nYour generated passkey: {shown}")
+        print(f"\nYour generated passkey: {result.shown}")
         print("⚠️ Remember this passkey and sequence for future logins!\n")
-
-        with connect_db() as conn:
-            conn.execute("UPDATE users SET passkey=?, card_sequence=? WHERE username=?",
-                         (passkey, f"{','.join(selection)} | {card_value_set}", user["username"]))
-            conn.commit()
         return True
 
     # --- Existing User Verification ---
     else:
         print("\n ---- Verify Your Poker Card Sequence ----")
 
-        full_sequence_field = user["card_sequence"] or ""
-        stored_passkey = user["passkey"] or ""
-
-        # Split the card_sequence field cleanly — only take the part before '|'
-        if " | " in full_sequence_field:
-            sequence_part, _ = full_sequence_field.split(" | ", 1)
-        else:
-            sequence_part = full_sequence_field
-
-        stored_sequence = [s.strip() for s in sequence_part.split(",") if s.strip()]
-        numeric_values = [int(d) for d in stored_passkey if d.isdigit()][:7]
-        mapped_cards = stored_sequence[:7]
-        card_values_by_passkey = dict(zip(mapped_cards, numeric_values))
-
-        # Format properly for DB
-        updated_value_text = ", ".join([f"{k}:{v}" for k, v in card_values_by_passkey.items()])
-
-        # Save updated card values in dedicated column so it's clean
-        with connect_db() as conn:
-            cur = conn.cursor()
-            cur.execute("UPDATE users SET card_values=? WHERE username=?", (updated_value_text, user["username"]))
-            conn.commit()
-
-        original_seq = [s for s in stored_sequence]
-        lock_time = 60
-        fail_count = 0
-        lock_cycles = 0
-
         while True:
+            # locks are persisted (lock-until timestamp), so nothing sleeps here
+            remaining = flow.lock_remaining()
+            if remaining > 0:
+                print(f"⏳ Locked. Try again in {remaining} seconds.")
+                input("Press Enter to try again...")
+                continue
+
             shuffled_cards = cards[:]
             random.shuffle(shuffled_cards)
             print("\nSelect your 7 cards in correct sequence:")
@@ -409,23 +217,18 @@ def step1_poker_security(user):
 
             pass_input = input("Enter your 8-digit passkey: ").strip()
 
-            if [a.lower() for a in attempt] == [s.lower() for s in original_seq] and pass_input == stored_passkey:
-                print("\n✅ Step 1 passed successfully!")
+            result = flow.submit_cards(attempt, pass_input)
+            if result.ok:
+                print(f"\n✅ {result.message}")
                 return True
-            else:
-                fail_count += 1
-                print("❌ Incorrect sequence or passkey.")
-                if fail_count % 3 == 0:
-                    lock_cycles += 1
-                    print(f"⏳ Locked for {lock_time} seconds.")
-                    time.sleep(lock_time)
-                    lock_time += 60
-                if lock_cycles >= 3:
-                    print("\n🚫 You have reached the trying limit. Log in after 24 hours.")
-                    return False
-        return False
+            print("❌ Incorrect sequence or passkey.")
+            if result.status == LOCKED:
+                print(f"⏳ {result.message}")
+            elif result.status == BANNED:
+                print(f"\n🚫 {result.message}")
+                return False
 
-# NEW: capture typing during login, save first-time profile, detect bots and compare WPM
+# NEW: capture typing during login, then let the engine check password + typing profile
 def login_user():
     print("\n--- Login (typing profiling enabled) ---")
     # Capture username with timing (per-character)
@@ -443,140 +246,57 @@ def login_user():
         print("\nInterrupted.")
         return None
 
-    # Combine metrics
-    total_chars = len(typed_username) + len(typed_password)
-    # total duration: if both have durations use sum, else recompute from intervals if needed
-    total_duration = (u_duration or 0.0) + (p_duration or 0.0)
-    # Combined intervals: use username intervals then password intervals (phone-like)
-    combined_intervals = u_intervals + p_intervals
-
-    # Compute WPM
-    wpm = compute_wpm(total_chars, total_duration)
-
-    # Lookup credentials (use typed_username & typed_password)
-    with connect_db() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM users WHERE username=? AND password=?", (typed_username, typed_password))  
-        user = cur.fetchone()
-
-    if not user:
-        print("❌ Invalid username or password.")
-        return None
-
-    # Check if this is first successful login regarding typing profile
-    stored_wpm = user["typing_wpm"]
-    stored_intervals_field = user["typing_intervals"]
-    if not stored_wpm:
-        # first-time: store wpm and intervals string
-        intervals_str = ",".join(str(i) for i in combined_intervals)
-        with connect_db() as conn:
-            conn.execute("UPDATE users SET typing_wpm=?, typing_intervals=? WHERE username=?",
-                         (wpm, intervals_str, typed_username))
-            conn.commit()
-        print(f"✅ Login successful! (Typing profile recorded: {wpm} wpm)")
-        return user
+    # Combined intervals: username intervals then password intervals; durations summed
+    flow = ENGINE.start()
+    result = flow.submit_password(typed_username, typed_password,
+                                  intervals=u_intervals + p_intervals,
+                                  duration=(u_duration or 0.0) + (p_duration or 0.0))
+    if result.ok:
+        print(f"✅ Login successful! ({result.message})")
+        return flow
+    if result.status == BANNED:
+        print(f"🚫 {result.message}")
+    elif result.status == LOCKED:
+        print(f"⏳ {result.message}")
+    elif result.status == DENIED:
+        print(f"❌ {result.message} Access denied.")
     else:
-        # Subsequent login: compare WPM within tolerance and detect bots by interval variance
-        try:
-            stored_wpm_val = int(stored_wpm)
-        except Exception:
-            stored_wpm_val = stored_wpm or 0
-
-        # choose tolerance; user wanted +- flexibility — use +-25 wpm (reasonable)
-        tol = 25
-        if not (stored_wpm_val - tol <= wpm <= stored_wpm_val + tol):
-            print(f"❌ Typing speed mismatch. Recorded: {stored_wpm_val} wpm, Now: {wpm} wpm. Access denied.")
-            return None
-
-        # bot detection: check if combined_intervals are too uniform (low stddev)
-        import statistics
-        if len(combined_intervals) >= 3:
-            try:
-                stddev = statistics.pstdev(combined_intervals)
-            except Exception:
-                stddev = None
-        else:
-            stddev = None
-
-        # If stddev is extremely low (e.g., < 8 ms), suspect bot
-        if stddev is not None and stddev < 8:
-            print("❌ Keystroke timing looks artificial (bot-like). Access denied.")
-            return None
-
-        # otherwise accept; do not overwrite stored profile
-        print("✅ Login successful! Typing profile matched.")
-        return user
+        print(f"❌ {result.message}")
+    return None
 
 # Security Question ---
-def security_question(user):
+def security_question(flow):
     print("\nSecurity Question:")
-    attempts = 0
-    while attempts < 3:
-        answer = input("What is your code word? ").strip().lower()
-        stored = (user["code_word"] or "").strip().lower()
-        if answer == stored:
-            print("✅ Security question passed.")
+    while True:
+        result = flow.submit_code_word(input("What is your code word? "))
+        if result.ok:
+            print(f"✅ {result.message}")
             return True
-        else:
-            attempts += 1
-            if attempts < 3:
-                print(f"Wrong code word. Attempts left: {3 - attempts}")
-            else:
-                print("❌ Wrong code word.")
-                return False
+        if result.status != RETRY:
+            print(f"❌ {result.message}")
+            return False
+        print(result.message)
 
-# NEW STEP 3 — MACBOOK FINGERPRINT BIOMETRIC AUTH
-# STEP 3 — MACBOOK FINGERPRINT BIOMETRIC AUTH (persistent retry for new users)
-# NEW STEP 3 — MACBOOK FINGERPRINT BIOMETRIC AUTH
-def step3_fingerprint(user):
+# STEP 3 — MACBOOK FINGERPRINT BIOMETRIC AUTH (activation for new users, verification after)
+def step3_fingerprint(flow):
     print("\n---- Fingerprint Authentication ----")
-
-    max_attempts = 3
-    attempts = 0
-
-    # First-time setup: enable fingerprint
-    if not user["fingerprint_enabled"]:
-        while attempts < max_attempts:
+    while True:
+        if flow.biometric_setup:
             print("Please verify Touch ID to activate fingerprint login...")
-            if touch_id_auth():
-                with connect_db() as conn:
-                    conn.execute(
-                        "UPDATE users SET fingerprint_enabled=1 WHERE username=?",
-                        (user["username"],)
-                    )
-                    conn.commit()
-                # Update the user dict locally so next check sees it
-                user = dict(user)
-                user["fingerprint_enabled"] = 1
-                print("✅ Touch ID activated successfully!")
-                return True
-            else:
-                attempts += 1
-                if attempts < max_attempts:
-                    print(f"❌ Touch ID failed. Attempts left: {max_attempts - attempts}")
-                else:
-                    print("❌ Touch ID failed. You can retry on your next login.")
-                    return False
-
-    # Subsequent login: verify fingerprint
-    else:
-        while attempts < max_attempts:
+        else:
             print("Touch ID required...")
-            if touch_id_auth():
-                print("✅ Fingerprint verified.")
-                return True
-            else:
-                attempts += 1
-                if attempts < max_attempts:
-                    print(f"❌ Fingerprint mismatch. Attempts left: {max_attempts - attempts}")
-                else:
-                    print("❌ Fingerprint mismatch. Maximum attempts reached. Access denied.")
-                    return False
-                
+        result = flow.submit_biometric(biometric_auth(flow.username))
+        if result.ok:
+            print(f"✅ {result.message}")
+            return True
+        print(f"❌ {result.message}")
+        if result.status != RETRY:
+            return False
+
 # Main Security Interface ---
 def security_interface():
     init_db()
-    add_missing_columns()
+    get_hasher().warm_up()
     print("\n=== Secure Access Interface ===")
     while True:
         print("\n1) Register")
@@ -586,17 +306,22 @@ def security_interface():
         if choice == "1":
             register_user()
         elif choice == "2":
-            user = login_user()
-            if not user:
-                continue
-            if not security_question(user):
-                print("Access Denied.")
-                continue
-            if not step1_poker_security(user):
+            flow = login_user()
+            if not flow:
                 continue
-            if not step3_fingerprint(user):
-                continue
-            print(f"\n Access Granted! Welcome {user['first_name']} {user['last_name']}")
+            try:
+                if not security_question(flow):
+                    print("Access Denied.")
+                    continue
+                if not step1_poker_security(flow):
+                    continue
+                if not step3_fingerprint(flow):
+                    continue
+                user = flow.user
+                print(f"\n Access Granted! Welcome {user['first_name']} {user['last_name']}")
+            finally:
+                # end of the login flow: apply all staged updates in one write
+                flow.finish()
         elif choice == "3":
             print("Goodbye!")
             break
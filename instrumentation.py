@@ -0,0 +1,309 @@
+import atexit
+import bisect
+import logging
+import os
+import threading
+import time
+
+# ----------------------
+# Spans and counters for the auth flow
+# ----------------------
+# Off by default. Turn on with TRISECURE_TRACE, a comma-separated list of exporters:
+#   log                      one log line per span (logger "trisecure.trace")
+#   histogram                in-memory histograms, read with snapshot()
+#   prometheus:<path>        histograms written to <path> in Prometheus text format
+# e.g. TRISECURE_TRACE="histogram,prometheus:/tmp/trisecure.prom"
+#
+# While disabled, span() returns one shared no-op object and count() returns at
+# once, so instrumented code pays a function call and a flag check.
+
+TRACE = os.environ.get("TRISECURE_TRACE", "")
+PROMETHEUS_INTERVAL = float(os.environ.get("TRISECURE_TRACE_INTERVAL", "10"))
+# histogram bucket upper bounds, seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_enabled = False
+_exporters = ()
+_config_lock = threading.Lock()
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **labels):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("name", "labels", "started", "seconds")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.started = 0
+        self.seconds = 0.0
+
+    def set(self, **labels):
+        """Add labels discovered inside the span (e.g. the step's result status)."""
+        self.labels.update(labels)
+
+    def __enter__(self):
+        self.started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = (time.perf_counter_ns() - self.started) / 1e9
+        if exc_type is not None:
+            self.labels["error"] = exc_type.__name__
+        for exporter in _exporters:
+            exporter.on_span(self.name, self.seconds, self.labels)
+        return False
+
+
+def span(name, **labels):
+    """with span("db.authenticate"): ...  — times the block when tracing is on."""
+    if not _enabled:
+        return _NOOP
+    return Span(name, labels)
+
+
+def count(name, value=1, **labels):
+    if not _enabled:
+        return
+    for exporter in _exporters:
+        exporter.on_count(name, value, labels)
+
+
+def observe(name, seconds, **labels):
+    """Record a duration measured elsewhere (another thread or a worker process) as a span."""
+    if not _enabled:
+        return
+    for exporter in _exporters:
+        exporter.on_span(name, seconds, labels)
+
+
+# ----------------------
+# Exporters
+# ----------------------
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class LogExporter:
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger("trisecure.trace")
+        self.level = level
+
+    def on_span(self, name, seconds, labels):
+        self.logger.log(self.level, "span %s %.3fms %s", name, seconds * 1000,
+                        " ".join(f"{k}={v}" for k, v in labels.items()))
+
+    def on_count(self, name, value, labels):
+        self.logger.log(self.level, "count %s +%s %s", name, value,
+                        " ".join(f"{k}={v}" for k, v in labels.items()))
+
+    def close(self):
+        pass
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "n")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)    # last slot is +Inf
+        self.total = 0.0
+        self.n = 0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.n += 1
+
+    def quantile(self, q):
+        """Bucket upper bound containing the q-quantile (an upper estimate)."""
+        if not self.n:
+            return 0.0
+        rank = q * self.n
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else float("inf")
+        return float("inf")
+
+
+class HistogramExporter:
+    """Aggregates spans into fixed-bucket histograms and counters, in memory."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}    # (name, label_key) -> Histogram
+        self.counters = {}      # (name, label_key) -> number
+
+    def on_span(self, name, seconds, labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.add(seconds)
+
+    def on_count(self, name, value, labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def snapshot(self):
+        """{"spans": {name: {count, mean_ms, p50_ms, p95_ms, p99_ms}}, "counters": {...}} merged over labels."""
+        with self._lock:
+            merged = {}
+            for (name, _), hist in self.histograms.items():
+                target = merged.get(name)
+                if target is None:
+                    target = merged[name] = Histogram()
+                target.counts = [a + b for a, b in zip(target.counts, hist.counts)]
+                target.total += hist.total
+                target.n += hist.n
+            counters = {}
+            for (name, labels), value in self.counters.items():
+                label_text = ",".join(f"{k}={v}" for k, v in labels)
+                counters[f"{name}{{{label_text}}}" if label_text else name] = value
+        spans = {name: {"count": h.n,
+                        "mean_ms": round(h.total / h.n * 1000, 3) if h.n else 0.0,
+                        "p50_ms": h.quantile(0.50) * 1000,
+                        "p95_ms": h.quantile(0.95) * 1000,
+                        "p99_ms": h.quantile(0.99) * 1000}
+                 for name, h in merged.items()}
+        return {"spans": spans, "counters": counters}
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def close(self):
+        pass
+
+
+def _metric_name(name):
+    return "trisecure_" + "".join(c if c.isalnum() else "_" for c in name)
+
+
+def _prom_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class PrometheusFileExporter(HistogramExporter):
+    """
+    Histograms/counters written to a text file for node_exporter's textfile
+    collector. Rewritten atomically every `interval` seconds and on close().
+    """
+    def __init__(self, path, interval=PROMETHEUS_INTERVAL):
+        super().__init__()
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        if interval > 0:
+            self._thread = threading.Thread(target=self._loop, name="trace-prometheus", daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def render(self):
+        lines = ["# TYPE trisecure_span_seconds histogram"]
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        for (name, labels), hist in histograms:
+            base = (("span", name),) + labels
+            cumulative = 0
+            for bound, c in zip(BUCKETS + (float("inf"),), hist.counts):
+                cumulative += c
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"trisecure_span_seconds_bucket{_prom_labels(base + (('le', le),))} {cumulative}")
+            lines.append(f"trisecure_span_seconds_sum{_prom_labels(base)} {hist.total}")
+            lines.append(f"trisecure_span_seconds_count{_prom_labels(base)} {hist.n}")
+        for name in sorted({name for (name, _), _ in counters}):
+            lines.append(f"# TYPE {_metric_name(name)}_total counter")
+        for (name, labels), value in counters:
+            lines.append(f"{_metric_name(name)}_total{_prom_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render())
+        os.replace(tmp, self.path)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+        self.write()
+
+
+# ----------------------
+# Configuration
+# ----------------------
+def enable(*exporters):
+    """Turn tracing on with the given exporters (replacing any current ones)."""
+    global _enabled, _exporters
+    with _config_lock:
+        old, _exporters = _exporters, tuple(exporters)
+        _enabled = bool(_exporters)
+    for exporter in old:
+        if exporter not in exporters:
+            exporter.close()
+
+
+def disable():
+    enable()
+
+
+def exporters():
+    return _exporters
+
+
+def histogram():
+    """The first in-memory histogram exporter (Prometheus ones included), or None."""
+    for exporter in _exporters:
+        if isinstance(exporter, HistogramExporter):
+            return exporter
+    return None
+
+
+def exporters_from_spec(spec):
+    result = []
+    for item in (s.strip() for s in spec.split(",")):
+        if not item:
+            continue
+        kind, _, arg = item.partition(":")
+        if kind == "log":
+            logging.basicConfig(level=logging.INFO)     # no-op if the app configured logging
+            result.append(LogExporter())
+        elif kind == "histogram":
+            result.append(HistogramExporter())
+        elif kind == "prometheus":
+            result.append(PrometheusFileExporter(arg or "trisecure.prom"))
+        else:
+            raise ValueError(f"unknown trace exporter: {item}")
+    return result
+
+
+if TRACE:
+    enable(*exporters_from_spec(TRACE))
+    atexit.register(disable)     # final Prometheus write on exit
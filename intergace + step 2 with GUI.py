@@ -9,6 +9,10 @@ import string
 import customtkinter as ctk
 from tkinter import messagebox, simpledialog
 
+from migrations import run_migrations
+from user_ids import next_user_id
+from validators import validate_dob_str, validate_phone_str
+
 DB = "users.db"
 
 
@@ -78,44 +82,8 @@ def otp_simulate_and_verify(phone, parent):
             return False
     return False
 
-# ---------------------------
-# Small validation utilities re-used by GUI handlers
-# ---------------------------
-def validate_dob_str(dob_str):
-    try:
-        parsed = datetime.strptime(dob_str, "%d/%m/%Y")
-    except Exception:
-        return False, "Invalid format — use dd/mm/yyyy"
-    day, month, year = parsed.day, parsed.month, parsed.year
-    if not (1 <= day <= 31):
-        return False, "Day must be between 1 and 31"
-    if not (1 <= month <= 12):
-        return False, "Month must be between 1 and 12"
-    if year > 2025:
-        return False, "Year cannot be greater than 2025"
-    return True, ""
-
-def validate_phone_str(phone):
-    if not phone:
-        return False, "Phone number required"
-    if not phone.isdigit():
-        return False, "Phone must contain digits only"
-    if len(phone) != 11:
-        return False, "Phone must be exactly 11 digits"
-    if not phone.startswith("01"):
-        return False, "Phone must start with '01'"
-    if phone[2] not in "3456789":
-        return False, "3rd digit must be between 3 and 9"
-    return True, ""
-
 def generate_unique_user_id():
-    with connect_db() as conn:
-        cur = conn.cursor()
-        while True:
-            user_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=7))
-            cur.execute("SELECT 1 FROM users WHERE id=?", (user_id,))
-            if not cur.fetchone():
-                return user_id
+    return next_user_id(DB)
 
 # ---------------------------
 # GUI App (CustomTkinter)
@@ -137,6 +105,8 @@ class SecureApp(ctk.CTk):
         # init DB
         init_db()
         add_missing_columns()
+        # shared schema (id_sequence for user IDs, indexes) comes from the numbered migrations
+        run_migrations(DB)
 
         # pages container
         self.container = ctk.CTkFrame(self)
@@ -0,0 +1,187 @@
+import codecs
+import os
+import select
+import sys
+import time
+from array import array
+
+try:
+    import msvcrt
+    PLATFORM = "windows"
+except ImportError:
+    import termios
+    import tty
+    PLATFORM = "unix"
+
+# ----------------------
+# Terminal keystroke capture
+# ----------------------
+# The terminal is switched to raw mode once per field, not once per key, and
+# keys are read straight from the file descriptor (select + os.read), each read
+# stamped with time.perf_counter_ns(). That keeps mode-switch syscalls out of the
+# measured intervals.
+
+ENTER = ("\r", "\n")
+BACKSPACE = ("\x08", "\x7f")
+CTRL_C = "\x03"
+CTRL_D = "\x04"
+ESC = "\x1b"
+READ_SIZE = 64
+
+
+class RawTerminal:
+    """Context manager: raw mode on entry, restored on exit (Unix)."""
+    def __init__(self, fd=None):
+        self.fd = sys.stdin.fileno() if fd is None else fd
+        self._saved = None
+
+    def __enter__(self):
+        if PLATFORM == "unix":
+            self._saved = termios.tcgetattr(self.fd)
+            tty.setraw(self.fd)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._saved is not None:
+            termios.tcsetattr(self.fd, termios.TCSADRAIN, self._saved)
+            self._saved = None
+        return False
+
+    def keys(self, timeout=None):
+        """Yield (char, perf_counter_ns) until the caller stops; raises TimeoutError if idle too long."""
+        if PLATFORM == "windows":
+            while True:
+                ch = msvcrt.getwch()
+                yield ch, time.perf_counter_ns()
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while True:
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+            if not ready:
+                raise TimeoutError("no keystroke within timeout")
+            data = os.read(self.fd, READ_SIZE)
+            stamp = time.perf_counter_ns()
+            if not data:
+                yield CTRL_D, stamp
+                continue
+            # several keys in one read (fast typing, paste) share the read's timestamp
+            for ch in decoder.decode(data):
+                yield ch, stamp
+
+
+def intervals_from_stamps(stamps_ns):
+    """Key timestamps (ns) -> (intervals in whole ms, duration in seconds)."""
+    intervals = [(stamps_ns[i] - stamps_ns[i - 1]) // 1_000_000 for i in range(1, len(stamps_ns))]
+    duration = (stamps_ns[-1] - stamps_ns[0]) / 1e9 if len(stamps_ns) >= 2 else 0.0
+    return intervals, duration
+
+
+def capture_field(prompt, mask=False, timeout=None, fd=None, out=None):
+    """
+    Read one line with per-key timing.
+    Returns (typed_string, intervals_ms, total_duration_seconds); backspaced keys
+    are dropped along with their timestamps. Without a TTY (piped input) the line
+    is read normally and no timing is returned.
+    """
+    out = out or sys.stdout
+    out.write(prompt)
+    out.flush()
+    fd = sys.stdin.fileno() if fd is None else fd
+    if PLATFORM == "unix" and not os.isatty(fd):
+        line = sys.stdin.readline()
+        if not line:
+            raise EOFError
+        return line.rstrip("\r\n"), [], 0.0
+
+    chars = []
+    stamps = []
+    in_escape = False
+    with RawTerminal(fd) as term:
+        for ch, stamp in term.keys(timeout):
+            # arrow/function keys arrive as ESC [ ... final-letter; ignore the whole sequence
+            if in_escape:
+                if ch.isalpha() or ch == "~":
+                    in_escape = False
+                continue
+            if ch == ESC:
+                in_escape = True
+                continue
+            if ch in ENTER:
+                break
+            if ch in BACKSPACE:
+                if chars:
+                    chars.pop()
+                    stamps.pop()
+                    out.write("\b \b")
+                    out.flush()
+                continue
+            if ch == CTRL_C:
+                raise KeyboardInterrupt
+            if ch == CTRL_D:
+                if not chars:
+                    raise EOFError
+                continue
+            if not ch.isprintable():
+                continue
+            chars.append(ch)
+            stamps.append(stamp)
+            out.write("*" if mask else ch)
+            out.flush()
+    # raw mode disables output post-processing, so the newline is written after restoring
+    out.write("\n")
+    out.flush()
+    intervals, duration = intervals_from_stamps(stamps)
+    return "".join(chars), intervals, duration
+
+
+# ----------------------
+# GUI keystroke recorder (key presses)
+# ----------------------
+class KeystrokeRecorder:
+    """
+    Records key-down times (monotonic ns) for one text field into a
+    preallocated array. Only keys still present in the field are "live":
+    backspace() drops the last one, and sync() starts over when the field was
+    edited some other way (paste, cut, mid-text delete) so events never drift
+    out of line with the text.
+    """
+    def __init__(self, capacity=128):
+        self.capacity = capacity
+        self.pressed = array("q", bytes(8 * capacity))
+        self.count = 0
+        self.edited = False
+
+    def clear(self):
+        self.count = 0
+        self.edited = False
+
+    def _grow(self):
+        self.pressed.frombytes(bytes(8 * self.capacity))
+        self.capacity *= 2
+
+    def press(self, t_ns=None):
+        if self.count == self.capacity:
+            self._grow()
+        self.pressed[self.count] = time.monotonic_ns() if t_ns is None else t_ns
+        self.count += 1
+
+    def backspace(self):
+        if self.count:
+            self.count -= 1
+            self.edited = True
+
+    def sync(self, text_length):
+        """Call after the field changed; restarts recording if events and text disagree."""
+        if self.count != text_length:
+            self.count = 0
+            self.edited = True
+            return False
+        return True
+
+    # --- features (the typing profile's inputs) ---
+    def intervals_ms(self):
+        """Press-to-press latency between consecutive keys (whole ms), the stored profile format."""
+        p = self.pressed
+        return [(p[i] - p[i - 1]) // 1_000_000 for i in range(1, self.count)]
+
+    def duration(self):
+        return (self.pressed[self.count - 1] - self.pressed[0]) / 1e9 if self.count >= 2 else 0.0
@@ -0,0 +1,134 @@
+import os
+
+try:
+    import numpy as np
+except ImportError:         # optional: without NumPy the login falls back to the WPM check
+    np = None
+
+from typing_store import FORMAT_U16, decode_intervals
+
+# ----------------------
+# Keystroke-dynamics scoring (replaces the WPM +-25 comparison when NumPy is available)
+# ----------------------
+# A template holds, for every inter-key position of the user's username+password,
+# the mean and standard deviation of the interval in ms. A new sample is scored as
+# the mean absolute z-distance over the positions it shares with the template
+# (scaled Manhattan distance), plus a penalty for extra/missing keystrokes.
+# Lower is closer; a score above THRESHOLD is rejected.
+
+HAVE_NUMPY = np is not None
+THRESHOLD = float(os.environ.get("TRISECURE_KEYSTROKE_THRESHOLD", "1.4"))
+MIN_STD_MS = 30.0           # floor for the per-position spread (a single stored sample has none)
+REL_STD = 0.35              # ... or this fraction of the position's mean, whichever is larger
+LENGTH_PENALTY = 0.5        # added per missing/extra interval, as a fraction of the compared length
+BOT_STDDEV_MS = 8           # same rule as before: near-constant intervals are scripted
+
+
+class KeystrokeTemplate:
+    """Per-position interval statistics (ms) for one user."""
+    def __init__(self, mean, std, samples=1):
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.std = np.maximum(np.asarray(std, dtype=np.float64),
+                              np.maximum(MIN_STD_MS, REL_STD * self.mean))
+        self.samples = samples
+
+    def __len__(self):
+        return len(self.mean)
+
+    @classmethod
+    def from_samples(cls, samples):
+        """Build from one or more interval sequences (lengths may differ; NaN-padded)."""
+        matrix = as_matrix(samples)
+        if matrix.size == 0:
+            return cls([], [], 0)
+        counts = np.sum(~np.isnan(matrix), axis=0)
+        keep = counts > 0
+        matrix = matrix[:, keep]
+        mean = np.nanmean(matrix, axis=0)
+        std = np.nanstd(matrix, axis=0) if len(matrix) > 1 else np.zeros_like(mean)
+        return cls(mean, std, len(matrix))
+
+    @classmethod
+    def from_stored(cls, value):
+        """From the users.typing_intervals column (blob read zero-copy, legacy text decoded)."""
+        if isinstance(value, (bytes, bytearray, memoryview)) and len(value) > 1 and value[0] == FORMAT_U16:
+            intervals = np.frombuffer(value, dtype="<u2", offset=1).astype(np.float64)
+        else:
+            intervals = np.asarray(decode_intervals(value), dtype=np.float64)
+        return cls.from_samples([intervals])
+
+
+def as_matrix(samples):
+    """List of interval sequences -> 2-D float array, rows padded with NaN to the longest."""
+    rows = [np.asarray(s, dtype=np.float64).ravel() for s in samples]
+    width = max((len(r) for r in rows), default=0)
+    matrix = np.full((len(rows), width), np.nan)
+    for i, row in enumerate(rows):
+        matrix[i, :len(row)] = row
+    return matrix
+
+
+def _lengths(matrix):
+    return np.sum(~np.isnan(matrix), axis=1)
+
+
+def score_batch(template, samples):
+    """Distance of each sample to the template, in one vectorized pass. Returns an array."""
+    matrix = samples if isinstance(samples, np.ndarray) and samples.ndim == 2 else as_matrix(samples)
+    n_rows = matrix.shape[0]
+    width = len(template)
+    if width == 0 or matrix.shape[1] == 0:
+        return np.full(n_rows, np.inf)
+    # align widths: extra sample columns are ignored here and penalised below
+    if matrix.shape[1] < width:
+        matrix = np.pad(matrix, ((0, 0), (0, width - matrix.shape[1])), constant_values=np.nan)
+    lengths = _lengths(matrix)
+    matrix = matrix[:, :width]
+    z = np.abs(matrix - template.mean) / template.std
+    compared = np.sum(~np.isnan(z), axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        distance = np.nansum(z, axis=1) / compared
+        penalty = LENGTH_PENALTY * np.abs(lengths - width) / np.maximum(compared, 1)
+    distance = np.where(compared > 0, distance + penalty, np.inf)
+    return distance
+
+
+def score(template, sample):
+    return float(score_batch(template, [sample])[0])
+
+
+def bot_like_batch(samples, min_std=BOT_STDDEV_MS):
+    """True where a sample's intervals are too uniform to be human (needs 3+ intervals)."""
+    matrix = as_matrix(samples)
+    lengths = _lengths(matrix)
+    with np.errstate(invalid="ignore"):
+        spread = np.nanstd(matrix, axis=1) if matrix.shape[1] else np.zeros(len(matrix))
+    return (lengths >= 3) & (spread < min_std)
+
+
+def verdict(template, sample, threshold=THRESHOLD):
+    """(accepted, score, reason) with reason None, "bot" or "mismatch"."""
+    if bot_like_batch([sample])[0]:
+        return False, None, "bot"
+    value = score(template, sample)
+    if value > threshold:
+        return False, value, "mismatch"
+    return True, value, None
+
+
+def error_rates(genuine_scores, impostor_scores, thresholds=None):
+    """
+    Offline evaluation: false reject / false accept rate at each threshold,
+    plus the equal-error point. Returns {"thresholds", "frr", "far", "eer", "eer_threshold"}.
+    """
+    genuine = np.sort(np.asarray(genuine_scores, dtype=np.float64))
+    impostor = np.sort(np.asarray(impostor_scores, dtype=np.float64))
+    if thresholds is None:
+        finite = np.concatenate([genuine[np.isfinite(genuine)], impostor[np.isfinite(impostor)]])
+        thresholds = np.unique(finite) if finite.size else np.array([THRESHOLD])
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    frr = 1.0 - np.searchsorted(genuine, thresholds, side="right") / max(len(genuine), 1)
+    far = np.searchsorted(impostor, thresholds, side="right") / max(len(impostor), 1)
+    best = int(np.argmin(np.abs(frr - far)))
+    return {"thresholds": thresholds, "frr": frr, "far": far,
+            "eer": float((frr[best] + far[best]) / 2), "eer_threshold": float(thresholds[best])}
@@ -0,0 +1,255 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+from db_pool import DB, get_pool, write_transaction
+from instrumentation import span
+
+# ----------------------
+# Lockout rules (same as the original Step1 logic)
+# ----------------------
+FAILS_PER_LOCK = 3          # every 3rd wrong card/passkey attempt locks the user
+FIRST_LOCK_SECONDS = 60     # 60s, then 120s, then 180s ...
+LOCK_STEP_SECONDS = 60
+MAX_LOCK_CYCLES = 3         # after 3 locks: "Log in after 24 hours"
+BAN_SECONDS = 24 * 60 * 60
+
+# in-memory sliding windows (per process), counted on every failed attempt
+WINDOW_SECONDS = 60
+MAX_FAILS_PER_USER = 10
+MAX_FAILS_PER_SOURCE = 30
+# keys (usernames/sources) kept in memory per window and in the lock-state cache;
+# past this the least recently seen key is dropped (a dropped lock is re-read from the DB)
+MAX_TRACKED_KEYS = 100_000
+
+# how long a cached lock state is trusted before re-reading the DB
+# (keeps checks O(1) while still seeing locks set by other processes)
+CACHE_TTL = 2.0
+
+
+class SlidingWindow:
+    """
+    Counts events per key over the last `seconds`; amortised O(1) per call.
+    Only the newest `limit` events are kept per key, and keys are kept in
+    least-recently-hit order so idle ones are dropped once their window is over
+    (and the oldest ones once more than max_keys are tracked).
+    """
+    def __init__(self, seconds, limit, clock=time.time, max_keys=MAX_TRACKED_KEYS):
+        self.seconds = seconds
+        self.limit = limit
+        self.clock = clock
+        self.max_keys = max_keys
+        self._events = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _trim(self, key, now):
+        events = self._events.get(key)
+        if events is None:
+            return None
+        while events and events[0] <= now - self.seconds:
+            events.popleft()
+        if not events:
+            del self._events[key]
+            return None
+        return events
+
+    def _evict(self, now):
+        # the first key was hit least recently: once its newest event is outside
+        # the window, every event it holds is
+        while self._events:
+            oldest = next(iter(self._events.values()))
+            if oldest[-1] > now - self.seconds and len(self._events) <= self.max_keys:
+                break
+            self._events.popitem(last=False)
+
+    def hit(self, key):
+        now = self.clock()
+        with self._lock:
+            events = self._trim(key, now)
+            if events is None:
+                events = self._events[key] = deque(maxlen=self.limit)
+            else:
+                self._events.move_to_end(key)
+            events.append(now)
+            self._evict(now)
+
+    def retry_after(self, key):
+        """0 if the key is under its limit, else seconds until it drops back below it."""
+        now = self.clock()
+        with self._lock:
+            events = self._trim(key, now)
+            if events is None or len(events) < self.limit:
+                return 0
+            oldest = events[0]
+        return max(1, int(oldest + self.seconds - now + 0.999))
+
+    def __len__(self):
+        return len(self._events)
+
+
+class LockoutStore:
+    """
+    Persistent per-user failure counters and locks (lockouts table) plus
+    in-memory sliding windows per username and per source.
+    check() answers "may this attempt go ahead?" from memory, before any
+    password lookup or other expensive step.
+    """
+    def __init__(self, db=DB, clock=time.time, max_cached=MAX_TRACKED_KEYS):
+        self.db = db
+        self.clock = clock
+        self.max_cached = max_cached
+        self._lock = threading.Lock()
+        self._blocked = OrderedDict()   # username -> (blocked_until, reason, cached_at, has_row), LRU order
+        self.user_window = SlidingWindow(WINDOW_SECONDS, MAX_FAILS_PER_USER, clock, max_cached)
+        self.source_window = SlidingWindow(WINDOW_SECONDS, MAX_FAILS_PER_SOURCE, clock, max_cached)
+
+    def _conn(self):
+        return get_pool(self.db).acquire()
+
+    def _load(self, username):
+        row = self._conn().execute(
+            "SELECT locked_until, banned_until FROM lockouts WHERE username=?", (username,)).fetchone()
+        if row is None:
+            return 0.0, None, False
+        if row["banned_until"] > row["locked_until"]:
+            return row["banned_until"], "banned", True
+        return row["locked_until"], "locked", True
+
+    def _cache(self, username, cached):
+        # caller holds self._lock
+        self._blocked[username] = cached
+        self._blocked.move_to_end(username)
+        while len(self._blocked) > self.max_cached:
+            self._blocked.popitem(last=False)
+
+    def _state(self, username):
+        now = self.clock()
+        with self._lock:
+            cached = self._blocked.get(username)
+        if cached is None or now - cached[2] > CACHE_TTL:
+            until, reason, has_row = self._load(username)
+            cached = (until, reason, now, has_row)
+            with self._lock:
+                self._cache(username, cached)
+        return cached
+
+    def _blocked_until(self, username):
+        until, reason, _, _ = self._state(username)
+        return until, reason
+
+    def _remember(self, username, until, reason):
+        # only called after writing the user's lockouts row
+        with self._lock:
+            self._cache(username, (until, reason, self.clock(), True))
+
+    # --- checks ---
+    def check(self, username, source=None):
+        """Return (allowed, retry_after_seconds, reason) where reason is None, 'locked', 'banned' or 'rate_limited'."""
+        now = self.clock()
+        until, reason = self._blocked_until(username)
+        if until > now:
+            return False, max(1, int(until - now + 0.999)), reason
+        wait = self.user_window.retry_after(username)
+        if source is not None:
+            wait = max(wait, self.source_window.retry_after(source))
+        if wait:
+            return False, wait, "rate_limited"
+        return True, 0, None
+
+    def locked_until(self, username):
+        until, _ = self._blocked_until(username)
+        return until if until > self.clock() else None
+
+    def remaining(self, username):
+        until = self.locked_until(username)
+        return max(0, int(until - self.clock() + 0.999)) if until else 0
+
+    # --- updates ---
+    def lock(self, username, seconds):
+        until = self.clock() + seconds
+        conn = self._conn()
+        with conn:
+            conn.execute("""
+                INSERT INTO lockouts (username, locked_until) VALUES (?, ?)
+                ON CONFLICT(username) DO UPDATE SET locked_until=excluded.locked_until
+            """, (username, until))
+        self._remember(username, until, "locked")
+        return until
+
+    def record_failure(self, username, source=None, lockable=True):
+        """
+        Count a failed attempt. With lockable=True (wrong card sequence/passkey)
+        the persistent counters apply the 3-strikes lock and the 24-hour rule.
+        Returns {"locked_for": seconds or 0, "banned": bool}.
+        """
+        self.user_window.hit(username)
+        if source is not None:
+            self.source_window.hit(source)
+        result = {"locked_for": 0, "banned": False}
+        if not lockable:
+            return result
+
+        now = self.clock()
+        conn = self._conn()
+        # take the write lock before reading, so concurrent failures for the same user
+        # (other threads or processes) are counted one after another; work the caller
+        # left open on this connection is kept in its transaction, not committed here
+        with span("db.lockout_failure"), write_transaction(conn, "lockout_failure"):
+            row = conn.execute(
+                "SELECT fail_count, lock_cycles, lock_time, locked_until, banned_until FROM lockouts WHERE username=?",
+                (username,)).fetchone()
+            fail_count, lock_cycles, lock_time = (row[0], row[1], row[2]) if row else (0, 0, FIRST_LOCK_SECONDS)
+            locked_until, banned_until = (row[3], row[4]) if row else (0.0, 0.0)
+
+            fail_count += 1
+            if fail_count % FAILS_PER_LOCK == 0:
+                lock_cycles += 1
+                locked_until = now + lock_time
+                result["locked_for"] = lock_time
+                lock_time += LOCK_STEP_SECONDS
+            if lock_cycles >= MAX_LOCK_CYCLES:
+                banned_until = now + BAN_SECONDS
+                result["banned"] = True
+                fail_count, lock_cycles, lock_time = 0, 0, FIRST_LOCK_SECONDS
+
+            conn.execute("""
+                INSERT INTO lockouts (username, locked_until, fail_count, lock_cycles, lock_time, banned_until)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(username) DO UPDATE SET
+                    locked_until=excluded.locked_until, fail_count=excluded.fail_count,
+                    lock_cycles=excluded.lock_cycles, lock_time=excluded.lock_time,
+                    banned_until=excluded.banned_until
+            """, (username, locked_until, fail_count, lock_cycles, lock_time, banned_until))
+
+        if banned_until > locked_until:
+            self._remember(username, banned_until, "banned")
+        else:
+            self._remember(username, locked_until, "locked")
+        return result
+
+    def record_success(self, username):
+        """A passed step clears the user's failure counters (not the source window)."""
+        if not self._state(username)[3]:
+            return      # no counters or lock stored: nothing to write
+        conn = self._conn()
+        with span("db.lockout_success"), conn:
+            conn.execute("DELETE FROM lockouts WHERE username=? AND banned_until <= ?", (username, self.clock()))
+        with self._lock:
+            self._blocked.pop(username, None)
+
+    def clear(self, username):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM lockouts WHERE username=?", (username,))
+        with self._lock:
+            self._blocked.pop(username, None)
+
+
+_stores = {}
+
+
+def get_lockouts(db=DB):
+    store = _stores.get(db)
+    if store is None:
+        store = _stores.setdefault(db, LockoutStore(db))
+    return store
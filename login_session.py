@@ -0,0 +1,96 @@
+from db_pool import DB, get_pool
+from instrumentation import span
+from password_hashing import get_hasher
+
+
+class LoginSession:
+    """
+    One user's row, loaded once at login and carried through every step.
+    Reads come from the cached row; updates made during the flow are staged
+    and written back together by flush() when the flow ends.
+    """
+    def __init__(self, row, db=DB):
+        self.db = db
+        self._row = dict(row)
+        self._pending = {}
+
+    @classmethod
+    def authenticate(cls, username, password, db=DB, hasher=None):
+        """
+        Load the user row for a username/password pair, or return None.
+        The row is looked up by username only and the password checked with a
+        constant-time verify; legacy plaintext (or weaker) hashes are upgraded here.
+        """
+        hasher = hasher or get_hasher()
+        with span("db.authenticate"):
+            conn = get_pool(db).acquire()
+            row = conn.execute("SELECT * FROM users WHERE username=?", (username,)).fetchone()
+        matches, rehash = hasher.verify(password, row["password"] if row else None)
+        if not matches:
+            return None
+        session = cls(row, db)
+        if rehash:
+            session.save(password=hasher.hash(password))
+        return session
+
+    @classmethod
+    def load(cls, username, db=DB):
+        with span("db.load_user"):
+            conn = get_pool(db).acquire()
+            row = conn.execute("SELECT * FROM users WHERE username=?", (username,)).fetchone()
+        return cls(row, db) if row else None
+
+    # --- row-like access so pages/steps can keep using user["col"] ---
+    def __getitem__(self, key):
+        return self._row[key]
+
+    def __contains__(self, key):
+        return key in self._row
+
+    def keys(self):
+        return self._row.keys()
+
+    def get(self, key, default=None):
+        return self._row.get(key, default)
+
+    @property
+    def username(self):
+        return self._row["username"]
+
+    @property
+    def dirty(self):
+        return bool(self._pending)
+
+    def stage(self, **columns):
+        """Record column updates to be written at flush(); visible to reads immediately."""
+        self._row.update(columns)
+        self._pending.update(columns)
+
+    def save(self, **columns):
+        """
+        Write columns straight away (for data the user must not lose, e.g. a new passkey).
+        If the UPDATE fails (e.g. a UNIQUE constraint) the columns are not kept staged.
+        """
+        previous = {c: self._row.get(c) for c in columns}
+        pending = dict(self._pending)
+        self.stage(**columns)
+        try:
+            self.flush()
+        except Exception:
+            self._row.update(previous)
+            self._pending = pending
+            raise
+
+    def flush(self):
+        """Apply every staged update in a single UPDATE statement."""
+        if not self._pending:
+            return False
+        cols = list(self._pending)
+        assignments = ", ".join(f"{c}=?" for c in cols)
+        params = [self._pending[c] for c in cols] + [self._row["username"]]
+        with span("db.flush_user"):
+            conn = get_pool(self.db).acquire()
+            with conn:
+                conn.execute(f"UPDATE users SET {assignments} WHERE username=?", params)
+        self._pending.clear()
+        return True
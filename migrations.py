@@ -0,0 +1,315 @@
+import argparse
+import json
+import sys
+import time
+from array import array
+
+from db_pool import DB, get_pool
+
+# ----------------------
+# Versioned schema migrations (tracked in PRAGMA user_version)
+# ----------------------
+# Each migration runs exactly once per database, in order. Append new ones to
+# MIGRATIONS; never edit or reorder a migration that has already shipped.
+# Migrations are frozen: their SQL and data conversions live here, as they were
+# when the step shipped, and never call into the feature modules (which keep
+# changing with the current schema).
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _add_columns(conn, table, columns):
+    existing = _columns(conn, table)
+    for col, col_type in columns.items():
+        if col not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {col} {col_type}")
+
+
+def m001_users_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            first_name TEXT,
+            last_name TEXT,
+            dob TEXT,
+            phone TEXT,
+            code_word TEXT,
+            username TEXT UNIQUE,
+            password TEXT,
+            passkey TEXT,
+            card_sequence TEXT,
+            card_values TEXT,
+            typing_wpm INTEGER,
+            typing_intervals TEXT,
+            created_at INTEGER,
+            fingerprint_enabled INTEGER
+        )
+    """)
+    # databases created by older builds may lack some of these
+    _add_columns(conn, "users", {
+        "first_name": "TEXT",
+        "last_name": "TEXT",
+        "dob": "TEXT",
+        "phone": "TEXT",
+        "code_word": "TEXT",
+        "password": "TEXT",
+        "passkey": "TEXT",
+        "card_sequence": "TEXT",
+        "card_values": "TEXT",
+        "typing_wpm": "INTEGER",
+        "typing_intervals": "TEXT",
+        "created_at": "INTEGER",
+        "fingerprint_enabled": "INTEGER",
+    })
+
+
+def m002_passkey_index(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_passkey ON users(passkey)")
+
+
+def _u16(values):
+    # little-endian uint16 bytes
+    values = array("H", values)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _f32(values):
+    values = array("f", values)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _intervals_from_text(text):
+    # legacy comma-joined milliseconds, clamped to uint16
+    return [min(max(int(p), 0), 0xFFFF) for p in str(text).split(",") if p.strip()]
+
+
+def _intervals_from_column(value):
+    # v3 blob (format byte 1 + uint16) or legacy text
+    if value is None:
+        return []
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        raw = bytes(value)
+        if not raw or raw[0] != 1:
+            return []
+        values = array("H")
+        values.frombytes(raw[1:])
+        if sys.byteorder != "little":
+            values.byteswap()
+        return list(values)
+    return _intervals_from_text(value)
+
+
+def m003_pack_typing_intervals(conn):
+    # typing_intervals text -> blob: 1 format byte + little-endian uint16 milliseconds
+    rows = conn.execute("SELECT id, typing_intervals FROM users WHERE typeof(typing_intervals) = 'text'").fetchall()
+    conn.executemany("UPDATE users SET typing_intervals=? WHERE id=?",
+                     [(bytes([1]) + _u16(_intervals_from_text(r[1])), r[0]) for r in rows])
+
+
+V4_CARDS = ["Spade", "Heart", "Diamond", "Club", "Ace", "King", "Queen", "Jack", "Joker"]
+
+
+def _card_secret_v4(field_text):
+    # "CardA,CardB,... | CardX:val, ..." -> format 1, 7 card indices, 9 digits (0xFF = unknown)
+    if not field_text:
+        return None
+    seq_part, _, value_part = field_text.partition(" | ")
+    selection = [s.strip() for s in seq_part.split(",") if s.strip()][:7]
+    if len(selection) != 7:
+        return None
+    values = {}
+    for item in value_part.split(","):
+        if ":" in item:
+            k, v = item.split(":", 1)
+            try:
+                values[k.strip()] = int(v.strip())
+            except ValueError:
+                pass
+    index = {name.lower(): i for i, name in enumerate(V4_CARDS)}
+    return (bytes([1]) + bytes(index.get(name.lower(), 0xFF) for name in selection)
+            + bytes(values.get(name, 0xFF) for name in V4_CARDS))
+
+
+def m004_card_secret(conn):
+    _add_columns(conn, "users", {"card_secret": "BLOB"})
+    rows = conn.execute(
+        "SELECT id, card_sequence FROM users WHERE card_secret IS NULL AND card_sequence IS NOT NULL").fetchall()
+    updates = []
+    for row in rows:
+        blob = _card_secret_v4(row[1])
+        if blob is not None:
+            updates.append((blob, row[0]))
+    conn.executemany("UPDATE users SET card_secret=? WHERE id=?", updates)
+
+
+def m005_id_sequence(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS id_sequence (
+            name TEXT PRIMARY KEY,
+            next_value INTEGER NOT NULL,
+            key TEXT NOT NULL
+        )
+    """)
+
+
+def m006_lockouts(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS lockouts (
+            username TEXT PRIMARY KEY,
+            locked_until REAL NOT NULL
+        )
+    """)
+
+
+def m007_lockout_counters(conn):
+    existing = _columns(conn, "lockouts")
+    for col, col_def in (("fail_count", "INTEGER NOT NULL DEFAULT 0"),
+                         ("lock_cycles", "INTEGER NOT NULL DEFAULT 0"),
+                         ("lock_time", "INTEGER NOT NULL DEFAULT 60"),
+                         ("banned_until", "REAL NOT NULL DEFAULT 0")):
+        if col not in existing:
+            conn.execute(f"ALTER TABLE lockouts ADD COLUMN {col} {col_def}")
+
+
+def m008_otps(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS otps (
+            otp_key TEXT PRIMARY KEY,
+            code_hash TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+
+
+def m009_typing_profiles(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS typing_profiles (
+            username TEXT PRIMARY KEY,
+            n INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            wpm REAL,
+            mean BLOB NOT NULL,
+            var BLOB NOT NULL,
+            ring BLOB NOT NULL,
+            ring_head INTEGER NOT NULL DEFAULT 0,
+            ring_count INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL
+        )
+    """)
+    # seed a one-sample profile (mean = the sample, var = 0, ring row 0 = the sample)
+    # for every user that only has the first-login snapshot
+    ring_size, max_positions, missing = 16, 64, 0xFFFF
+    rows = conn.execute("""
+        SELECT u.username, u.typing_intervals, u.typing_wpm FROM users u
+        WHERE u.typing_intervals IS NOT NULL AND u.username IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM typing_profiles p WHERE p.username = u.username)
+    """).fetchall()
+    params = []
+    now = time.time()
+    for username, stored, wpm in rows:
+        intervals = _intervals_from_column(stored)[:max_positions]
+        if not intervals:
+            continue
+        try:
+            wpm = float(wpm) if wpm else None
+        except (TypeError, ValueError):
+            wpm = None
+        length = len(intervals)
+        ring = [min(x, missing - 1) for x in intervals] + [missing] * (length * (ring_size - 1))
+        params.append((username, 1, length, wpm, _f32(intervals), _f32([0.0] * length), _u16(ring), 1, 1, now))
+    conn.executemany("""
+        INSERT INTO typing_profiles (username, n, length, wpm, mean, var, ring, ring_head, ring_count, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, params)
+
+
+def m010_unique_passkeys(conn):
+    # rows that share a passkey keep it on the oldest row only; the others set up cards again
+    conn.execute("""
+        UPDATE users SET passkey = NULL
+        WHERE passkey IS NOT NULL
+          AND rowid > (SELECT MIN(rowid) FROM users AS u WHERE u.passkey = users.passkey)
+    """)
+    conn.execute("DROP INDEX IF EXISTS idx_users_passkey")
+    conn.execute("CREATE UNIQUE INDEX idx_users_passkey ON users(passkey) WHERE passkey IS NOT NULL")
+
+
+MIGRATIONS = [
+    (1, "users table", m001_users_table),
+    (2, "passkey index", m002_passkey_index),
+    (3, "pack typing_intervals", m003_pack_typing_intervals),
+    (4, "card_secret blob", m004_card_secret),
+    (5, "id_sequence table", m005_id_sequence),
+    (6, "lockouts table", m006_lockouts),
+    (7, "lockout counters", m007_lockout_counters),
+    (8, "otps table", m008_otps),
+    (9, "typing_profiles table", m009_typing_profiles),
+    (10, "unique passkey index", m010_unique_passkeys),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def run_migrations(db=DB, dry_run=False):
+    """
+    Bring the database up to LATEST_VERSION in a single transaction.
+    Returns a report: {"from", "to", "applied": [{"version", "name", "seconds"}], "dry_run"}.
+    When the schema is already current this is one PRAGMA read and nothing else.
+    """
+    # leased for this call only, so the caller's thread does not keep a pool slot afterwards
+    with get_pool(db).leased() as conn:
+        return _migrate(conn, dry_run)
+
+
+def _migrate(conn, dry_run):
+    current = schema_version(conn)
+    report = {"from": current, "to": current, "applied": [], "dry_run": dry_run}
+    if current >= LATEST_VERSION:
+        return report
+
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # another process may have migrated while we waited for the write lock
+        current = report["from"] = schema_version(conn)
+        for version, name, migrate in MIGRATIONS:
+            if version <= current:
+                continue
+            started = time.perf_counter()
+            migrate(conn)
+            report["applied"].append({"version": version, "name": name,
+                                      "seconds": round(time.perf_counter() - started, 4)})
+            report["to"] = version
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.execute(f"PRAGMA user_version = {int(report['to'])}")
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations.")
+    parser.add_argument("--db", default=DB, help="SQLite database file (default: users.db)")
+    parser.add_argument("--dry-run", action="store_true", help="run pending migrations, then roll back")
+    args = parser.parse_args(argv)
+    print(json.dumps(run_migrations(args.db, dry_run=args.dry_run), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
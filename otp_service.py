@@ -0,0 +1,250 @@
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db_pool import DB, get_pool
+from instrumentation import count, span
+
+# ----------------------
+# OTP settings
+# ----------------------
+OTP_TTL = int(os.environ.get("TRISECURE_OTP_TTL", "300"))          # seconds
+OTP_MAX_ATTEMPTS = 3
+OTP_STORE = os.environ.get("TRISECURE_OTP_STORE", "memory")         # "memory" or "sqlite"
+OTP_TRANSPORT = os.environ.get("TRISECURE_OTP_TRANSPORT", "console")  # "console" or "stub"
+DELIVERY_WORKERS = int(os.environ.get("TRISECURE_OTP_WORKERS", "4"))
+PURGE_INTERVAL = 60     # seconds between sweeps of expired codes (run from issue())
+
+
+def _digest(key, code):
+    return hashlib.sha256(f"{key}:{code}".encode()).hexdigest()
+
+
+# ----------------------
+# Stores: key -> (code hash, expiry, failed attempts)
+# ----------------------
+class MemoryOtpStore:
+    """In-process store; entries expire after their TTL (checked on access and by purge())."""
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def put(self, key, code_hash, expires_at):
+        with self._lock:
+            self._entries[key] = [code_hash, expires_at, 0]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= self.clock():
+                del self._entries[key]
+                entry = None
+            return tuple(entry) if entry else None
+
+    def add_attempt(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return 0
+            entry[2] += 1
+            return entry[2]
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def purge(self):
+        now = self.clock()
+        with self._lock:
+            expired = [k for k, e in self._entries.items() if e[1] <= now]
+            for k in expired:
+                del self._entries[k]
+        return len(expired)
+
+
+class SqliteOtpStore:
+    """Same interface, backed by the otps table so codes survive restarts / are shared by processes."""
+    def __init__(self, db=DB, clock=time.time):
+        self.db = db
+        self.clock = clock
+
+    def _conn(self):
+        return get_pool(self.db).acquire()
+
+    def put(self, key, code_hash, expires_at):
+        conn = self._conn()
+        with conn:
+            conn.execute("""
+                INSERT INTO otps (otp_key, code_hash, expires_at, attempts) VALUES (?, ?, ?, 0)
+                ON CONFLICT(otp_key) DO UPDATE SET
+                    code_hash=excluded.code_hash, expires_at=excluded.expires_at, attempts=0
+            """, (key, code_hash, expires_at))
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT code_hash, expires_at, attempts FROM otps WHERE otp_key=? AND expires_at > ?",
+            (key, self.clock())).fetchone()
+        return tuple(row) if row else None
+
+    def add_attempt(self, key):
+        conn = self._conn()
+        with conn:
+            conn.execute("UPDATE otps SET attempts = attempts + 1 WHERE otp_key=?", (key,))
+        row = conn.execute("SELECT attempts FROM otps WHERE otp_key=?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def delete(self, key):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM otps WHERE otp_key=?", (key,))
+
+    def purge(self):
+        conn = self._conn()
+        with conn:
+            return conn.execute("DELETE FROM otps WHERE expires_at <= ?", (self.clock(),)).rowcount
+
+
+# ----------------------
+# Delivery transports
+# ----------------------
+class ConsoleTransport:
+    def send(self, phone, message):
+        print(f"\n Sending OTP to {phone}...")
+        print(message)
+
+
+class StubSink:
+    """Keeps sent messages in memory (demo GUI popup, tests, load runs)."""
+    def __init__(self, keep=1000):
+        self.keep = keep
+        self.messages = []
+        self._lock = threading.Lock()
+
+    def send(self, phone, message):
+        with self._lock:
+            self.messages.append((phone, message))
+            if len(self.messages) > self.keep:
+                del self.messages[:-self.keep]
+
+    def last(self, phone):
+        with self._lock:
+            for sent_to, message in reversed(self.messages):
+                if sent_to == phone:
+                    return message
+        return None
+
+
+class OtpTicket:
+    def __init__(self, key, expires_at, delivery):
+        self.key = key
+        self.expires_at = expires_at
+        self.delivery = delivery    # Future; done once the transport has sent the code
+
+
+class OtpIssuer:
+    """
+    Creates a code under a fresh random key, stores its hash and hands delivery
+    to a worker pool (returns at once). Expired codes are swept every
+    PURGE_INTERVAL seconds as part of issuing.
+    """
+    def __init__(self, store, transport, ttl=OTP_TTL, workers=DELIVERY_WORKERS, clock=time.time,
+                 purge_interval=PURGE_INTERVAL):
+        self.store = store
+        self.transport = transport
+        self.ttl = ttl
+        self.clock = clock
+        self.purge_interval = purge_interval
+        self._next_purge = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="otp")
+
+    def _deliver(self, phone, message):
+        with span("otp.deliver", transport=type(self.transport).__name__):
+            self.transport.send(phone, message)
+
+    def _maybe_purge(self, now):
+        if now >= self._next_purge:
+            self._next_purge = now + self.purge_interval
+            self.store.purge()
+
+    def issue(self, phone):
+        with span("otp.issue"):
+            now = self.clock()
+            self._maybe_purge(now)
+            # a per-ticket key: a second code for the same phone never replaces or unlocks the first
+            key = secrets.token_urlsafe(16)
+            code = f"{secrets.randbelow(9000) + 1000}"
+            expires_at = now + self.ttl
+            self.store.put(key, _digest(key, code), expires_at)
+            delivery = self._executor.submit(self._deliver, phone, f"Your OTP is: {code}")
+        return OtpTicket(key, expires_at, delivery)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+class OtpVerifier:
+    """Checks a code; success consumes it, too many wrong tries invalidates it."""
+    OK, WRONG, EXPIRED, LOCKED = "ok", "wrong", "expired", "locked"
+
+    def __init__(self, store, max_attempts=OTP_MAX_ATTEMPTS):
+        self.store = store
+        self.max_attempts = max_attempts
+
+    def verify(self, key, code):
+        """Returns (status, attempts_left)."""
+        entry = self.store.get(key)
+        if entry is None:
+            return self.EXPIRED, 0
+        code_hash, _, attempts = entry
+        if attempts >= self.max_attempts:
+            self.store.delete(key)
+            return self.LOCKED, 0
+        if hmac.compare_digest(code_hash, _digest(key, str(code).strip())):
+            self.store.delete(key)
+            return self.OK, self.max_attempts - attempts
+        attempts = self.store.add_attempt(key)
+        left = max(0, self.max_attempts - attempts)
+        if left == 0:
+            self.store.delete(key)
+            return self.LOCKED, 0
+        return self.WRONG, left
+
+
+class OtpService:
+    def __init__(self, store=None, transport=None, ttl=OTP_TTL, db=DB):
+        if store is None:
+            store = SqliteOtpStore(db) if OTP_STORE == "sqlite" else MemoryOtpStore()
+        if transport is None:
+            transport = StubSink() if OTP_TRANSPORT == "stub" else ConsoleTransport()
+        self.store = store
+        self.transport = transport
+        self.issuer = OtpIssuer(store, transport, ttl)
+        self.verifier = OtpVerifier(store)
+
+    def issue(self, phone):
+        return self.issuer.issue(phone)
+
+    def verify(self, key, code):
+        with span("otp.verify") as sp:
+            status, left = self.verifier.verify(key, code)
+            sp.set(status=status)
+        count("otp.results", status=status)
+        return status, left
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_otp_service(name="default", **options):
+    """Shared service per name; options only apply when it is first created."""
+    with _services_lock:
+        service = _services.get(name)
+        if service is None:
+            service = _services[name] = OtpService(**options)
+    return service
@@ -0,0 +1,123 @@
+import hashlib
+import math
+import random
+import sqlite3
+import threading
+
+from db_pool import DB, get_pool
+
+
+class PasskeyExhausted(Exception):
+    """Every 8-digit variant of a 7-digit card passkey is already taken."""
+    pass
+
+
+class BloomFilter:
+    """
+    Small in-process Bloom filter (bytearray bitset, double hashing).
+    A negative answer is certain, a positive one may be a false positive.
+    """
+    def __init__(self, capacity=1_000_000, error_rate=0.01):
+        capacity = max(1, capacity)
+        bits = int(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.num_bits = max(8, bits)
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        for p in self._positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+
+class PasskeyRegistry:
+    """
+    Answers "is this passkey taken?" for passkey generation.
+    Existing passkeys are loaded into a Bloom filter once; only Bloom hits
+    go to the (indexed) users.passkey lookup. The filter is only a hint: other
+    processes may have taken a passkey since it was loaded, so the UNIQUE index
+    (migration 10) decides and reserve_unique() moves on to the next candidate when it refuses.
+    """
+    def __init__(self, db=DB, capacity=1_000_000, error_rate=0.01):
+        self.db = db
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._bloom = None
+        self._lock = threading.Lock()
+        self.db_probes = 0
+        self.collisions = 0
+
+    def _load(self):
+        conn = get_pool(self.db).acquire()
+        rows = conn.execute("SELECT passkey FROM users WHERE passkey IS NOT NULL").fetchall()
+        bloom = BloomFilter(max(self.capacity, len(rows) * 2), self.error_rate)
+        for row in rows:
+            bloom.add(row[0])
+        self._bloom = bloom
+
+    def _bloom_filter(self):
+        if self._bloom is None:
+            with self._lock:
+                if self._bloom is None:
+                    self._load()
+        return self._bloom
+
+    def exists(self, passkey):
+        if passkey not in self._bloom_filter():
+            return False
+        self.db_probes += 1
+        conn = get_pool(self.db).acquire()
+        return conn.execute("SELECT 1 FROM users WHERE passkey=? LIMIT 1", (passkey,)).fetchone() is not None
+
+    def add(self, passkey):
+        bloom = self._bloom_filter()    # before taking the lock: a first load takes it too
+        with self._lock:
+            bloom.add(passkey)
+
+    def reserve_unique(self, passkey7, claim, rng=random):
+        """
+        Insert one extra digit into the 7-digit card passkey so the 8-digit
+        result is unused. Tries every (position, digit) variant in random order;
+        claim(passkey8) writes a free-looking candidate, and a sqlite3.IntegrityError
+        from it (taken by another process meanwhile) moves on to the next one.
+        Raises PasskeyExhausted only if all of them are taken.
+        """
+        candidates = [(pos, digit) for pos in range(len(passkey7) + 1) for digit in "0123456789"]
+        rng.shuffle(candidates)
+        seen = set()
+        for pos, digit in candidates:
+            passkey8 = passkey7[:pos] + digit + passkey7[pos:]
+            if passkey8 in seen:
+                continue
+            seen.add(passkey8)
+            if self.exists(passkey8):
+                continue
+            try:
+                claim(passkey8)
+            except sqlite3.IntegrityError:
+                self.collisions += 1
+                self.add(passkey8)
+                continue
+            self.add(passkey8)
+            return passkey8
+        raise PasskeyExhausted(f"no free 8-digit passkey left for {passkey7}")
+
+
+_registries = {}
+
+
+def get_registry(db=DB):
+    registry = _registries.get(db)
+    if registry is None:
+        registry = _registries.setdefault(db, PasskeyRegistry(db))
+    return registry
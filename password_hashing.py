@@ -0,0 +1,243 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+from executors import KDF, get_executor
+from instrumentation import span
+
+# ----------------------
+# Password hashing (users.password)
+# ----------------------
+# Stored as "$"-separated text so the column type does not change:
+#   scrypt$<n>$<r>$<p>$<salt>$<hash>
+#   pbkdf2_sha256$<iterations>$<salt>$<hash>
+# salt and hash are unpadded base64; every user gets a fresh random salt.
+# A value that starts with "$" or with "scrypt$"/"pbkdf2_sha256$" claims to be a
+# hash: if it does not parse it matches nothing. Anything else is a legacy
+# plaintext password (older builds and the legacy scripts still write those): it
+# is compared in constant time and replaced by a hash on the user's next
+# successful login, at the calibrated cost.
+#
+# The cost (scrypt n / PBKDF2 iterations) is calibrated once per process by
+# doubling it until one hash takes TARGET_MS; TRISECURE_KDF_COST pins it instead.
+# Hashes stored with a lower cost than the current one are upgraded on login.
+# users.code_word uses the same format; code words are normalized (strip + lower)
+# before hashing, so the answer check stays case-insensitive.
+# The KDF runs on the shared "kdf" process pool (executors.py).
+
+SCRYPT = "scrypt"
+PBKDF2 = "pbkdf2_sha256"
+ALGORITHM = os.environ.get("TRISECURE_KDF", SCRYPT if hasattr(hashlib, "scrypt") else PBKDF2)
+TARGET_MS = float(os.environ.get("TRISECURE_KDF_TARGET_MS", "50"))
+COST = int(os.environ.get("TRISECURE_KDF_COST", "0")) or None
+SALT_BYTES = 16
+HASH_BYTES = 32
+SCRYPT_R = 8
+SCRYPT_P = 1
+HASH_CHUNK = 64         # passwords per task in hash_many()
+MIN_COST = {SCRYPT: 2 ** 10, PBKDF2: 2 ** 12}
+MAX_COST = {SCRYPT: 2 ** 17, PBKDF2: 2 ** 22}
+
+
+def _b64(raw):
+    return base64.b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _unb64(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def _derive(algorithm, cost, password, salt):
+    if algorithm == SCRYPT:
+        return hashlib.scrypt(password, salt=salt, n=cost, r=SCRYPT_R, p=SCRYPT_P,
+                              maxmem=256 * SCRYPT_R * cost * SCRYPT_P, dklen=HASH_BYTES)
+    if algorithm == PBKDF2:
+        return hashlib.pbkdf2_hmac("sha256", password, salt, cost, dklen=HASH_BYTES)
+    raise ValueError(f"unknown KDF: {algorithm}")
+
+
+def parse(stored):
+    """(algorithm, cost, salt, digest) for a stored hash, or None for legacy/empty values."""
+    if not isinstance(stored, str):
+        return None
+    parts = stored.split("$")
+    try:
+        if parts[0] == SCRYPT and len(parts) == 6:
+            if int(parts[2]) != SCRYPT_R or int(parts[3]) != SCRYPT_P:
+                return None
+            return SCRYPT, int(parts[1]), _unb64(parts[4]), _unb64(parts[5])
+        if parts[0] == PBKDF2 and len(parts) == 4:
+            return PBKDF2, int(parts[1]), _unb64(parts[2]), _unb64(parts[3])
+    except ValueError:
+        return None
+    return None
+
+
+def is_hashed(stored):
+    return parse(stored) is not None
+
+
+def is_plaintext(stored):
+    """True for a legacy plaintext value, i.e. one without a "$"-delimited algorithm prefix."""
+    if not isinstance(stored, str):
+        return False
+    prefix, sep, _ = stored.partition("$")
+    return not sep or (prefix != "" and prefix not in MIN_COST)
+
+
+def hash_password(password, algorithm=ALGORITHM, cost=None):
+    """New salted hash in the stored text form. Picklable, so it can run in a worker process."""
+    cost = cost or MIN_COST[algorithm]
+    salt = os.urandom(SALT_BYTES)
+    digest = _b64(_derive(algorithm, cost, password.encode("utf-8"), salt))
+    if algorithm == SCRYPT:
+        return f"{SCRYPT}${cost}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${digest}"
+    return f"{PBKDF2}${cost}${_b64(salt)}${digest}"
+
+
+def hash_passwords(passwords, algorithm=ALGORITHM, cost=None):
+    return [hash_password(p, algorithm, cost) for p in passwords]
+
+
+def normalize_code_word(code_word):
+    """Code words ignore case and surrounding spaces; applied once at registration and to every answer."""
+    return (code_word or "").strip().lower()
+
+
+def verify_password(password, stored):
+    """Constant-time check of a password against a stored hash or legacy plaintext; malformed hashes never match."""
+    candidate = password.encode("utf-8")
+    parsed = parse(stored)
+    if parsed is None:
+        return is_plaintext(stored) and hmac.compare_digest(candidate, stored.encode("utf-8"))
+    algorithm, cost, salt, digest = parsed
+    if not MIN_COST[algorithm] <= cost <= MAX_COST[algorithm]:
+        return False
+    return hmac.compare_digest(_derive(algorithm, cost, candidate, salt), digest)
+
+
+def calibrate(algorithm=ALGORITHM, target_ms=TARGET_MS):
+    """Smallest power-of-two cost whose hash takes at least target_ms here (capped at MAX_COST)."""
+    cost = MIN_COST[algorithm]
+    salt = os.urandom(SALT_BYTES)
+    while cost < MAX_COST[algorithm]:
+        started = time.perf_counter()
+        _derive(algorithm, cost, b"calibration", salt)
+        if (time.perf_counter() - started) * 1000 >= target_ms:
+            break
+        cost *= 2
+    return cost
+
+
+class Hasher:
+    """Hashes and verifies passwords at the current cost, on the kdf executor."""
+    def __init__(self, algorithm=ALGORITHM, cost=COST, target_ms=TARGET_MS, executor=None):
+        if algorithm not in MIN_COST:
+            raise ValueError(f"unknown KDF: {algorithm}")
+        self.algorithm = algorithm
+        self._cost = cost
+        self.target_ms = target_ms
+        self.executor = executor or get_executor(KDF)
+        self._dummy = None
+        self._lock = threading.Lock()
+
+    @property
+    def cost(self):
+        if self._cost is None:
+            with self._lock:
+                if self._cost is None:
+                    with span("kdf.calibrate", algorithm=self.algorithm):
+                        self._cost = calibrate(self.algorithm, self.target_ms)
+        return self._cost
+
+    def warm_up(self):
+        """Calibrate and start the workers now (at startup) instead of on the first login."""
+        self._dummy_hash()
+        return self.cost
+
+    def _run(self, fn, *args):
+        return self.executor.run(fn, *args)
+
+    def _dummy_hash(self):
+        if self._dummy is None:
+            self._dummy = self._run(hash_password, "dummy", self.algorithm, self.cost)
+        return self._dummy
+
+    def hash(self, password):
+        with span("kdf.hash", algorithm=self.algorithm):
+            return self._run(hash_password, password, self.algorithm, self.cost)
+
+    def hash_many(self, passwords, chunk=HASH_CHUNK):
+        """Hash a batch across all workers (bulk import); order is preserved."""
+        passwords = list(passwords)
+        cost = self.cost
+        with span("kdf.hash_many", algorithm=self.algorithm):
+            # keep about two chunks per worker in flight so a huge import never fills the queue
+            window = 2 * max(self.executor.workers, 1)
+            pending, hashes = [], []
+            for i in range(0, len(passwords), chunk):
+                if len(pending) >= window:
+                    hashes.extend(pending.pop(0).result())
+                pending.append(self.executor.submit(hash_passwords, passwords[i:i + chunk], self.algorithm, cost))
+            for future in pending:
+                hashes.extend(future.result())
+            return hashes
+
+    def needs_rehash(self, stored):
+        parsed = parse(stored)
+        return parsed is None or parsed[0] != self.algorithm or parsed[1] < self.cost
+
+    def verify(self, password, stored):
+        """
+        (matches, needs_rehash). A missing user (stored None) still pays for one
+        hash against a dummy value, so response time does not reveal which
+        usernames exist.
+        """
+        with span("kdf.verify"):
+            if stored is None:
+                self._run(verify_password, password, self._dummy_hash())
+                return False, False
+            if not password:
+                return False, False
+            # legacy plaintext is a plain constant-time compare, not worth a round trip to a worker
+            matches = (self._run(verify_password, password, stored) if is_hashed(stored)
+                       else verify_password(password, stored))
+            if not matches:
+                return False, False
+        return True, self.needs_rehash(stored)
+
+    def hash_code_word(self, code_word):
+        return self.hash(normalize_code_word(code_word))
+
+    def verify_code_word(self, answer, stored):
+        """
+        (matches, needs_rehash) for the step-2 code word. A legacy plaintext value
+        is normalized like the answer and compared in constant time (an empty
+        stored code word still matches an empty answer, as before).
+        """
+        answer = normalize_code_word(answer)
+        with span("kdf.verify_code_word"):
+            if is_hashed(stored):
+                matches = self._run(verify_password, answer, stored)
+            elif stored is None or is_plaintext(stored):
+                matches = verify_password(answer, normalize_code_word(stored))
+            else:
+                matches = False     # malformed hash
+        return matches, matches and self.needs_rehash(stored)
+
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+
+def get_hasher():
+    """Process-wide hasher configured from the TRISECURE_KDF* settings."""
+    global _hasher
+    if _hasher is None:
+        with _hasher_lock:
+            if _hasher is None:
+                _hasher = Hasher()
+    return _hasher
@@ -0,0 +1,57 @@
+import os
+import sqlite3
+import sys
+
+# hash inline in the test process instead of starting the kdf worker pool
+os.environ.setdefault("TRISECURE_KDF_WORKERS", "0")
+os.environ.setdefault("TRISECURE_BIOMETRIC_BACKEND", "simulated")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from migrations import run_migrations
+from password_hashing import ALGORITHM, MIN_COST, Hasher
+
+
+@pytest.fixture
+def db(tmp_path):
+    """A fresh, fully migrated database file."""
+    path = str(tmp_path / "users.db")
+    run_migrations(path)
+    return path
+
+
+@pytest.fixture
+def hasher():
+    return Hasher(cost=MIN_COST[ALGORITHM])
+
+
+@pytest.fixture
+def make_user(db, hasher):
+    """Insert a registered user; password/code_word are hashed unless plaintext=True."""
+    def make(username="alice", password="s3cret", code_word="Blue Moon", plaintext=False, **columns):
+        row = {"id": username, "first_name": "A", "last_name": "B", "username": username,
+               "password": password if plaintext else hasher.hash(password),
+               "code_word": code_word if plaintext else hasher.hash_code_word(code_word)}
+        row.update(columns)
+        with sqlite3.connect(db) as conn:
+            conn.execute(f"INSERT INTO users ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+                         list(row.values()))
+        return row
+    return make
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
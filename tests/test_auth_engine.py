@@ -0,0 +1,139 @@
+import sqlite3
+
+import pytest
+
+from auth_engine import (BANNED, DENIED, LOCKED, OK, RETRY, STEP_BIOMETRIC, STEP_CARDS, STEP_CODE_WORD,
+                         STEP_DONE, STEP_FAILED, STEP_PASSWORD, AuthEngine, AuthStateError)
+from biometrics import SimulatedBackend
+from card_secret import CARDS
+from lockout import LockoutStore
+
+INTERVALS = [120, 95, 160, 130, 110]
+DURATION = 3.0      # "alice" + "s3cret" in 3s = 44 wpm
+SELECTION = CARDS[:7]
+
+
+@pytest.fixture
+def engine(db, hasher, clock):
+    return AuthEngine(db, source="test", lockouts=LockoutStore(db, clock=clock), typing_check="wpm",
+                      biometric_backend=SimulatedBackend(), hasher=hasher)
+
+
+def login(engine, password="s3cret"):
+    flow = engine.start()
+    return flow, flow.submit_password("alice", password, INTERVALS, duration=DURATION)
+
+
+def row(db, username="alice"):
+    with sqlite3.connect(db) as conn:
+        conn.row_factory = sqlite3.Row
+        return conn.execute("SELECT * FROM users WHERE username=?", (username,)).fetchone()
+
+
+def test_first_login_walks_every_step(engine, make_user, db):
+    make_user()
+    flow, result = login(engine)
+    assert result.status == OK and result.profile_recorded
+    assert flow.state == STEP_CODE_WORD
+
+    assert flow.submit_code_word("  blue MOON ").ok
+    assert flow.state == STEP_CARDS and flow.needs_card_setup
+
+    result = flow.setup_cards(SELECTION)
+    assert result.ok and len(result.passkey) == 8
+    assert flow.state == STEP_BIOMETRIC
+    assert row(db)["passkey"] == result.passkey    # saved at once, not staged
+
+    result = flow.submit_biometric(True)
+    assert result.ok and result.activated
+    assert flow.state == STEP_DONE and flow.done
+    saved = row(db)
+    assert saved["fingerprint_enabled"] == 1
+    assert saved["typing_wpm"] == 44
+
+
+def test_steps_must_run_in_order(engine, make_user):
+    make_user()
+    flow = engine.start()
+    with pytest.raises(AuthStateError):
+        flow.submit_code_word("blue moon")
+    login_flow, _ = login(engine)
+    with pytest.raises(AuthStateError):
+        login_flow.submit_cards(SELECTION, "12345678")
+
+
+def test_wrong_password_stays_on_password_step(engine, make_user):
+    make_user()
+    flow, result = login(engine, password="nope")
+    assert result.status == RETRY
+    assert flow.state == STEP_PASSWORD and flow.user is None
+
+
+def test_code_word_attempts_run_out(engine, make_user):
+    make_user()
+    flow, _ = login(engine)
+    assert flow.submit_code_word("red").status == RETRY
+    assert flow.submit_code_word("green").attempts_left == 1
+    result = flow.submit_code_word("yellow")
+    assert result.status == DENIED
+    assert flow.state == STEP_FAILED
+
+
+def test_returning_user_verifies_cards(engine, make_user):
+    make_user()
+    flow, _ = login(engine)
+    flow.submit_code_word("blue moon")
+    passkey = flow.setup_cards(SELECTION).passkey
+    flow.submit_biometric(True)
+
+    flow, result = login(engine)
+    assert result.ok and not result.profile_recorded
+    flow.submit_code_word("blue moon")
+    assert not flow.needs_card_setup
+    assert flow.submit_cards(SELECTION, passkey).ok
+    result = flow.submit_biometric(True)
+    assert result.ok and not result.activated
+
+
+def test_typing_speed_mismatch_is_denied(engine, make_user):
+    make_user()
+    flow, _ = login(engine)
+    flow.finish()
+    flow = engine.start()
+    result = flow.submit_password("alice", "s3cret", INTERVALS, duration=DURATION * 3)
+    assert result.status == DENIED
+    assert flow.state == STEP_PASSWORD
+
+
+def test_card_failures_lock_then_ban(engine, make_user, clock):
+    make_user(passkey="12345678")
+    flow, _ = login(engine)
+    flow.submit_code_word("blue moon")
+    wrong = list(reversed(SELECTION))
+    assert flow.submit_cards(wrong, "12345678").status == RETRY
+    assert flow.submit_cards(SELECTION, "00000000").status == RETRY
+    result = flow.submit_cards(wrong, "12345678")
+    assert result.status == LOCKED and result.retry_after == 60
+    assert flow.submit_cards(SELECTION, "12345678").status == LOCKED    # even the right answer
+
+    for lock in (120, 180):
+        clock.advance(lock)
+        for _ in range(2):
+            flow.submit_cards(wrong, "12345678")
+        result = flow.submit_cards(wrong, "12345678")
+    assert result.status == BANNED
+    assert flow.state == STEP_FAILED
+
+
+def test_biometric_attempts_run_out(db, hasher, make_user, clock):
+    engine = AuthEngine(db, lockouts=LockoutStore(db, clock=clock), typing_check="wpm",
+                        biometric_backend=SimulatedBackend(results=["FAILED"]), hasher=hasher)
+    make_user()
+    flow, _ = login(engine)
+    flow.submit_code_word("blue moon")
+    flow.setup_cards(SELECTION)
+    assert flow.submit_biometric().status == RETRY
+    assert flow.submit_biometric().status == RETRY
+    assert flow.submit_biometric().status == DENIED
+    assert flow.state == STEP_FAILED
+    assert not row(db)["fingerprint_enabled"]
@@ -0,0 +1,70 @@
+import asyncio
+import json
+import threading
+
+from auth_engine import AuthEngine
+from auth_server import AuthServer
+from biometrics import SimulatedBackend
+from db_pool import get_pool
+
+WORKERS = 16        # twice the default pool size
+
+
+async def post(port, path, body):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    payload = json.dumps(body).encode()
+    writer.write(f"POST {path} HTTP/1.1\r\nContent-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode()
+                 + payload)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    await reader.read()
+    writer.close()
+    return status
+
+
+def serve_and(server, client):
+    """Run the server on a free port, await client(port), then stop."""
+    async def main():
+        started = asyncio.Event()
+        ports = []
+
+        def ready(srv):
+            ports.append(srv.sockets[0].getsockname()[1])
+            started.set()
+        task = asyncio.create_task(server.serve("127.0.0.1", 0, ready))
+        await started.wait()
+        try:
+            return await client(ports[0])
+        finally:
+            task.cancel()
+    return asyncio.run(main())
+
+
+def test_every_worker_holds_a_connection_at_once(db):
+    get_pool(db).acquire()      # the main thread already holds one, as after startup
+    server = AuthServer(db, workers=WORKERS)
+    barrier = threading.Barrier(WORKERS)
+
+    def work():
+        get_pool(db).acquire(timeout=1).execute("SELECT 1")
+        barrier.wait(timeout=5)
+        return True
+
+    async def client(port):
+        return await asyncio.gather(*(server.db.run(work) for _ in range(WORKERS)))
+    assert serve_and(server, client) == [True] * WORKERS
+    assert server.db.pool.stats()["idle"] == server.db.pool.stats()["created"] - 1     # leases given back
+
+
+def test_concurrent_logins(db, hasher, make_user):
+    for i in range(WORKERS):
+        make_user(f"user{i}")
+    engine = AuthEngine(db, source="test", typing_check="wpm", biometric_backend=SimulatedBackend(), hasher=hasher)
+    server = AuthServer(db, workers=WORKERS, engine=engine)
+
+    async def client(port):
+        return await asyncio.gather(*(
+            post(port, "/login", {"username": f"user{i}", "password": "s3cret",
+                                  "intervals": [120, 95, 160], "duration": 3.0})
+            for i in range(WORKERS)))
+    assert serve_and(server, client) == [200] * WORKERS
@@ -0,0 +1,69 @@
+import json
+import sqlite3
+
+import pytest
+
+from bulk_import import clean_record, import_users, read_records
+from password_hashing import verify_password
+from validators import validate_dob_str, validate_phone_str
+
+
+def record(username, **fields):
+    row = {"first_name": "Ada", "last_name": "Lovelace", "dob": "10/12/1990", "phone": "01712345678",
+           "code_word": " Blue Moon ", "username": username, "password": "s3cret"}
+    row.update(fields)
+    return row
+
+
+@pytest.mark.parametrize("dob, ok", [("10/12/1990", True), ("31/02/1990", False), ("1990-12-10", False),
+                                     ("01/01/2026", False), (None, False)])
+def test_validate_dob(dob, ok):
+    assert validate_dob_str(dob)[0] is ok
+
+
+@pytest.mark.parametrize("phone, message", [("01712345678", ""), ("", "Phone number required"),
+                                            ("0171234567x", "Phone must contain digits only"),
+                                            ("0171234567", "Phone must be exactly 11 digits"),
+                                            ("02712345678", "Phone must start with '01'"),
+                                            ("01212345678", "3rd digit must be between 3 and 9")])
+def test_validate_phone(phone, message):
+    assert validate_phone_str(phone) == (message == "", message)
+
+
+def test_clean_record_strips_and_validates():
+    values, error = clean_record(record("  ada  "))
+    assert error is None and values[5] == "ada" and values[4] == "Blue Moon"
+    assert clean_record(record("ada", password=""))[1] == "Username and password cannot be empty."
+    assert clean_record(record("ada", phone="123"))[1] == "Phone must be exactly 11 digits"
+
+
+def test_import_skips_invalid_and_duplicate_users(db, hasher, make_user):
+    make_user("taken")
+    records = [record("ada"), record("bob", dob="bad"), record("ada"), record("taken"), record("cy")]
+    report = import_users(records, db=db, batch_size=2, hasher=hasher)
+    assert (report["read"], report["inserted"], report["invalid"], report["duplicates"]) == (5, 2, 1, 2)
+    assert report["errors"] == [{"record": 2, "error": "Invalid format — use dd/mm/yyyy"}]
+    with sqlite3.connect(db) as conn:
+        rows = conn.execute("SELECT id, password, code_word FROM users WHERE username IN ('ada', 'cy')").fetchall()
+    assert len({user_id for user_id, _, _ in rows}) == 2
+    assert all(verify_password("s3cret", pw) and verify_password("blue moon", cw) for _, pw, cw in rows)
+
+
+def test_dry_run_reports_the_same_counts_without_writing(db, hasher, make_user):
+    make_user("taken")
+    records = [record("ada"), record("taken"), record("ada"), record("cy", phone="")]
+    dry = import_users(records, db=db, dry_run=True, hasher=hasher)
+    with sqlite3.connect(db) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 1
+    real = import_users(records, db=db, hasher=hasher)
+    assert {k: dry[k] for k in ("inserted", "invalid", "duplicates")} == \
+           {k: real[k] for k in ("inserted", "invalid", "duplicates")} == {"inserted": 1, "invalid": 1, "duplicates": 2}
+
+
+def test_read_records_by_extension(tmp_path):
+    csv_path = tmp_path / "users.csv"
+    csv_path.write_text("first_name,username\nAda,ada\n", encoding="utf-8")
+    jsonl_path = tmp_path / "users.jsonl"
+    jsonl_path.write_text(json.dumps({"first_name": "Ada", "username": "ada"}) + "\n\n", encoding="utf-8")
+    assert list(read_records(str(csv_path))) == list(read_records(str(jsonl_path))) == \
+           [{"first_name": "Ada", "username": "ada"}]
@@ -0,0 +1,55 @@
+import pytest
+
+from card_secret import (BLOB_LEN, CARDS, FORMAT_V1, UNKNOWN, card_secret_from_text, decode_card_secret,
+                         encode_card_secret, stored_card_secret, verify_sequence)
+
+SELECTION = ["Joker", "Ace", "Heart", "Club", "Queen", "Spade", "King"]
+VALUES = dict(zip(CARDS, [3, 1, 4, 5, 9, 2, 6, 8, 7]))
+
+
+def test_round_trip():
+    blob = encode_card_secret(SELECTION, VALUES)
+    assert len(blob) == BLOB_LEN and blob[0] == FORMAT_V1
+    assert decode_card_secret(blob) == (SELECTION, VALUES)
+
+
+def test_missing_values_are_unknown():
+    blob = encode_card_secret(SELECTION, {"Spade": 3})
+    assert blob[1 + len(SELECTION):] == bytes([3] + [UNKNOWN] * (len(CARDS) - 1))
+    assert decode_card_secret(blob) == (SELECTION, {"Spade": 3})
+
+
+def test_wrong_length_selection_is_rejected():
+    with pytest.raises(ValueError):
+        encode_card_secret(SELECTION[:6], VALUES)
+
+
+def test_verify_sequence():
+    blob = encode_card_secret(SELECTION, VALUES)
+    assert verify_sequence(blob, SELECTION)
+    assert verify_sequence(blob, [" joker", "ACE ", "heart", "club", "queen", "spade", "king"])
+    assert not verify_sequence(blob, list(reversed(SELECTION)))
+    assert not verify_sequence(blob, SELECTION[:6])
+    assert not verify_sequence(blob, SELECTION[:6] + ["Bogus"])
+    assert not verify_sequence(None, SELECTION)
+    assert not verify_sequence(blob[:-1], SELECTION)
+
+
+def test_unknown_format_is_rejected():
+    blob = bytes([FORMAT_V1 + 1]) + encode_card_secret(SELECTION, VALUES)[1:]
+    with pytest.raises(ValueError):
+        decode_card_secret(blob)
+
+
+def test_legacy_text_conversion():
+    text = "Joker,Ace,Heart,Club,Queen,Spade,King | Spade:3, Heart:1, Diamond:x"
+    assert decode_card_secret(card_secret_from_text(text)) == (SELECTION, {"Spade": 3, "Heart": 1})
+    assert card_secret_from_text("Joker,Ace,Heart") is None
+    assert card_secret_from_text("") is None
+
+
+def test_stored_secret_falls_back_to_text():
+    blob = encode_card_secret(SELECTION, VALUES)
+    assert stored_card_secret({"card_secret": blob, "card_sequence": None}) == blob
+    fallback = stored_card_secret({"card_secret": None, "card_sequence": ",".join(SELECTION)})
+    assert verify_sequence(fallback, SELECTION)
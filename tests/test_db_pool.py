@@ -0,0 +1,94 @@
+import threading
+
+import pytest
+
+from db_pool import ConnectionPool, PoolExhausted, get_pool
+from migrations import run_migrations
+
+
+def in_thread(fn):
+    """Run fn on a new thread and return its result (or raise its exception)."""
+    out = {}
+
+    def target():
+        try:
+            out["result"] = fn()
+        except Exception as e:
+            out["error"] = e
+    t = threading.Thread(target=target)
+    t.start()
+    t.join()
+    if "error" in out:
+        raise out["error"]
+    return out["result"]
+
+
+def test_thread_keeps_its_connection(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "a.db"), size=2)
+    conn = pool.acquire()
+    assert pool.acquire() is conn
+    assert in_thread(pool.acquire) is not conn
+
+
+def test_exhausted_until_a_lease_is_released(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "a.db"), size=1)
+    conn = pool.acquire()
+    with pytest.raises(PoolExhausted):
+        in_thread(lambda: pool.acquire(timeout=0.05))
+    pool.release()
+    assert in_thread(lambda: pool.acquire(timeout=0.05)) is conn
+
+
+def test_thread_exit_gives_the_connection_back(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "a.db"), size=1)
+    in_thread(pool.acquire)
+    assert pool.stats() == {"size": 1, "created": 1, "idle": 1}
+
+
+def test_leased_releases_only_what_it_took(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "a.db"), size=1)
+    with pool.leased() as conn:
+        conn.execute("CREATE TABLE t (x)")
+        conn.execute("INSERT INTO t VALUES (1)")     # left open: rolled back on release
+    assert not pool.holds() and pool.stats()["idle"] == 1
+    held = pool.acquire()
+    assert held.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+    with pool.leased() as conn:
+        assert conn is held
+    assert pool.holds()
+
+
+def test_get_pool_grows_an_existing_pool(tmp_path):
+    path = str(tmp_path / "a.db")
+    pool = get_pool(path, size=2)
+    assert get_pool(path) is pool and pool.size == 2
+    assert get_pool(path, size=6).size == 6
+    assert get_pool(path, size=3).size == 6       # never shrinks
+
+
+def test_migrations_do_not_keep_a_lease(tmp_path):
+    path = str(tmp_path / "a.db")
+    run_migrations(path)
+    assert not get_pool(path).holds()
+
+
+def test_every_thread_gets_a_connection(tmp_path):
+    # the reviewer's case: the main thread has used the pool, then `size` workers lease one each
+    path = str(tmp_path / "a.db")
+    run_migrations(path)
+    pool = get_pool(path, size=8)
+    barrier = threading.Barrier(8)
+    errors = []
+
+    def work():
+        try:
+            pool.acquire(timeout=1).execute("SELECT 1")
+            barrier.wait(timeout=5)     # all eight hold a lease at once
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
@@ -0,0 +1,59 @@
+import threading
+import time
+
+import pytest
+
+import executors
+from executors import DB_IO, Overloaded, configure, get_executor, run_off_tk
+
+
+class FakeWidget:
+    """Runs after() callbacks when pump() is called, like a Tk event loop."""
+    def __init__(self):
+        self.pending = []
+
+    def after(self, ms, callback):
+        self.pending.append(callback)
+
+    def pump(self, timeout=5):
+        deadline = time.monotonic() + timeout
+        while self.pending and time.monotonic() < deadline:
+            self.pending.pop(0)()
+            time.sleep(0.001)
+
+
+@pytest.fixture
+def small_db_pool():
+    saved = dict(executors.DEFAULTS[DB_IO])
+    configure(DB_IO, workers=1, queue=0, submit_timeout=5)
+    yield get_executor(DB_IO)
+    executors.DEFAULTS[DB_IO] = saved
+    configure(DB_IO)
+
+
+def test_try_submit_refuses_at_once(small_db_pool):
+    gate = threading.Event()
+    running = small_db_pool.try_submit(gate.wait)
+    with pytest.raises(Overloaded):
+        small_db_pool.try_submit(lambda: None)
+    gate.set()
+    running.result(timeout=5)
+    assert small_db_pool.stats()["rejected"] == 1
+
+
+def test_run_off_tk_delivers_the_result(small_db_pool):
+    widget, results = FakeWidget(), []
+    assert run_off_tk(widget, lambda a, b=0: a + b, lambda result, error: results.append((result, error)), 2, b=3)
+    widget.pump()
+    assert results == [(5, None)]
+
+
+def test_run_off_tk_does_not_wait_when_overloaded(small_db_pool):
+    gate = threading.Event()
+    small_db_pool.try_submit(gate.wait)
+    called = []
+    started = time.perf_counter()
+    assert not run_off_tk(FakeWidget(), called.append, called.append, 1)
+    assert time.perf_counter() - started < 1        # submit() would have waited submit_timeout (5 s)
+    gate.set()
+    assert called == []
@@ -0,0 +1,89 @@
+import logging
+
+import pytest
+
+from auth_engine import AuthEngine
+from biometrics import SimulatedBackend
+from instrumentation import (HistogramExporter, LogExporter, PrometheusFileExporter, count, disable, enable,
+                             exporters_from_spec, histogram, observe, span)
+
+
+@pytest.fixture
+def hist():
+    exporter = HistogramExporter()
+    enable(exporter)
+    yield exporter
+    disable()
+
+
+def test_disabled_is_a_shared_no_op():
+    disable()
+    assert span("a") is span("b", x=1)
+    with span("a") as sp:
+        sp.set(status="ok")
+    count("c")
+    assert histogram() is None
+
+
+def test_spans_and_counters_are_aggregated(hist):
+    for _ in range(3):
+        with span("step", user="a") as sp:
+            sp.set(status="ok")
+    observe("step", 0.2, user="b")
+    count("results", status="ok")
+    count("results", 2, status="ok")
+    snapshot = hist.snapshot()
+    assert snapshot["spans"]["step"]["count"] == 4        # merged over labels
+    assert snapshot["spans"]["step"]["p99_ms"] == 250.0   # bucket upper bound
+    assert snapshot["counters"] == {"results{status=ok}": 3}
+
+
+def test_span_records_the_error(hist):
+    with pytest.raises(KeyError):
+        with span("boom"):
+            raise KeyError("x")
+    (name, labels), = hist.histograms
+    assert (name, labels) == ("boom", (("error", "KeyError"),))
+
+
+def test_log_exporter(caplog):
+    enable(LogExporter())
+    try:
+        with caplog.at_level(logging.INFO, logger="trisecure.trace"):
+            count("otp.results", status="ok")
+    finally:
+        disable()
+    assert caplog.messages == ["count otp.results +1 status=ok"]
+
+
+def test_prometheus_file(tmp_path):
+    path = tmp_path / "trisecure.prom"
+    exporter = PrometheusFileExporter(str(path), interval=0)
+    enable(exporter)
+    observe("db.load_user", 0.003)
+    count("auth.results", step="password", status="ok")
+    disable()       # closing writes the file
+    text = path.read_text()
+    assert 'trisecure_span_seconds_bucket{span="db.load_user",le="0.005"} 1' in text
+    assert 'trisecure_span_seconds_count{span="db.load_user"} 1' in text
+    assert 'trisecure_auth_results_total{status="ok",step="password"} 1' in text
+
+
+def test_exporters_from_spec(tmp_path):
+    exporters = exporters_from_spec(f"histogram, prometheus:{tmp_path / 'x.prom'}")
+    assert [type(e) for e in exporters] == [HistogramExporter, PrometheusFileExporter]
+    for exporter in exporters:
+        exporter.close()
+    with pytest.raises(ValueError):
+        exporters_from_spec("statsd")
+
+
+def test_login_steps_are_traced(hist, db, hasher, make_user):
+    make_user()
+    engine = AuthEngine(db, typing_check="wpm", biometric_backend=SimulatedBackend(), hasher=hasher)
+    flow = engine.start()
+    flow.submit_password("alice", "s3cret", [120, 95, 160], duration=3.0)
+    flow.submit_code_word("blue moon")
+    snapshot = hist.snapshot()
+    assert {"auth.password", "auth.code_word", "db.authenticate", "kdf.verify"} <= set(snapshot["spans"])
+    assert snapshot["counters"]["auth.results{status=ok,step=password}"] == 1
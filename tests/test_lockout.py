@@ -0,0 +1,129 @@
+import threading
+
+from lockout import (BAN_SECONDS, FAILS_PER_LOCK, MAX_FAILS_PER_USER, WINDOW_SECONDS, LockoutStore,
+                     SlidingWindow)
+
+
+def test_every_third_failure_locks_for_longer(db, clock):
+    store = LockoutStore(db, clock=clock)
+    locks = []
+    for _ in range(2 * FAILS_PER_LOCK):
+        result = store.record_failure("bob")
+        locks.append(result["locked_for"])
+    assert locks == [0, 0, 60, 0, 0, 120]
+    assert store.remaining("bob") == 120
+    allowed, retry_after, reason = store.check("bob")
+    assert not allowed and retry_after == 120 and reason == "locked"
+
+
+def test_third_lock_is_a_ban(db, clock):
+    store = LockoutStore(db, clock=clock)
+    for _ in range(3 * FAILS_PER_LOCK - 1):
+        assert not store.record_failure("bob")["banned"]
+    assert store.record_failure("bob")["banned"]
+    allowed, retry_after, reason = store.check("bob")
+    assert (allowed, reason) == (False, "banned")
+    assert retry_after == BAN_SECONDS
+
+
+def test_success_clears_counters_but_not_a_ban(db, clock):
+    store = LockoutStore(db, clock=clock)
+    store.record_failure("bob")
+    store.record_failure("bob")
+    store.record_success("bob")
+    assert store.record_failure("bob")["locked_for"] == 0     # counting starts again
+
+    for _ in range(3 * FAILS_PER_LOCK):
+        store.record_failure("eve")
+    store.record_success("eve")
+    assert store.check("eve")[2] == "banned"
+
+
+def test_lock_expires(db, clock):
+    store = LockoutStore(db, clock=clock)
+    store.lock("bob", 30)
+    assert store.remaining("bob") == 30
+    clock.advance(31)
+    assert store.remaining("bob") == 0
+    assert store.check("bob") == (True, 0, None)
+
+
+def test_concurrent_failures_are_all_counted(db):
+    store = LockoutStore(db)
+    threads = [threading.Thread(target=lambda: [store.record_failure("bob") for _ in range(5)]) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # 20 failures: two full lock-lock-ban cycles of 9, then 2 more
+    row = store._conn().execute("SELECT fail_count FROM lockouts WHERE username='bob'").fetchone()
+    assert row[0] == 20 % (3 * FAILS_PER_LOCK)
+
+
+def test_rate_limit_window(db, clock):
+    store = LockoutStore(db, clock=clock)
+    for _ in range(MAX_FAILS_PER_USER):
+        store.record_failure("bob", lockable=False)
+    allowed, retry_after, reason = store.check("bob")
+    assert (allowed, reason) == (False, "rate_limited")
+    assert retry_after == WINDOW_SECONDS
+    clock.advance(WINDOW_SECONDS)
+    assert store.check("bob")[0]
+
+
+def test_sliding_window_counts_only_recent_events(clock):
+    window = SlidingWindow(60, 3, clock)
+    window.hit("k")
+    clock.advance(30)
+    window.hit("k")
+    window.hit("k")
+    assert window.retry_after("k") == 30    # until the first hit leaves the window
+    clock.advance(30)
+    assert window.retry_after("k") == 0
+
+
+def test_sliding_window_is_bounded(clock):
+    window = SlidingWindow(60, 3, clock, max_keys=10)
+    for _ in range(100):
+        window.hit("busy")
+    assert len(window._events["busy"]) == 3
+    for i in range(50):
+        window.hit(f"user{i}")
+    assert len(window) == 10
+    clock.advance(61)
+    window.hit("late")
+    assert len(window) == 1     # idle keys are dropped once their window is over
+
+
+def test_lock_cache_is_bounded(db, clock):
+    store = LockoutStore(db, clock=clock, max_cached=5)
+    store.lock("bob", 30)
+    for i in range(20):
+        store.check(f"user{i}")
+    assert len(store._blocked) == 5
+    assert store.remaining("bob") == 30     # evicted, re-read from the lockouts table
+
+
+def test_success_without_counters_does_not_write(db, clock):
+    store = LockoutStore(db, clock=clock)
+    statements = []
+    store._conn().set_trace_callback(statements.append)
+    try:
+        store.record_success("alice")
+        store.record_success("alice")
+        assert not any(sql.startswith("DELETE") for sql in statements)
+        store.record_failure("alice")
+        store.record_success("alice")
+        assert sum(sql.startswith("DELETE") for sql in statements) == 1
+    finally:
+        store._conn().set_trace_callback(None)
+
+
+def test_failure_does_not_commit_the_callers_transaction(db, clock):
+    store = LockoutStore(db, clock=clock)
+    conn = store._conn()
+    conn.execute("INSERT INTO users (id, username) VALUES ('X', 'pending')")
+    store.record_failure("bob")
+    assert conn.in_transaction
+    conn.rollback()
+    assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0
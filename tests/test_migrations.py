@@ -0,0 +1,87 @@
+import sqlite3
+
+import pytest
+
+from card_secret import decode_card_secret
+from migrations import LATEST_VERSION, MIGRATIONS, run_migrations, schema_version
+from typing_store import decode_intervals
+
+
+def test_versions_are_consecutive_and_unique():
+    versions = [version for version, _, _ in MIGRATIONS]
+    assert versions == list(range(1, len(MIGRATIONS) + 1))
+    assert LATEST_VERSION == versions[-1]
+    assert len({name for _, name, _ in MIGRATIONS}) == len(MIGRATIONS)
+
+
+def test_fresh_database_applies_every_step_in_order(tmp_path):
+    path = str(tmp_path / "fresh.db")
+    report = run_migrations(path)
+    assert [step["version"] for step in report["applied"]] == [v for v, _, _ in MIGRATIONS]
+    assert (report["from"], report["to"]) == (0, LATEST_VERSION)
+    with sqlite3.connect(path) as conn:
+        assert schema_version(conn) == LATEST_VERSION
+
+
+def test_current_database_is_a_no_op(db):
+    report = run_migrations(db)
+    assert report["applied"] == [] and report["from"] == LATEST_VERSION
+
+
+def test_dry_run_rolls_back(tmp_path):
+    path = str(tmp_path / "dry.db")
+    report = run_migrations(path, dry_run=True)
+    assert report["to"] == LATEST_VERSION
+    with sqlite3.connect(path) as conn:
+        assert schema_version(conn) == 0
+        assert conn.execute("SELECT name FROM sqlite_master WHERE name='users'").fetchone() is None
+
+
+def legacy_database(path):
+    """A users table as the oldest builds created it, with text columns and plaintext secrets."""
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE users (id TEXT PRIMARY KEY, username TEXT UNIQUE, password TEXT, code_word TEXT,
+                            passkey TEXT, card_sequence TEXT, typing_wpm INTEGER, typing_intervals TEXT)
+    """)
+    conn.executemany("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?)", [
+        ("1", "alice", "s3cret", " Blue Moon ", "12345678",
+         "Joker,Ace,Heart,Club,Queen,Spade,King | Spade:3, Heart:1", 44, "120,98,143"),
+        ("2", "bob", "hunter2", "red", "12345678", None, None, None),
+    ])
+    conn.commit()
+    return conn
+
+
+def test_legacy_rows_are_upgraded_step_by_step(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    legacy_database(path).close()
+    assert run_migrations(path)["to"] == LATEST_VERSION
+
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    alice, bob = conn.execute("SELECT * FROM users ORDER BY id").fetchall()
+    # 3: text intervals packed as a blob
+    assert list(decode_intervals(alice["typing_intervals"])) == [120, 98, 143]
+    # 4: card_sequence text converted to the card_secret blob
+    sequence, values = decode_card_secret(alice["card_secret"])
+    assert sequence[0] == "Joker" and values == {"Spade": 3, "Heart": 1}
+    # 9: the first-login snapshot seeds a typing profile
+    profile = conn.execute("SELECT n, length, wpm FROM typing_profiles WHERE username='alice'").fetchone()
+    assert tuple(profile) == (1, 3, 44.0)
+    # 10: duplicate passkeys keep only the oldest row, and the index is now unique
+    assert (alice["passkey"], bob["passkey"]) == ("12345678", None)
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("UPDATE users SET passkey='12345678' WHERE id='2'")
+    # plaintext secrets are left alone: the next successful login hashes them
+    assert (alice["password"], alice["code_word"]) == ("s3cret", " Blue Moon ")
+    conn.close()
+
+
+def test_unique_passkey_step_runs_after_index_step(tmp_path):
+    # step 10 replaces the plain index created by step 2; running them in order must end unique
+    path = str(tmp_path / "order.db")
+    run_migrations(path)
+    with sqlite3.connect(path) as conn:
+        sql = conn.execute("SELECT sql FROM sqlite_master WHERE name='idx_users_passkey'").fetchone()[0]
+    assert sql.startswith("CREATE UNIQUE INDEX")
@@ -0,0 +1,88 @@
+import threading
+
+import pytest
+
+from otp_service import OTP_MAX_ATTEMPTS, MemoryOtpStore, OtpIssuer, OtpService, OtpVerifier, SqliteOtpStore, StubSink
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, clock):
+    if request.param == "memory":
+        return MemoryOtpStore(clock)
+    return SqliteOtpStore(request.getfixturevalue("db"), clock)
+
+
+@pytest.fixture
+def issuer(store, clock):
+    issuer = OtpIssuer(store, StubSink(), ttl=60, workers=1, clock=clock, purge_interval=10)
+    yield issuer
+    issuer.shutdown()
+
+
+def sent_code(issuer, phone, ticket):
+    ticket.delivery.result(timeout=5)
+    return issuer.transport.last(phone).rsplit(" ", 1)[1]
+
+
+def test_code_is_accepted_once(issuer, store):
+    ticket = issuer.issue("01712345678")
+    code = sent_code(issuer, "01712345678", ticket)
+    verifier = OtpVerifier(store)
+    assert verifier.verify(ticket.key, f" {code} ") == ("ok", OTP_MAX_ATTEMPTS)
+    assert verifier.verify(ticket.key, code)[0] == "expired"      # consumed
+
+
+def test_wrong_codes_run_out(issuer, store):
+    ticket = issuer.issue("01712345678")
+    code = sent_code(issuer, "01712345678", ticket)
+    wrong = "0000" if code != "0000" else "1111"
+    verifier = OtpVerifier(store)
+    assert verifier.verify(ticket.key, wrong) == ("wrong", 2)
+    assert verifier.verify(ticket.key, wrong) == ("wrong", 1)
+    assert verifier.verify(ticket.key, wrong) == ("locked", 0)
+    assert verifier.verify(ticket.key, code)[0] == "expired"      # the right code no longer helps
+
+
+def test_codes_expire_and_are_purged(issuer, store, clock):
+    ticket = issuer.issue("01712345678")
+    code = sent_code(issuer, "01712345678", ticket)
+    clock.advance(61)
+    assert OtpVerifier(store).verify(ticket.key, code) == ("expired", 0)
+    stale = issuer.issue("01799999999")
+    clock.advance(61)
+    issuer.issue("01799999999")         # the sweep on issue drops the expired code
+    assert store.purge() == 0 and store.get(stale.key) is None
+
+
+def test_second_code_does_not_replace_the_first(issuer, store):
+    first = issuer.issue("01712345678")
+    first_code = sent_code(issuer, "01712345678", first)
+    second = issuer.issue("01712345678")
+    second_code = sent_code(issuer, "01712345678", second)
+    verifier = OtpVerifier(store)
+    assert first.key != second.key
+    assert verifier.verify(first.key, first_code)[0] == "ok"
+    assert verifier.verify(second.key, second_code)[0] == "ok"
+
+
+def test_issue_does_not_wait_for_delivery(clock):
+    gate = threading.Event()
+
+    class SlowTransport:
+        def send(self, phone, message):
+            gate.wait(5)
+    issuer = OtpIssuer(MemoryOtpStore(clock), SlowTransport(), workers=1, clock=clock)
+    ticket = issuer.issue("01712345678")
+    assert not ticket.delivery.done()
+    gate.set()
+    issuer.shutdown()
+    assert ticket.delivery.done()
+
+
+def test_service_round_trip():
+    sink = StubSink()
+    service = OtpService(store=MemoryOtpStore(), transport=sink)
+    ticket = service.issue("01712345678")
+    ticket.delivery.result(timeout=5)
+    assert service.verify(ticket.key, sink.last("01712345678").rsplit(" ", 1)[1]) == ("ok", OTP_MAX_ATTEMPTS)
+    service.issuer.shutdown()
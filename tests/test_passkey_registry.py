@@ -0,0 +1,51 @@
+import random
+import sqlite3
+
+import pytest
+
+from db_pool import get_pool
+from passkey_registry import PasskeyExhausted, PasskeyRegistry
+
+
+class InOrder(random.Random):
+    """Tries the (position, digit) variants in their natural order."""
+    def shuffle(self, x):
+        x.sort()
+
+
+def claimer(db, username):
+    def claim(passkey):
+        conn = get_pool(db).acquire()
+        with conn:
+            conn.execute("UPDATE users SET passkey=? WHERE username=?", (passkey, username))
+    return claim
+
+
+def test_first_add_does_not_deadlock(db):
+    registry = PasskeyRegistry(db)
+    registry.add("12345678")
+    assert "12345678" in registry._bloom_filter()
+
+
+def test_stale_filter_falls_back_to_unique_index(db, make_user):
+    make_user("alice")
+    make_user("bob")
+    first, second = PasskeyRegistry(db), PasskeyRegistry(db)
+    first._bloom_filter()
+    second._bloom_filter()      # loaded before `first` claims anything: stale from then on
+    taken = first.reserve_unique("1234567", claimer(db, "alice"), InOrder())
+    passkey = second.reserve_unique("1234567", claimer(db, "bob"), InOrder())
+    assert passkey != taken and second.collisions == 1
+    with sqlite3.connect(db) as conn:
+        assert conn.execute("SELECT COUNT(DISTINCT passkey) FROM users").fetchone()[0] == 2
+
+
+def test_exhausted(db, make_user):
+    make_user("alice")
+    registry = PasskeyRegistry(db)
+
+    def refuse(passkey):
+        raise sqlite3.IntegrityError("UNIQUE constraint failed: users.passkey")
+
+    with pytest.raises(PasskeyExhausted):
+        registry.reserve_unique("1234567", refuse)
@@ -0,0 +1,67 @@
+import sqlite3
+
+import pytest
+
+from login_session import LoginSession
+from password_hashing import (MIN_COST, PBKDF2, SCRYPT, Hasher, hash_password, is_hashed, is_plaintext,
+                              normalize_code_word, parse, verify_password)
+
+
+@pytest.mark.parametrize("algorithm", [SCRYPT, PBKDF2])
+def test_hash_format_round_trip(algorithm):
+    stored = hash_password("s3cret", algorithm, MIN_COST[algorithm])
+    assert stored.startswith(algorithm + "$")
+    parsed_algorithm, cost, salt, digest = parse(stored)
+    assert (parsed_algorithm, cost, len(salt), len(digest)) == (algorithm, MIN_COST[algorithm], 16, 32)
+    assert verify_password("s3cret", stored)
+    assert not verify_password("s3cret!", stored)
+    assert hash_password("s3cret", algorithm, MIN_COST[algorithm]) != stored     # fresh salt
+
+
+def test_legacy_plaintext_fallback():
+    assert is_plaintext("hunter2") and is_plaintext("pa$$word") and is_plaintext("")
+    assert verify_password("hunter2", "hunter2")
+    assert verify_password("pa$$word", "pa$$word")
+    assert not verify_password("hunter", "hunter2")
+
+
+@pytest.mark.parametrize("stored", ["scrypt$broken", "scrypt$1024$8$1$AAAA", "pbkdf2_sha256$x$AAAA$AAAA",
+                                    "$2b$12$abcdefghijklmnopqrstuv", None])
+def test_malformed_hashes_never_match(stored):
+    assert not is_hashed(stored)
+    assert not is_plaintext(stored)
+    assert not verify_password(stored or "", stored)
+
+
+def test_cost_outside_bounds_is_rejected():
+    stored = hash_password("s3cret", PBKDF2, 1)
+    assert not verify_password("s3cret", stored)
+
+
+def test_verify_reports_rehash(hasher):
+    assert hasher.verify("s3cret", "s3cret") == (True, True)        # legacy plaintext
+    weak = hash_password("s3cret", hasher.algorithm, hasher.cost)
+    assert hasher.verify("s3cret", weak) == (True, False)
+    stronger = Hasher(hasher.algorithm, cost=hasher.cost * 2, executor=hasher.executor)
+    assert stronger.verify("s3cret", weak) == (True, True)
+    assert hasher.verify("wrong", weak) == (False, False)
+    assert hasher.verify("s3cret", None) == (False, False)          # missing user
+
+
+def test_code_words_are_normalized(hasher):
+    assert normalize_code_word("  Blue MOON ") == "blue moon"
+    stored = hasher.hash_code_word(" Blue Moon")
+    assert hasher.verify_code_word("blue moon  ", stored) == (True, False)
+    assert hasher.verify_code_word(" BLUE moon", " Blue Moon ") == (True, True)    # legacy plaintext
+    assert hasher.verify_code_word("blue moon", "scrypt$broken") == (False, False)
+
+
+def test_login_rehashes_legacy_password(db, hasher, make_user):
+    make_user(password="s3cret", plaintext=True)
+    session = LoginSession.authenticate("alice", "s3cret", db, hasher)
+    assert session is not None
+    with sqlite3.connect(db) as conn:
+        stored = conn.execute("SELECT password FROM users WHERE username='alice'").fetchone()[0]
+    assert is_hashed(stored) and verify_password("s3cret", stored)
+    assert LoginSession.authenticate("alice", "s3cret", db, hasher) is not None
+    assert LoginSession.authenticate("alice", "wrong", db, hasher) is None
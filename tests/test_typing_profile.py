@@ -0,0 +1,61 @@
+import statistics
+
+import pytest
+
+from db_pool import get_pool
+from typing_profile import ALPHA, MAX_POSITIONS, RING_SIZE, ProfileStore, TypingProfile, seed_typing_profiles
+from typing_store import encode_intervals
+
+SAMPLES = [[120, 100, 150], [130, 90, 160], [110, 105, 140], [125, 95, 155]]
+
+
+def test_running_stats_match_the_full_history():
+    profile = TypingProfile.start(SAMPLES[0], wpm=40)
+    for sample in SAMPLES[1:]:
+        profile.update(sample, wpm=44)
+    for i, column in enumerate(zip(*SAMPLES)):
+        assert profile.mean[i] == pytest.approx(statistics.fmean(column), rel=1e-5)
+        assert profile.var[i] == pytest.approx(statistics.pvariance(column), rel=1e-4)
+    assert profile.n == 4 and profile.wpm == pytest.approx(43.0)
+
+
+def test_old_logins_decay_once_n_passes_one_over_alpha():
+    profile = TypingProfile.start([100])
+    for _ in range(int(1 / ALPHA) * 5):
+        profile.update([200])
+    assert profile.weight() == ALPHA
+    assert profile.mean[0] == pytest.approx(200, abs=1)     # the plain average would still be below 200
+
+
+def test_ring_keeps_the_most_recent_samples():
+    profile = TypingProfile.start([0, 0])
+    for k in range(1, RING_SIZE + 3):
+        profile.update([k] if k % 2 else [k, k])        # short samples are padded, then unpadded
+    recent = profile.recent_samples()
+    assert len(recent) == RING_SIZE
+    assert recent[0] == [3] and recent[-1] == [RING_SIZE + 2, RING_SIZE + 2]
+
+
+def test_length_is_capped():
+    assert TypingProfile.start(list(range(MAX_POSITIONS + 10))).length == MAX_POSITIONS
+
+
+def test_store_round_trip(db):
+    store = ProfileStore(db)
+    assert store.load("alice") is None
+    first = store.record("alice", SAMPLES[0], wpm=40)
+    store.record("alice", SAMPLES[1], wpm=44, profile=first)
+    loaded = store.load("alice")
+    assert loaded.n == 2 and list(loaded.mean) == pytest.approx([125, 95, 155])
+    assert loaded.recent_samples() == SAMPLES[:2]
+
+
+def test_seed_from_first_login_snapshot(db, make_user):
+    make_user("alice", typing_intervals=encode_intervals([120, 98, 143]), typing_wpm=44)
+    make_user("bob")
+    conn = get_pool(db).acquire()
+    with conn:
+        assert seed_typing_profiles(conn) == 1
+        assert seed_typing_profiles(conn) == 0      # already seeded
+    profile = ProfileStore(db).load("alice")
+    assert (profile.n, list(profile.mean), profile.wpm) == (1, [120, 98, 143], 44.0)
@@ -0,0 +1,46 @@
+import sqlite3
+
+import pytest
+
+from typing_store import FORMAT_U16, MAX_INTERVAL_MS, decode_intervals, encode_intervals, load_intervals
+
+
+def test_round_trip():
+    intervals = [0, 1, 120, 98, 143, MAX_INTERVAL_MS]
+    blob = encode_intervals(intervals)
+    assert blob[0] == FORMAT_U16 and len(blob) == 1 + 2 * len(intervals)
+    assert list(decode_intervals(blob)) == intervals
+
+
+def test_values_are_clamped_to_uint16():
+    assert list(decode_intervals(encode_intervals([-5, 70000, 12.7]))) == [0, MAX_INTERVAL_MS, 12]
+
+
+def test_little_endian_layout():
+    assert encode_intervals([0x0102]) == bytes([FORMAT_U16, 0x02, 0x01])
+
+
+@pytest.mark.parametrize("stored, expected", [
+    ("120,98,143", [120, 98, 143]),
+    ("120, 98,,143,", [120, 98, 143]),
+    ("", []),
+    (None, []),
+    (b"", []),
+])
+def test_legacy_and_empty_values(stored, expected):
+    assert list(decode_intervals(stored)) == expected
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError):
+        decode_intervals(bytes([99, 1, 0]))
+
+
+def test_load_reads_blob_and_text_rows(db, make_user):
+    make_user("blob", typing_intervals=encode_intervals([10, 20]))
+    make_user("text", typing_intervals="30,40")
+    assert list(load_intervals("blob", db)) == [10, 20]
+    assert list(load_intervals("text", db)) == [30, 40]
+    assert list(load_intervals("nobody", db)) == []
+    with sqlite3.connect(db) as conn:
+        assert conn.execute("SELECT typeof(typing_intervals) FROM users WHERE username='blob'").fetchone()[0] == "blob"
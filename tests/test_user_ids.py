@@ -0,0 +1,33 @@
+import sqlite3
+
+from db_pool import get_pool
+from user_ids import ID_LENGTH, BlockSequence, FeistelIdGenerator
+
+
+def stored_next_value(db):
+    with sqlite3.connect(db) as conn:
+        row = conn.execute("SELECT next_value FROM id_sequence WHERE name='users'").fetchone()
+    return row and row[0]
+
+
+def test_blocks_are_reserved_once_per_block(db):
+    sequence = BlockSequence(db, block_size=10)
+    assert [sequence.next() for _ in range(12)] == list(range(12))
+    assert stored_next_value(db) == 20
+    assert BlockSequence(db, block_size=10).next() == 20     # another process starts after our blocks
+
+
+def test_ids_are_unique_and_fixed_width(db):
+    generator = FeistelIdGenerator(BlockSequence(db, block_size=50))
+    ids = [generator.next_id() for _ in range(500)]
+    assert len(set(ids)) == 500 and all(len(i) == ID_LENGTH for i in ids)
+
+
+def test_reserving_does_not_commit_the_callers_transaction(db):
+    conn = get_pool(db).acquire()
+    conn.execute("INSERT INTO users (id, username) VALUES ('X', 'pending')")
+    BlockSequence(db).next()
+    assert conn.in_transaction
+    conn.rollback()
+    with sqlite3.connect(db) as other:
+        assert other.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0
@@ -0,0 +1,206 @@
+import os
+import selectors
+import shutil
+import subprocess
+import sys
+import threading
+
+from instrumentation import span
+
+# ----------------------
+# Long-lived Touch ID helper process
+# ----------------------
+# Protocol (one line each way, UTF-8):
+#   helper -> "READY" once started
+#   "AUTH <reason>"  -> "SUCCESS" | "FAILED" | "UNAVAILABLE"
+#   "PING"           -> "PONG"
+#   "QUIT"           -> helper exits
+# The Swift helper is compiled once (swiftc) and reused across attempts, so the
+# prompt no longer waits for `swift touchid.swift` to be interpreted each time.
+
+CACHE_DIR = os.environ.get("TRISECURE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "trisecure"))
+DAEMON_SOURCE = os.path.join(CACHE_DIR, "touchid_daemon.swift")
+DAEMON_BINARY = os.path.join(CACHE_DIR, "touchid_daemon")
+FAKE_HELPER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_touchid_helper.py")
+
+# "auto" (Swift helper), "fake" (fake_touchid_helper.py) or an explicit command line
+HELPER = os.environ.get("TRISECURE_TOUCHID_HELPER", "auto")
+AUTH_TIMEOUT = 20
+START_TIMEOUT = 120     # first start may include compiling the helper
+
+TOUCH_ID_DAEMON_SWIFT = """
+import LocalAuthentication
+import Foundation
+
+setbuf(stdout, nil)
+print("READY")
+while let line = readLine() {
+    let parts = line.split(separator: " ", maxSplits: 1)
+    let cmd = parts.first.map(String.init) ?? ""
+    if cmd == "QUIT" { break }
+    if cmd == "PING" { print("PONG"); continue }
+    if cmd != "AUTH" { print("ERROR unknown command"); continue }
+    let reason = parts.count > 1 ? String(parts[1]) : "Authenticate with Touch ID"
+
+    let context = LAContext()
+    var error: NSError?
+    if !context.canEvaluatePolicy(.deviceOwnerAuthenticationWithBiometrics, error: &error) {
+        print("UNAVAILABLE")
+        continue
+    }
+    let done = DispatchSemaphore(value: 0)
+    var ok = false
+    context.evaluatePolicy(.deviceOwnerAuthenticationWithBiometrics, localizedReason: reason) { success, _ in
+        ok = success
+        done.signal()
+    }
+    done.wait()
+    print(ok ? "SUCCESS" : "FAILED")
+}
+"""
+
+
+class HelperUnavailable(Exception):
+    pass
+
+
+def _write_if_changed(path, content):
+    try:
+        with open(path) as f:
+            if f.read() == content:
+                return False
+    except OSError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+    return True
+
+
+def swift_helper_command():
+    """Build (once) and return the command for the Swift helper."""
+    if sys.platform != "darwin":
+        raise HelperUnavailable("Touch ID helper needs macOS")
+    changed = _write_if_changed(DAEMON_SOURCE, TOUCH_ID_DAEMON_SWIFT)
+    swiftc = shutil.which("swiftc")
+    if swiftc:
+        if changed or not os.path.exists(DAEMON_BINARY):
+            subprocess.run([swiftc, "-O", DAEMON_SOURCE, "-o", DAEMON_BINARY],
+                           check=True, capture_output=True, timeout=START_TIMEOUT)
+        return [DAEMON_BINARY]
+    swift = shutil.which("swift") or "/usr/bin/swift"
+    if os.path.exists(swift):
+        # no compiler: interpret once, still amortised over every attempt
+        return [swift, DAEMON_SOURCE]
+    raise HelperUnavailable("swift toolchain not found")
+
+
+def helper_command(helper=None):
+    helper = helper or HELPER
+    if helper == "auto":
+        return swift_helper_command()
+    if helper == "fake":
+        return [sys.executable, FAKE_HELPER]
+    return helper.split()
+
+
+class TouchIDHelper:
+    """Python client for the helper; starts it lazily and restarts it if it dies."""
+    def __init__(self, command=None):
+        self._command = command
+        self._proc = None
+        self._lock = threading.Lock()
+        self._cancelled = False
+
+    def _readline(self, timeout):
+        sel = selectors.DefaultSelector()
+        try:
+            sel.register(self._proc.stdout, selectors.EVENT_READ)
+            if not sel.select(timeout):
+                return None
+        finally:
+            sel.close()
+        line = self._proc.stdout.readline()
+        return line.strip() if line else None
+
+    def _ensure_started(self):
+        if self._proc is not None and self._proc.poll() is None:
+            return
+        with span("biometric.helper_start"):
+            command = self._command or helper_command()
+            self._proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                          stderr=subprocess.DEVNULL, text=True, bufsize=1)
+            if self._readline(START_TIMEOUT) != "READY":
+                self._kill()
+                raise HelperUnavailable("helper did not start")
+
+    def _kill(self):
+        if self._proc is not None:
+            try:
+                self._proc.kill()
+                self._proc.wait(timeout=5)
+            except Exception:
+                pass
+        self._proc = None
+
+    def request(self, line, timeout=AUTH_TIMEOUT):
+        with self._lock:
+            self._cancelled = False
+            self._ensure_started()
+            try:
+                self._proc.stdin.write(line + "\n")
+                self._proc.stdin.flush()
+            except (BrokenPipeError, OSError):
+                self._kill()
+                raise HelperUnavailable("helper exited")
+            with span("biometric.helper_request") as sp:
+                reply = self._readline(timeout)
+                sp.set(reply=reply or "TIMEOUT")
+            if reply is None:
+                # no answer in time (or cancel() killed it): the helper state is unknown, start fresh next time
+                self._kill()
+                return "CANCELLED" if self._cancelled else "TIMEOUT"
+            return reply
+
+    def cancel(self):
+        """
+        Abort the request in progress, from any thread. The helper is killed,
+        which also dismisses the system prompt; the next request starts a new one.
+        """
+        proc = self._proc
+        if proc is not None and self._lock.locked():
+            self._cancelled = True
+            try:
+                proc.kill()
+            except OSError:
+                pass
+
+    def authenticate(self, reason="Authenticate with Touch ID", timeout=AUTH_TIMEOUT):
+        """Returns "SUCCESS", "FAILED", "UNAVAILABLE", "TIMEOUT" or "CANCELLED"."""
+        try:
+            return self.request("AUTH " + reason.replace("\n", " "), timeout)
+        except (HelperUnavailable, subprocess.SubprocessError, OSError):
+            return "UNAVAILABLE"
+
+    def close(self):
+        with self._lock:
+            if self._proc is not None and self._proc.poll() is None:
+                try:
+                    self._proc.stdin.write("QUIT\n")
+                    self._proc.stdin.flush()
+                    self._proc.wait(timeout=2)
+                except Exception:
+                    pass
+            self._kill()
+
+
+_helper = None
+_helper_lock = threading.Lock()
+
+
+def get_helper():
+    global _helper
+    with _helper_lock:
+        if _helper is None:
+            _helper = TouchIDHelper()
+    return _helper
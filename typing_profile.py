@@ -0,0 +1,178 @@
+import math
+import os
+import sys
+import time
+from array import array
+
+from db_pool import DB, get_pool
+from instrumentation import span
+from typing_store import MAX_INTERVAL_MS, decode_intervals
+
+# ----------------------
+# Rolling typing profile (typing_profiles table)
+# ----------------------
+# Per user and per inter-key position: running mean and variance of the interval,
+# updated in O(length) per accepted login without reading any history. The update
+# weight is 1/n (exact Welford mean/variance) until n reaches 1/ALPHA, then stays
+# at ALPHA, so older logins decay exponentially and the profile follows the user.
+# The last RING_SIZE samples are kept as uint16 rows in a ring buffer for re-training.
+#
+# Blob layouts (little-endian):
+#   mean, var   float32 per position
+#   ring        RING_SIZE rows x length uint16, MISSING where a sample was shorter
+
+ALPHA = float(os.environ.get("TRISECURE_PROFILE_ALPHA", "0.1"))
+RING_SIZE = 16
+MAX_POSITIONS = 64
+MISSING = 0xFFFF
+
+
+def _pack(values):
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _unpack(typecode, raw):
+    values = array(typecode)
+    values.frombytes(bytes(raw))
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+class TypingProfile:
+    def __init__(self, length, n=0, wpm=None, mean=None, var=None, ring=None, ring_head=0, ring_count=0):
+        self.length = length
+        self.n = n
+        self.wpm = wpm
+        self.mean = mean if mean is not None else array("f", bytes(4 * length))
+        self.var = var if var is not None else array("f", bytes(4 * length))
+        self.ring = ring if ring is not None else array("H", [MISSING]) * (RING_SIZE * length)
+        self.ring_head = ring_head
+        self.ring_count = ring_count
+
+    @classmethod
+    def start(cls, intervals, wpm=None):
+        """A new profile whose first sample is `intervals` (length capped at MAX_POSITIONS)."""
+        profile = cls(min(len(intervals), MAX_POSITIONS))
+        profile.update(intervals, wpm)
+        return profile
+
+    def weight(self):
+        return max(1.0 / self.n, ALPHA)
+
+    def update(self, intervals, wpm=None):
+        """Fold one accepted sample into the statistics and the ring buffer."""
+        self.n += 1
+        w = self.weight()
+        mean, var = self.mean, self.var
+        for i, x in enumerate(intervals[:self.length]):
+            delta = x - mean[i]
+            mean[i] += w * delta
+            var[i] = (1.0 - w) * (var[i] + w * delta * delta)
+        if wpm is not None:
+            self.wpm = wpm if self.wpm is None else self.wpm + w * (wpm - self.wpm)
+        # overwrite the oldest ring row in place
+        row = array("H", (min(max(int(x), 0), MAX_INTERVAL_MS - 1) for x in intervals[:self.length]))
+        row.extend([MISSING] * (self.length - len(row)))
+        start = self.ring_head * self.length
+        self.ring[start:start + self.length] = row
+        self.ring_head = (self.ring_head + 1) % RING_SIZE
+        self.ring_count = min(self.ring_count + 1, RING_SIZE)
+
+    def std(self):
+        return [math.sqrt(v) if v > 0 else 0.0 for v in self.var]
+
+    def recent_samples(self):
+        """Buffered samples, oldest first, without the MISSING padding."""
+        out = []
+        first = (self.ring_head - self.ring_count) % RING_SIZE
+        for k in range(self.ring_count):
+            start = ((first + k) % RING_SIZE) * self.length
+            out.append([v for v in self.ring[start:start + self.length] if v != MISSING])
+        return out
+
+    def template(self):
+        """KeystrokeTemplate for the scorer (needs NumPy)."""
+        from keystroke_scorer import KeystrokeTemplate
+        return KeystrokeTemplate(self.mean, self.std(), self.n)
+
+    # --- row conversion ---
+    def to_params(self, username):
+        return (username, self.n, self.length, self.wpm, _pack(self.mean), _pack(self.var),
+                _pack(self.ring), self.ring_head, self.ring_count, time.time())
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row["length"], row["n"], row["wpm"], _unpack("f", row["mean"]), _unpack("f", row["var"]),
+                   _unpack("H", row["ring"]), row["ring_head"], row["ring_count"])
+
+
+UPSERT_SQL = """
+    INSERT INTO typing_profiles (username, n, length, wpm, mean, var, ring, ring_head, ring_count, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(username) DO UPDATE SET
+        n=excluded.n, length=excluded.length, wpm=excluded.wpm, mean=excluded.mean, var=excluded.var,
+        ring=excluded.ring, ring_head=excluded.ring_head, ring_count=excluded.ring_count,
+        updated_at=excluded.updated_at
+"""
+
+
+class ProfileStore:
+    def __init__(self, db=DB):
+        self.db = db
+
+    def load(self, username):
+        with span("db.load_profile"):
+            row = get_pool(self.db).acquire().execute(
+                "SELECT * FROM typing_profiles WHERE username=?", (username,)).fetchone()
+        return TypingProfile.from_row(row) if row else None
+
+    def save(self, username, profile):
+        conn = get_pool(self.db).acquire()
+        with span("db.save_profile"), conn:
+            conn.execute(UPSERT_SQL, profile.to_params(username))
+
+    def record(self, username, intervals, wpm=None, profile=None):
+        """Add an accepted login. Pass the profile already loaded during the login to skip the read."""
+        if profile is None:
+            profile = self.load(username)
+        if profile is None:
+            profile = TypingProfile.start(intervals, wpm)
+        else:
+            profile.update(intervals, wpm)
+        self.save(username, profile)
+        return profile
+
+
+def seed_typing_profiles(conn):
+    """Start a profile for every user that only has the first-login snapshot. Returns rows seeded."""
+    rows = conn.execute("""
+        SELECT u.username, u.typing_intervals, u.typing_wpm FROM users u
+        WHERE u.typing_intervals IS NOT NULL AND u.username IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM typing_profiles p WHERE p.username = u.username)
+    """).fetchall()
+    params = []
+    for username, stored, wpm in rows:
+        intervals = decode_intervals(stored)
+        if not intervals:
+            continue
+        try:
+            wpm = float(wpm) if wpm else None
+        except (TypeError, ValueError):
+            wpm = None
+        params.append(TypingProfile.start(intervals, wpm).to_params(username))
+    conn.executemany(UPSERT_SQL, params)
+    return len(params)
+
+
+_stores = {}
+
+
+def get_profile_store(db=DB):
+    store = _stores.get(db)
+    if store is None:
+        store = _stores.setdefault(db, ProfileStore(db))
+    return store
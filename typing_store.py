@@ -0,0 +1,46 @@
+import sys
+from array import array
+
+from db_pool import DB, get_pool
+
+# ----------------------
+# Compact typing_intervals storage
+# ----------------------
+# Intervals are stored in the typing_intervals column as a BLOB:
+#   1 format byte + little-endian uint16 milliseconds (array('H')).
+# Old rows hold comma-joined text ("120,98,143"); the read path accepts both.
+FORMAT_U16 = 1
+MAX_INTERVAL_MS = 0xFFFF
+
+
+def encode_intervals(intervals):
+    values = array("H", (min(max(int(i), 0), MAX_INTERVAL_MS) for i in intervals))
+    if sys.byteorder != "little":
+        values.byteswap()
+    return bytes([FORMAT_U16]) + values.tobytes()
+
+
+def decode_intervals(value):
+    """Return the stored intervals as array('H'), whatever format the column holds."""
+    if value is None:
+        return array("H")
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        raw = bytes(value)
+        if not raw:
+            return array("H")
+        if raw[0] != FORMAT_U16:
+            raise ValueError(f"unknown typing_intervals format {raw[0]}")
+        values = array("H")
+        values.frombytes(raw[1:])
+        if sys.byteorder != "little":
+            values.byteswap()
+        return values
+    # legacy comma-joined text
+    return array("H", (min(max(int(p), 0), MAX_INTERVAL_MS) for p in str(value).split(",") if p.strip()))
+
+
+def load_intervals(username, db=DB):
+    """Read API: one user's stored intervals as array('H') (empty if none)."""
+    conn = get_pool(db).acquire()
+    row = conn.execute("SELECT typing_intervals FROM users WHERE username=?", (username,)).fetchone()
+    return decode_intervals(row[0]) if row else array("H")
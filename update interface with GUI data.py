@@ -9,6 +9,11 @@ import string
 import customtkinter as ctk
 from tkinter import messagebox, simpledialog
 
+from password_hashing import get_hasher
+from migrations import run_migrations
+from user_ids import next_user_id
+from validators import validate_dob_str, validate_phone_str
+
 DB = "users.db"
 
 def connect_db():
@@ -51,45 +56,9 @@ def add_missing_columns():
 ctk.set_appearance_mode("System")
 ctk.set_default_color_theme("blue")
 
-# Helper functions used by GUI, re-using the same validation rules as backend:
-def validate_dob_str(dob_str):
-    
-    try:
-        parsed = datetime.strptime(dob_str, "%d/%m/%Y")
-    except ValueError:
-        return False, "Invalid format — use dd/mm/yyyy"
-    day, month, year = parsed.day, parsed.month, parsed.year
-    if not (1 <= day <= 31):
-        return False, "Day must be between 1 and 31"
-    if not (1 <= month <= 12):
-        return False, "Month must be between 1 and 12"
-    if year > 2025:
-        return False, "Year cannot be greater than 2025"
-    return True, ""
-
-def validate_phone_str(phone):
-    
-    if not phone:
-        return False, "Phone number required"
-    if not phone.isdigit():
-        return False, "Phone must contain digits only"
-    if len(phone) != 11:
-        return False, "Phone must be exactly 11 digits"
-    if not phone.startswith("01"):
-        return False, "Phone must start with '01'"
-    if phone[2] not in "3456789":
-        return False, "3rd digit must be between 3 and 9"
-    return True, ""
-
 def generate_unique_user_id():
-    """Generate a 7-character alphanumeric ID and ensure uniqueness in DB."""
-    with connect_db() as conn:
-        cur = conn.cursor()
-        while True:
-            user_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=7))
-            cur.execute("SELECT 1 FROM users WHERE id=?", (user_id,))
-            if not cur.fetchone():
-                return user_id
+    """Generate a 7-character alphanumeric ID (unique by construction, no DB lookup)."""
+    return next_user_id(DB)
 
 # OTP 
 def gui_otp_flow(phone):
@@ -116,6 +85,9 @@ def gui_otp_flow(phone):
 
 # Database insert 
 def insert_user_to_db(user_id, first_name, last_name, dob, phone, code_word, username, password):
+    hasher = get_hasher()
+    password_hash = hasher.hash(password)
+    code_word_hash = hasher.hash_code_word(code_word)
     with connect_db() as conn:
         cur = conn.cursor()
         cur.execute("SELECT 1 FROM users WHERE username=?", (username,))
@@ -125,15 +97,24 @@ def insert_user_to_db(user_id, first_name, last_name, dob, phone, code_word, use
             INSERT INTO users (
                 id, first_name, last_name, dob, phone, code_word, username, password, created_at
             ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (user_id, first_name, last_name, dob, phone, code_word, username, password, int(time.time())))
+        """, (user_id, first_name, last_name, dob, phone, code_word_hash, username, password_hash, int(time.time())))
         conn.commit()
     return True, None
 
 def check_login_credentials(username, password):
     with connect_db() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT * FROM users WHERE username=? AND password=?", (username, password))
-        return cur.fetchone()
+        cur.execute("SELECT * FROM users WHERE username=?", (username,))
+        row = cur.fetchone()
+        hasher = get_hasher()
+        matches, rehash = hasher.verify(password, row["password"] if row else None)
+        if not matches:
+            return None
+        if rehash:
+            # legacy plaintext row: store the hash now that we know the password
+            cur.execute("UPDATE users SET password=? WHERE username=?", (hasher.hash(password), username))
+            conn.commit()
+        return row
 
 # GUI Layout Classes ---
 class App(ctk.CTk):
@@ -145,6 +126,8 @@ class App(ctk.CTk):
         # init DB
         init_db()
         add_missing_columns()
+        # shared schema (id_sequence for user IDs, indexes) comes from the numbered migrations
+        run_migrations(DB)
 
         # container frames
         self.frames = {}
@@ -332,13 +315,18 @@ class LoginFrame(ctk.CTkFrame):
                 self.password_entry.delete(0, "end")
                 return
         # credentials ok -> ask security question (3 attempts)
-        code_word_stored = (row["code_word"] or "").strip().lower()
+        hasher = get_hasher()
         for i in range(3):
             ans = simpledialog.askstring("Security Question", "What is your code word? (Recovery)")
             if ans is None:
                 # cancelled
                 return
-            if ans.strip().lower() == code_word_stored:
+            matches, rehash = hasher.verify_code_word(ans, row["code_word"])
+            if matches:
+                if rehash:
+                    with connect_db() as conn:
+                        conn.execute("UPDATE users SET code_word=? WHERE username=?",
+                                     (hasher.hash_code_word(ans), row["username"]))
                 # success
                 self.attempts_left = 3
                 # show welcome
@@ -0,0 +1,150 @@
+import hashlib
+import os
+import random
+import secrets
+import string
+import threading
+
+from db_pool import DB, get_pool, write_transaction
+
+ID_ALPHABET = string.ascii_uppercase + string.digits
+ID_LENGTH = 7
+ID_SPACE = len(ID_ALPHABET) ** ID_LENGTH   # 36^7 possible IDs
+
+# which generator next_user_id() uses: "feistel" (default) or "random"
+ID_GENERATOR = os.environ.get("TRISECURE_ID_GENERATOR", "feistel")
+BLOCK_SIZE = 1000
+
+
+def encode_id(n):
+    """Fixed-width base-36 encoding using the same A-Z0-9 alphabet as the old random IDs."""
+    chars = []
+    for _ in range(ID_LENGTH):
+        n, r = divmod(n, len(ID_ALPHABET))
+        chars.append(ID_ALPHABET[r])
+    return "".join(reversed(chars))
+
+
+class BlockSequence:
+    """
+    Monotonic counter persisted in id_sequence (created by migration 5). A whole
+    block of values is reserved per DB write, so most next() calls never touch the DB.
+    """
+    def __init__(self, db=DB, name="users", block_size=BLOCK_SIZE):
+        self.db = db
+        self.name = name
+        self.block_size = block_size
+        self.key = None
+        self._next = 0
+        self._limit = 0
+        self._lock = threading.Lock()
+
+    def _reserve_block(self):
+        conn = get_pool(self.db).acquire()
+        # BEGIN IMMEDIATE so two processes cannot reserve the same block; inside a caller's
+        # open transaction (e.g. a registration INSERT) a savepoint, so it is not committed here
+        with write_transaction(conn, "reserve_block"):
+            row = conn.execute("SELECT next_value, key FROM id_sequence WHERE name=?", (self.name,)).fetchone()
+            if row is None:
+                start, key = 0, secrets.token_hex(16)
+                conn.execute("INSERT INTO id_sequence (name, next_value, key) VALUES (?, ?, ?)",
+                             (self.name, self.block_size, key))
+            else:
+                start, key = row["next_value"], row["key"]
+                conn.execute("UPDATE id_sequence SET next_value=? WHERE name=?",
+                             (start + self.block_size, self.name))
+        self.key = key
+        self._next, self._limit = start, start + self.block_size
+
+    def next(self):
+        with self._lock:
+            if self._next >= self._limit:
+                self._reserve_block()
+            value = self._next
+            self._next += 1
+            return value
+
+    def ensure_key(self):
+        with self._lock:
+            if self.key is None:
+                self._reserve_block()
+            return self.key
+
+
+class FeistelIdGenerator:
+    """
+    Counter -> keyed Feistel permutation -> 7-char ID.
+    A permutation never maps two counters to the same ID, so IDs are unique
+    without checking the table, yet they do not look sequential.
+    """
+    HALF_BITS = 19          # 2^38 > 36^7, so cycle-walking needs few extra rounds
+    ROUNDS = 4
+
+    def __init__(self, sequence=None, key=None):
+        self.sequence = sequence or BlockSequence()
+        self._key = key
+
+    def _round_key(self):
+        if self._key is None:
+            self._key = self.sequence.ensure_key()
+        return self._key.encode()
+
+    def _permute_once(self, x, key):
+        mask = (1 << self.HALF_BITS) - 1
+        left, right = x >> self.HALF_BITS, x & mask
+        for r in range(self.ROUNDS):
+            digest = hashlib.blake2b(right.to_bytes(4, "little"), digest_size=4,
+                                     key=key, salt=r.to_bytes(16, "little")).digest()
+            left, right = right, left ^ (int.from_bytes(digest, "little") & mask)
+        return (left << self.HALF_BITS) | right
+
+    def permute(self, n):
+        if not 0 <= n < ID_SPACE:
+            raise ValueError("ID space exhausted")
+        key = self._round_key()
+        x = self._permute_once(n, key)
+        # cycle-walk until the value falls inside 36^7
+        while x >= ID_SPACE:
+            x = self._permute_once(x, key)
+        return x
+
+    def next_id(self):
+        return encode_id(self.permute(self.sequence.next()))
+
+
+class RandomIdGenerator:
+    """The original scheme: random 7-char IDs, checked against the users table."""
+    def __init__(self, db=DB):
+        self.db = db
+
+    def next_id(self):
+        conn = get_pool(self.db).acquire()
+        while True:
+            user_id = "".join(random.choices(ID_ALPHABET, k=ID_LENGTH))
+            if not conn.execute("SELECT 1 FROM users WHERE id=?", (user_id,)).fetchone():
+                return user_id
+
+
+GENERATORS = {
+    "feistel": lambda db: FeistelIdGenerator(BlockSequence(db)),
+    "random": RandomIdGenerator,
+}
+
+_generators = {}
+_generators_lock = threading.Lock()
+
+
+def get_id_generator(db=DB, scheme=None):
+    scheme = scheme or ID_GENERATOR
+    key = (db, scheme)
+    with _generators_lock:
+        gen = _generators.get(key)
+        if gen is None:
+            if scheme not in GENERATORS:
+                raise ValueError(f"unknown ID generator: {scheme}")
+            gen = _generators[key] = GENERATORS[scheme](db)
+    return gen
+
+
+def next_user_id(db=DB):
+    return get_id_generator(db).next_id()
@@ -0,0 +1,35 @@
+from datetime import datetime
+
+# ----------------------
+# Registration field validation (same rules as the GUI register pages)
+# ----------------------
+MAX_DOB_YEAR = 2025
+
+
+def validate_dob_str(dob_str):
+    try:
+        parsed = datetime.strptime(dob_str, "%d/%m/%Y")
+    except (TypeError, ValueError):
+        return False, "Invalid format — use dd/mm/yyyy"
+    day, month, year = parsed.day, parsed.month, parsed.year
+    if not (1 <= day <= 31):
+        return False, "Day must be between 1 and 31"
+    if not (1 <= month <= 12):
+        return False, "Month must be between 1 and 12"
+    if year > MAX_DOB_YEAR:
+        return False, f"Year cannot be greater than {MAX_DOB_YEAR}"
+    return True, ""
+
+
+def validate_phone_str(phone):
+    if not phone:
+        return False, "Phone number required"
+    if not phone.isdigit():
+        return False, "Phone must contain digits only"
+    if len(phone) != 11:
+        return False, "Phone must be exactly 11 digits"
+    if not phone.startswith("01"):
+        return False, "Phone must start with '01'"
+    if phone[2] not in "3456789":
+        return False, "3rd digit must be between 3 and 9"
+    return True, ""